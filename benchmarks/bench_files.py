@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.bench_images import measure
+from vk_community.app import index_files
+
+FILES_COUNTS = [1000, 10000, 100000]
+LOOKUPS_COUNT = 100
+ALBUMS_COUNT = 20
+
+
+def generate_files(path: str, files_count: int) -> List[str]:
+    """Creates empty files laid out like photos files, returns their names"""
+    files_names = list()
+    for ind in range(files_count):
+        file_dir = os.path.join(path, 'album {}'.format(ind % ALBUMS_COUNT),
+                                str(2010 + ind % 7), str(ind % 12 + 1))
+        os.makedirs(file_dir, exist_ok=True)
+        file_name = '-129836227_{}.jpg'.format(ind)
+        open(os.path.join(file_dir, file_name), mode='w').close()
+        files_names.append(file_name)
+    return files_names
+
+
+def list_files(path: str) -> List[str]:
+    return [os.path.join(root, file_name)
+            for root, _, files in os.walk(path)
+            for file_name in files
+            if file_name.endswith('.jpg')]
+
+
+def find_file_path(files_paths: List[str], file_name: str) -> str:
+    # matching of photo against flat list of files paths
+    return next((file_path
+                 for file_path in files_paths
+                 if os.path.basename(file_path) == file_name), None)
+
+
+def bench_files_matching(files_count: int, repeats: int,
+                         lookups_count: int = LOOKUPS_COUNT) -> Dict[str, Any]:
+    path = tempfile.mkdtemp()
+    try:
+        files_names = generate_files(path, files_count)
+        step = max(files_count // lookups_count, 1)
+        looked_up_names = files_names[::step][:lookups_count]
+        files_paths = list_files(path)
+        files_paths_by_names = index_files(path)
+
+        results = dict(listing=measure(lambda: list_files(path), repeats),
+                       indexing=measure(lambda: index_files(path), repeats),
+                       scan_lookups=measure(
+                           lambda: [find_file_path(files_paths, file_name)
+                                    for file_name in looked_up_names], repeats),
+                       index_lookups=measure(
+                           lambda: [files_paths_by_names.get(file_name)
+                                    for file_name in looked_up_names], repeats))
+    finally:
+        shutil.rmtree(path)
+    for key in ['scan_lookups', 'index_lookups']:
+        result = results[key]
+        result['lookup_latency'] = result['mean_latency'] / len(looked_up_names)
+        # estimate of matching of all files (one photo per file)
+        result['total_latency'] = result['lookup_latency'] * files_count
+    return dict(files_count=files_count, **results)
+
+
+def run_benchmarks(repeats: int = 3, files_counts: List[int] = None) -> List[Dict[str, Any]]:
+    return [bench_files_matching(files_count, repeats=repeats)
+            for files_count in files_counts or FILES_COUNTS]
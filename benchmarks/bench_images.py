@@ -0,0 +1,195 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import PIL
+import numpy as np
+from PIL import Image
+
+from vk_community.services.images import alpha_composite, mark_images, paste_watermark
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+BACKGROUNDS = {'light': (220, 220, 220),
+               'dark': (30, 30, 30)}
+WATERMARK_LENGTH = 512
+
+
+def generate_image(size: Tuple[int, int], color: Tuple[int, int, int],
+                   seed: int = 0) -> Image.Image:
+    """Returns image of given color with horizontal gradient of red channel and noise
+
+    Images used by tests and benchmarks are generated by this function,
+    so they don't diverge.
+
+    :param seed: distinguishes noise of images of same size
+    """
+    width, height = size
+    image_array = np.empty((height, width, 3), dtype=np.uint8)
+    image_array[...] = color
+    # add gradient and noise to avoid uniform images
+    image_array[..., 0] = np.arange(width, dtype=np.uint8)
+    noise = np.random.RandomState(width * height + seed).randint(0, 20,
+                                                                 size=image_array.shape)
+    image_array = np.clip(image_array + noise - 10, 0, 255).astype(np.uint8)
+    return Image.fromarray(image_array, mode='RGB')
+
+
+def generate_watermark(length: int) -> Image.Image:
+    watermark_array = np.zeros((length, length, 4), dtype=np.uint8)
+    watermark_array[..., :3] = 200
+    watermark_array[..., 3] = np.linspace(0, 255, length, dtype=np.uint8)
+    return Image.fromarray(watermark_array, mode='RGBA')
+
+
+def get_peak_rss() -> int:
+    """Returns peak resident set size of current process in bytes"""
+    # `ru_maxrss` is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() != 'Darwin':
+        peak_rss *= 1024
+    return peak_rss
+
+
+def measure(function: Callable[[], Any], repeats: int) -> Dict[str, Any]:
+    """Times `repeats` runs of function and then traces memory of one more run
+
+    Tracing slows down allocations, so traced run isn't timed.
+    """
+    latencies = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(repeats=repeats,
+                min_latency=min(latencies),
+                mean_latency=sum(latencies) / len(latencies),
+                max_latency=max(latencies),
+                throughput=len(latencies) / sum(latencies),
+                peak_traced_bytes=peak_traced)
+
+
+def bench_alpha_composite(size: Tuple[int, int], color: Tuple[int, int, int],
+                          repeats: int) -> Dict[str, Any]:
+    image_array = np.array(generate_image(size, color).convert('RGBA'))
+    foreground_array = np.zeros_like(image_array)
+    height, width = image_array.shape[:2]
+    foreground_array[height // 2:, :width // 4] = 128
+    return measure(lambda: alpha_composite(foreground_array, image_array), repeats)
+
+
+def bench_paste_watermark(size: Tuple[int, int], color: Tuple[int, int, int],
+                          repeats: int) -> Dict[str, Any]:
+    image = generate_image(size, color).convert('RGBA')
+    watermark = generate_watermark(WATERMARK_LENGTH)
+    return measure(lambda: paste_watermark(image, watermark), repeats)
+
+
+def bench_mark_images(size: Tuple[int, int], color: Tuple[int, int, int],
+                      repeats: int, images_count: int = 4,
+                      workers: int = 1) -> Dict[str, Any]:
+    images_path = tempfile.mkdtemp()
+    try:
+        for ind in range(images_count):
+            image = generate_image(size, color, seed=ind)
+            image.save(os.path.join(images_path, '{}.jpg'.format(ind)))
+        watermark = generate_watermark(WATERMARK_LENGTH)
+
+        def mark():
+            mark_images(images_path, watermark, workers=workers, manifest=False)
+            for file_name in os.listdir(images_path):
+                if not file_name.endswith('.jpg'):
+                    os.remove(os.path.join(images_path, file_name))
+
+        result = measure(mark, repeats)
+    finally:
+        shutil.rmtree(images_path)
+    # latencies are per run, but per image ones are more comparable
+    for key in ['min_latency', 'mean_latency', 'max_latency']:
+        result[key] /= images_count
+    result['throughput'] *= images_count
+    result['images_count'] = images_count
+    result['workers'] = workers
+    return result
+
+
+BENCHMARKS = {'alpha_composite': bench_alpha_composite,
+              'paste_watermark': bench_paste_watermark,
+              'mark_images': bench_mark_images}
+
+
+def run_benchmark(connection, benchmark: str, size: Tuple[int, int],
+                  color: Tuple[int, int, int], repeats: int):
+    """Sends result of benchmark with peak RSS of process by `connection`"""
+    result = BENCHMARKS[benchmark](size, color, repeats=repeats)
+    result['peak_rss_bytes'] = get_peak_rss()
+    connection.send(result)
+    connection.close()
+
+
+def run_isolated_benchmark(benchmark: str, size: Tuple[int, int],
+                           color: Tuple[int, int, int], repeats: int) -> Dict[str, Any]:
+    """Runs benchmark in new process
+
+    Peak RSS of process never decreases, so every benchmark
+    gets its own process not to report peaks of previous ones.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    # process isn't daemonic, so benchmark can start workers processes
+    process = context.Process(target=run_benchmark,
+                              args=(sender, benchmark, size, color, repeats))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    finally:
+        receiver.close()
+        process.join()
+    if result is None:
+        err_description = ('Process of benchmark "{benchmark}" exited with code {code}.'
+                           .format(benchmark=benchmark, code=process.exitcode))
+        raise RuntimeError(err_description)
+    return result
+
+
+def run_benchmarks(repeats: int = 3,
+                   resolutions: List[Tuple[int, int]] = None,
+                   benchmarks: List[str] = None) -> Dict[str, Any]:
+    resolutions = resolutions or RESOLUTIONS
+    benchmarks = benchmarks or list(BENCHMARKS)
+    results = list()
+    for benchmark in benchmarks:
+        for size in resolutions:
+            for background, color in BACKGROUNDS.items():
+                result = run_isolated_benchmark(benchmark, size, color, repeats)
+                result.update(benchmark=benchmark,
+                              width=size[0],
+                              height=size[1],
+                              background=background)
+                results.append(result)
+    environment = dict(python=platform.python_version(),
+                       numpy=np.__version__,
+                       pillow=getattr(PIL, '__version__', None) or PIL.PILLOW_VERSION,
+                       machine=platform.machine(),
+                       cpu_count=os.cpu_count())
+    return dict(environment=environment, results=results)
+
+
+def save_results(results: Dict[str, Any], file_path: str):
+    with open(file_path, mode='w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
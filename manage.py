@@ -1,8 +1,23 @@
+import time
 import unittest
 
 import click
-from tests.test_app import IntegrationTestsApp
+from benchmarks import bench_files
+from benchmarks.bench_images import BENCHMARKS, run_benchmarks, save_results
+from tests.test_api_cache import UnitTestsApiCache, IntegrationTestsApiCache
+from tests.test_app import (IntegrationTestsApp, IntegrationTestsAlbumsLoading,
+                            IntegrationTestsSynchronization, IntegrationTestsPostsDeletion,
+                            IntegrationTestsAttachmentsReloading, IntegrationTestsPhotosPosting,
+                            UnitTestsFilesSynchronization)
 from tests.test_data_access import UnitTestsDataAccess, UnitTestsExceptionsDataAccess, IntegrationTestsDataAccess
+from tests.test_downloads import IntegrationTestsDownloads
+from tests.test_execute import UnitTestsExecute, IntegrationTestsExecute
+from tests.test_images import UnitTestsImages, IntegrationTestsImages
+from tests.test_scheduler import UnitTestsScheduler, IntegrationTestsScheduler
+from tests.test_uploads import UnitTestsUploads, IntegrationTestsUploads
+from vk_community.services.api_cache import ResponseCache
+from vk_community.services.data_access import DataAccessObject, check_filters, DATE_FORMATS_BY_PERIODS
+from vk_community.services.snapshots import export_photos, import_photos, SNAPSHOT_CHUNK_SIZE
 
 
 @click.group(name='test', invoke_without_command=False)
@@ -26,6 +41,205 @@ def test_app():
     """Tests implemented app methods"""
     suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsApp)
     unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsAlbumsLoading)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsSynchronization)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsPostsDeletion)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(UnitTestsFilesSynchronization)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsAttachmentsReloading)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsPhotosPosting)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='test_images')
+def test_images():
+    """Tests implemented images processing"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(UnitTestsImages)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsImages)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='test_execute')
+def test_execute():
+    """Tests batching of API calls by "execute" method"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(UnitTestsExecute)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsExecute)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='test_downloads')
+def test_downloads():
+    """Tests parallel downloading of files"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsDownloads)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='test_scheduler')
+def test_scheduler():
+    """Tests scheduling of API calls"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(UnitTestsScheduler)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsScheduler)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='test_api_cache')
+def test_api_cache():
+    """Tests caching of API responses"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(UnitTestsApiCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsApiCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='test_uploads')
+def test_uploads():
+    """Tests streaming uploads of files"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(UnitTestsUploads)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestsUploads)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@test.command(name='migrate_dao')
+@click.argument('database_url')
+def migrate_data_access(database_url: str):
+    """Adds missing columns and indexes to existing database tables"""
+    dao = DataAccessObject(database_url)
+    dao.migrate()
+
+
+@test.command(name='photos_stats')
+@click.argument('database_url')
+@click.option('--album', '-a', 'albums', multiple=True, help='Album to count photos of.')
+@click.option('--posted', '-p', type=click.Choice(['0', '1']),
+              help='Count only unposted (0) or posted (1) photos.')
+@click.option('--start-datetime', type=int, help='Start of date range as UNIX timestamp.')
+@click.option('--end-datetime', type=int, help='End of date range as UNIX timestamp.')
+@click.option('--period', default='day', type=click.Choice(list(DATE_FORMATS_BY_PERIODS)),
+              help='Period of dates histogram.')
+def photos_stats(database_url: str, albums, posted: str,
+                 start_datetime: int, end_datetime: int, period: str):
+    """Prints statistics of photos computed by database"""
+    filters = dict(albums=list(albums) or None,
+                   posted=posted,
+                   start_datetime=start_datetime,
+                   end_datetime=end_datetime)
+    check_filters(filters)
+    dao = DataAccessObject(database_url)
+    with dao:
+        counts_by_posted = dao.count_photos_by_posted(**filters)
+        counts_by_albums = dao.count_photos_by_albums(**filters)
+        counts_by_dates = dao.count_photos_by_dates(period=period, **filters)
+    click.echo('Total: {}'.format(sum(counts_by_posted.values())))
+    click.echo('Unposted: {unposted}, posted: {posted}'
+               .format(unposted=counts_by_posted[False],
+                       posted=counts_by_posted[True]))
+    click.echo('By albums:')
+    for album, count in counts_by_albums.items():
+        click.echo('  {album}: {count}'.format(album=album, count=count))
+    click.echo('By {period}s:'.format(period=period))
+    for date, count in counts_by_dates.items():
+        click.echo('  {date}: {count}'.format(date=date, count=count))
+
+
+@test.command(name='api_cache_stats')
+@click.argument('cache_path')
+def api_cache_stats(cache_path: str):
+    """Prints cached responses of API methods"""
+    cache = ResponseCache(cache_path)
+    cache_info = cache.cache_info()
+    click.echo('Responses: {count}, size: {size}/{max_size} bytes'
+               .format(count=cache_info.entries_count,
+                       size=cache_info.size,
+                       max_size=cache_info.max_size))
+    now = time.time()
+    for entry in cache.get_entries():
+        click.echo('  {method} {params}: {size} bytes, age: {age:.0f}s, '
+                   '{expiration}'
+                   .format(method=entry.method,
+                           params=entry.params,
+                           size=entry.size,
+                           age=now - entry.created,
+                           expiration=('expires in {:.0f}s'.format(entry.expires - now)
+                                       if entry.expires > now else 'expired')))
+
+
+@test.command(name='clear_api_cache')
+@click.argument('cache_path')
+@click.option('--method', '-m', 'methods', multiple=True,
+              help='API method to remove responses of, all responses are removed by default.')
+def clear_api_cache(cache_path: str, methods):
+    """Removes cached responses of API methods"""
+    cache = ResponseCache(cache_path)
+    removed_count = cache.clear(list(methods) or None)
+    click.echo('Removed responses: {}'.format(removed_count))
+
+
+@test.command(name='export_photos')
+@click.argument('database_url')
+@click.argument('file_path')
+@click.option('--chunk-size', default=SNAPSHOT_CHUNK_SIZE,
+              help='Number of photos read from database at once.')
+def export_photos_snapshot(database_url: str, file_path: str, chunk_size: int):
+    """Writes photos table to ".npz", ".parquet", ".csv.gz" or ".csv" file"""
+    dao = DataAccessObject(database_url)
+    photos_count = export_photos(dao, file_path, chunk_size=chunk_size)
+    click.echo('Exported {count} photos to {file_path}'.format(count=photos_count,
+                                                               file_path=file_path))
+
+
+@test.command(name='import_photos')
+@click.argument('database_url')
+@click.argument('file_path')
+def import_photos_snapshot(database_url: str, file_path: str):
+    """Inserts photos from file written by "export_photos" command"""
+    dao = DataAccessObject(database_url)
+    photos_count = import_photos(dao, file_path)
+    click.echo('Imported {count} photos from {file_path}'.format(count=photos_count,
+                                                                 file_path=file_path))
+
+
+@test.command(name='bench_images')
+@click.option('--output', '-o', default='bench_images.json',
+              help='Path of JSON file to save results to.')
+@click.option('--repeats', '-r', default=3, help='Number of runs of each benchmark.')
+@click.option('--benchmark', '-b', 'benchmarks', multiple=True,
+              type=click.Choice(sorted(BENCHMARKS)),
+              help='Benchmark to run, all benchmarks are run by default.')
+def bench_images(output: str, repeats: int, benchmarks):
+    """Benchmarks images processing"""
+    results = run_benchmarks(repeats=repeats, benchmarks=list(benchmarks))
+    for result in results['results']:
+        click.echo('{benchmark} {width}x{height} {background}: '
+                   '{mean_latency:.4f}s per image, {throughput:.2f} images/s, '
+                   'peak RSS {peak_rss_bytes} bytes'.format(**result))
+    save_results(results, output)
+
+
+@test.command(name='bench_files')
+@click.option('--output', '-o', default='bench_files.json',
+              help='Path of JSON file to save results to.')
+@click.option('--repeats', '-r', default=3, help='Number of runs of each benchmark.')
+@click.option('--files-count', '-n', 'files_counts', multiple=True, type=int,
+              help='Number of synthetic photos files, '
+                   'by default benchmarks are run for 1k, 10k and 100k files.')
+def bench_files_matching(output: str, repeats: int, files_counts):
+    """Benchmarks matching of photos with their files"""
+    results = bench_files.run_benchmarks(repeats=repeats, files_counts=list(files_counts))
+    for result in results:
+        click.echo('{files_count} files: indexing {indexing[mean_latency]:.4f}s, '
+                   'lookup by index {index_lookups[lookup_latency]:.2e}s, '
+                   'lookup by scan {scan_lookups[lookup_latency]:.2e}s '
+                   '(estimate for all files: {scan_lookups[total_latency]:.2f}s)'
+                   .format(**result))
+    save_results(dict(results=results), output)
 
 
 if __name__ == '__main__':
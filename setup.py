@@ -2,7 +2,7 @@ from setuptools import setup, find_packages
 
 setup(name='VKCommunity',
       version='0.1.2',
-      packages=find_packages(exclude=['tests']),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       url='https://github.com/lycantropos/VKCommunity',
       license='GNU GPL',
       author='lycantropos',
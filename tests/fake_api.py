@@ -0,0 +1,311 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+
+METHOD_PATH_PREFIX = '/method/'
+CALL_CODE_PATTERN = re.compile(r'API\.(?P<method>[\w.]+)\(')
+DISPOSITION_PATTERN = re.compile(r'name="(?P<field_name>[^"]*)"; filename="(?P<file_name>[^"]*)"')
+BODY_CHUNK_SIZE = 64 * 1024
+# "One of the parameters specified was missing or invalid"
+DEFAULT_ERROR_CODE = 100
+TOO_MANY_REQUESTS_ERROR_CODE = 6
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalServer:
+    """HTTP server on free local port serving requests in background thread"""
+
+    def __init__(self, request_handler_cls: type):
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), request_handler_cls)
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.http_server.server_address
+        return 'http://{host}:{port}'.format(host=host, port=port)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.thread.join()
+
+    def __enter__(self) -> 'LocalServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class FakeApiServer(LocalServer):
+    """Local HTTP server imitating VK API
+
+    Methods are implemented by handlers taking parameters dictionary
+    and returning response or raising `ValueError` for VK API error,
+    "execute" method evaluates API calls of VKScript code
+    in form of "return [API.method({...}), ...];".
+    Requests exceeding `calls_per_second` within last second
+    get "Too many requests per second" error.
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 calls_per_second: int = None):
+        self.handlers = handlers
+        self.calls_per_second = calls_per_second
+        # names of methods in order of HTTP requests
+        self.requests = list()  # type: List[str]
+        # times of requests which aren't rejected by rate limit
+        self.calls_times = deque()
+        self.rate_limit_errors_count = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                self.respond(url.path, dict(parse_qsl(url.query)))
+
+            def do_POST(self):
+                content_length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(content_length).decode('utf-8')
+                self.respond(urlparse(self.path).path, dict(parse_qsl(body)))
+
+            def respond(self, path: str, params: Dict[str, Any]):
+                method = path[len(METHOD_PATH_PREFIX):]
+                with server.lock:
+                    server.requests.append(method)
+                    rate_limit_exceeded = server.check_rate_limit()
+                try:
+                    if rate_limit_exceeded:
+                        raise ApiError('Too many requests per second',
+                                       code=TOO_MANY_REQUESTS_ERROR_CODE)
+                    response = dict(response=server.call(method, params))
+                except ValueError as err:
+                    response = dict(error=dict(error_code=getattr(err, 'code',
+                                                                  DEFAULT_ERROR_CODE),
+                                               error_msg=str(err)))
+                content = json.dumps(response).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(RequestHandler)
+
+    def check_rate_limit(self) -> bool:
+        """Returns whether request exceeds rate limit"""
+        if self.calls_per_second is None:
+            return False
+        now = time.monotonic()
+        while self.calls_times and now - self.calls_times[0] >= 1.:
+            self.calls_times.popleft()
+        if len(self.calls_times) >= self.calls_per_second:
+            self.rate_limit_errors_count += 1
+            return True
+        self.calls_times.append(now)
+        return False
+
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == 'execute':
+            return self.execute(params['code'])
+        try:
+            handler = self.handlers[method]
+        except KeyError:
+            raise ValueError('Unknown method: {}'.format(method))
+        return handler(params)
+
+    def execute(self, code: str) -> List[Any]:
+        decoder = json.JSONDecoder()
+        results = list()
+        position = 0
+        while True:
+            match = CALL_CODE_PATTERN.search(code, position)
+            if match is None:
+                return results
+            params, position = decoder.raw_decode(code, match.end())
+            try:
+                results.append(self.call(match.group('method'), params))
+            except ValueError:
+                # failed calls of "execute" return `false`
+                results.append(False)
+
+
+class ApiError(ValueError):
+    """VK API error with its code"""
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = DEFAULT_ERROR_CODE if code is None else code
+
+
+class FakeFilesServer(LocalServer):
+    """Local HTTP server of files contents with keep-alive connections
+
+    Requests of paths from `failures` get "503 Service Unavailable" response
+    given number of times, requests of unknown paths get "404 Not Found" one.
+    """
+
+    def __init__(self, files: Dict[str, bytes], failures: Dict[str, int] = None,
+                 delay: float = 0.):
+        self.files = files
+        self.failures = dict(failures or {})
+        self.delay = delay
+        # requested paths in order of requests
+        self.requests = list()  # type: List[str]
+        # addresses of clients, every connection has its own one
+        self.connections = set()
+        self.active_requests_count = self.max_active_requests_count = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                with server.lock:
+                    server.requests.append(path)
+                    server.connections.add(self.client_address)
+                    server.active_requests_count += 1
+                    server.max_active_requests_count = max(
+                        server.max_active_requests_count, server.active_requests_count)
+                    failures_count = server.failures.get(path, 0)
+                    if failures_count:
+                        server.failures[path] = failures_count - 1
+                try:
+                    time.sleep(server.delay)
+                    if failures_count:
+                        self.respond(503, b'')
+                    elif path in server.files:
+                        self.respond(200, server.files[path])
+                    else:
+                        self.respond(404, b'')
+                finally:
+                    with server.lock:
+                        server.active_requests_count -= 1
+
+            def respond(self, status: int, content: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(RequestHandler)
+
+
+class FakeUploadServer(LocalServer):
+    """Local HTTP server imitating VK upload server
+
+    Bodies of requests are written by chunks to files in `path`,
+    so server doesn't hold uploaded files in memory,
+    response contains path of body file
+    to pass it to method saving uploaded files.
+    """
+
+    def __init__(self, path: str, delay: float = 0.):
+        self.path = path
+        self.delay = delay
+        # pairs of "Content-Type" header and path of body file in order of requests
+        self.requests = list()  # type: List[Tuple[str, str]]
+        self.active_requests_count = self.max_active_requests_count = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                with server.lock:
+                    body_path = os.path.join(server.path,
+                                             '{}.body'.format(len(server.requests)))
+                    server.requests.append((self.headers['Content-Type'], body_path))
+                    server.active_requests_count += 1
+                    server.max_active_requests_count = max(
+                        server.max_active_requests_count, server.active_requests_count)
+                try:
+                    remaining = int(self.headers['Content-Length'])
+                    with open(body_path, mode='wb') as body_file:
+                        while remaining:
+                            chunk = self.rfile.read(min(remaining, BODY_CHUNK_SIZE))
+                            if not chunk:
+                                break
+                            body_file.write(chunk)
+                            remaining -= len(chunk)
+                    time.sleep(server.delay)
+                    content = json.dumps(dict(body=body_path)).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                finally:
+                    with server.lock:
+                        server.active_requests_count -= 1
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(RequestHandler)
+
+
+def parse_multipart(content_type: str, body_path: str) -> List[Tuple[str, str, bytes]]:
+    """Returns triplets of field name, file name and content of file"""
+    boundary = content_type.split('boundary=', 1)[1].encode('utf-8')
+    with open(body_path, mode='rb') as body_file:
+        body = body_file.read()
+    files = list()
+    for part in body.split(b'--' + boundary)[1:-1]:
+        headers, content = part.split(b'\r\n\r\n', 1)
+        disposition = DISPOSITION_PATTERN.search(headers.decode('utf-8'))
+        files.append((disposition.group('field_name'), disposition.group('file_name'),
+                      content[:-len(b'\r\n')]))
+    return files
+
+
+class ApiSession:
+    """Minimal client of VK API with interface of `vk_app` sessions"""
+
+    def __init__(self, url: str, method: str = ''):
+        self.url = url
+        self.method = method
+
+    def __getattr__(self, name: str) -> 'ApiSession':
+        method = '.'.join(filter(None, [self.method, name]))
+        return ApiSession(self.url, method)
+
+    def __call__(self, *args, **params) -> Any:
+        method, = args or [self.method]
+        response = requests.post(self.url + METHOD_PATH_PREFIX + method, data=params).json()
+        if 'error' in response:
+            raise ApiError(response['error']['error_msg'], code=response['error']['error_code'])
+        return response['response']
+
+
+def paging_handler(items: List[Any]) -> Callable[[Dict[str, Any]], Any]:
+    def handler(params: Dict[str, Any]) -> Dict[str, Any]:
+        offset = int(params.get('offset', 0))
+        count = int(params.get('count', 20))
+        return dict(count=len(items), items=items[offset:offset + count])
+
+    return handler
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tests.fake_api import FakeApiServer, paging_handler
+from tests.test_app import create_app
+from vk_community.services.api_cache import ResponseCache
+
+
+class UnitTestsApiCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.path, 'api_cache.db')
+        self.ttls = {'groups.getById': 60, 'photos.getAlbums': 0.2}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get_or_load(self):
+        cache = ResponseCache(self.cache_path, ttls=self.ttls)
+        loads = list()
+
+        def load_group() -> list:
+            loads.append('groups.getById')
+            return [dict(id=1, screen_name='club')]
+
+        params = dict(group_id=1, fields='screen_name')
+        for _ in range(3):
+            self.assertListEqual(cache.get_or_load('groups.getById', params, load_group),
+                                 [dict(id=1, screen_name='club')])
+        self.assertEqual(len(loads), 1)
+        cache_info = cache.cache_info()
+        self.assertTupleEqual((cache_info.hits, cache_info.misses, cache_info.entries_count),
+                              (2, 1, 1))
+        # responses are shared by caches with same file
+        self.assertListEqual(ResponseCache(self.cache_path, ttls=self.ttls)
+                             .get('groups.getById', params),
+                             [dict(id=1, screen_name='club')])
+        self.assertIsNone(cache.get('groups.getById', dict(group_id=2)))
+
+        # methods out of allow-list aren't cached
+        cache.put('wall.get', dict(owner_id=-1), [1, 2])
+        self.assertIsNone(cache.get('wall.get', dict(owner_id=-1)))
+        self.assertEqual(cache.cache_info().entries_count, 1)
+
+    def test_ttls(self):
+        cache = ResponseCache(self.cache_path, ttls=self.ttls)
+        cache.put('groups.getById', dict(group_id=1), [dict(id=1)])
+        cache.put('photos.getAlbums', dict(owner_id=-1), [dict(id=2)])
+        self.assertListEqual(cache.get('photos.getAlbums', dict(owner_id=-1)), [dict(id=2)])
+        time.sleep(0.25)
+        self.assertIsNone(cache.get('photos.getAlbums', dict(owner_id=-1)))
+        self.assertListEqual(cache.get('groups.getById', dict(group_id=1)), [dict(id=1)])
+        # expired responses are evicted on saving of new ones
+        cache.put('groups.getById', dict(group_id=2), [dict(id=2)])
+        self.assertListEqual([entry.method for entry in cache.get_entries()],
+                             ['groups.getById'] * 2)
+
+    def test_size_limit(self):
+        response = ['x' * 100]
+        response_size = len('["{}"]'.format(response[0]))
+        cache = ResponseCache(self.cache_path, ttls=self.ttls, max_size=3 * response_size)
+        for group_id in range(3):
+            cache.put('groups.getById', dict(group_id=group_id), response)
+            time.sleep(0.01)
+        # first response becomes most recently used
+        self.assertIsNotNone(cache.get('groups.getById', dict(group_id=0)))
+        cache.put('groups.getById', dict(group_id=3), response)
+        self.assertListEqual([entry.params['group_id'] for entry in cache.get_entries()],
+                             [0, 2, 3])
+        self.assertEqual(cache.cache_info().size, 3 * response_size)
+        # responses exceeding size limit aren't cached
+        cache.put('groups.getById', dict(group_id=4), response * 4)
+        self.assertIsNone(cache.get('groups.getById', dict(group_id=4)))
+
+    def test_clear(self):
+        cache = ResponseCache(self.cache_path, ttls=self.ttls)
+        cache.put('groups.getById', dict(group_id=1), [dict(id=1)])
+        cache.put('photos.getAlbums', dict(owner_id=-1), [dict(id=2)])
+        cache.put('photos.getAlbums', dict(owner_id=-2), [dict(id=3)])
+        self.assertEqual(cache.clear(['photos.getAlbums']), 2)
+        self.assertEqual(cache.cache_info().entries_count, 1)
+        self.assertEqual(cache.clear(), 1)
+        self.assertEqual(cache.get_entries(), [])
+
+
+class IntegrationTestsApiCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.owner_id = -129836227
+        self.albums = [dict(id=ind, owner_id=self.owner_id, title='album {}'.format(ind))
+                       for ind in range(1, 3)]
+        self.server = FakeApiServer({'photos.getAlbums': paging_handler(self.albums),
+                                     'photos.get': paging_handler([])})
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def test_get_albums(self):
+        cache_path = os.path.join(self.path, 'api_cache.db')
+        for _ in range(2):
+            # every app is like short-lived worker process
+            app = create_app(self.server.url, group_id=-self.owner_id,
+                             api_cache=ResponseCache(cache_path))
+            self.assertListEqual(app.get_albums(owner_id=self.owner_id), self.albums)
+        self.assertListEqual(self.server.requests, ['execute'])
+
+        app = create_app(self.server.url, group_id=-self.owner_id)
+        self.assertListEqual(app.get_albums(owner_id=self.owner_id), self.albums)
+        self.assertListEqual(self.server.requests, ['execute'] * 2)
@@ -1,5 +1,10 @@
 import datetime
+import math
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 from sqlalchemy.engine.url import make_url
@@ -7,9 +12,27 @@ from sqlalchemy_utils import create_database
 from sqlalchemy_utils import database_exists
 from sqlalchemy_utils import drop_database
 
-from vk_community.app import CommunityApp
-from vk_community.models import Photo
+from tests.fake_api import (ApiSession, FakeApiServer, FakeUploadServer, paging_handler,
+                            parse_multipart)
+from tests.test_data_access import make_photo
+from vk_community.app import (CommunityApp, index_files, load_albums,
+                              synchronize_photo_file, WALL_ALBUM_ID)
+from vk_community.models import Photo, Post
+from vk_community.services.api_cache import ResponseCache
 from vk_community.services.data_access import DataAccessObject
+from vk_community.services.scheduler import ApiScheduler, ScheduledApiSession
+
+
+def create_app(api_url: str, group_id: int, dao: DataAccessObject = None,
+               api_cache: ResponseCache = None) -> CommunityApp:
+    """Returns app working with fake API without authorization"""
+    app = CommunityApp.__new__(CommunityApp)
+    app.group_id = group_id
+    app.scheduler = ApiScheduler(calls_per_second=100)
+    app.api_session = ScheduledApiSession(ApiSession(api_url), app.scheduler)
+    app.api_cache = api_cache
+    app.dao = dao
+    return app
 
 
 class IntegrationTestsApp(unittest.TestCase):
@@ -51,12 +74,7 @@ class IntegrationTestsApp(unittest.TestCase):
 
     def setUp(self):
         Photo.__table__.create(bind=self.app.dao.engine)
-        self.photos = [
-            Photo(owner_id=-129836227, object_id=431928280, album_id=-7, album='wall',
-                  date_time=datetime.datetime(2016, 9, 30, 23, 55, 7), user_id=100,
-                  text=None,
-                  link='http://cs638122.vk.me/v638122248/1c41/SnfoaFP-Hfk.jpg')
-        ]
+        self.photos = [make_photo(0)]
 
     def tearDown(self):
         Photo.__table__.drop(bind=self.app.dao.engine)
@@ -95,3 +113,481 @@ class IntegrationTestsApp(unittest.TestCase):
                             for old_photo_path in old_photos_paths))
         self.assertTrue(all(os.path.exists(new_photo_path)
                             for new_photo_path in new_photos_paths))
+
+
+class IntegrationTestsAlbumsLoading(unittest.TestCase):
+    def setUp(self):
+        self.albums = [dict(id=ind, title='album {}'.format(ind)) for ind in range(6)]
+        self.raw_photos = [dict(id=ind, owner_id=-129836227, album_id=ind % 6,
+                                date=1475279707 + ind, text=None,
+                                photo_604='http://cs638122.vk.me/{}.jpg'.format(ind))
+                           for ind in range(30)]
+        self.failed_album_id = 2
+        self.calls_times = list()
+        self.active_calls_count = self.max_active_calls_count = 0
+        lock = threading.Lock()
+
+        def get_photos(params):
+            with lock:
+                self.calls_times.append(time.monotonic())
+                self.active_calls_count += 1
+                self.max_active_calls_count = max(self.max_active_calls_count,
+                                                  self.active_calls_count)
+            try:
+                time.sleep(0.1)
+                album_id = int(params['album_id'])
+                if album_id == self.failed_album_id:
+                    raise ValueError('Access denied')
+                return paging_handler([raw_photo for raw_photo in self.raw_photos
+                                       if raw_photo['album_id'] == album_id])(params)
+            finally:
+                with lock:
+                    self.active_calls_count -= 1
+
+        self.server = FakeApiServer({'photos.get': get_photos})
+        self.server.start()
+        self.api_session = ApiSession(self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_load_albums(self):
+        scheduler = ApiScheduler(calls_per_second=50)
+        api_session = ScheduledApiSession(self.api_session, scheduler)
+        albums_photos = load_albums(api_session, self.albums, workers=3,
+                                    owner_id=-129836227, album_id='shared')
+        self.assertListEqual([album_photos.album_id for album_photos in albums_photos],
+                             [album['id'] for album in self.albums])
+        for album, album_photos in zip(self.albums, albums_photos):
+            self.assertGreater(album_photos.duration, 0)
+            if album['id'] == self.failed_album_id:
+                self.assertIsInstance(album_photos.error, RuntimeError)
+                self.assertListEqual(album_photos.photos, [])
+                continue
+            self.assertIsNone(album_photos.error)
+            self.assertListEqual([photo.object_id for photo in album_photos.photos],
+                                 [raw_photo['id'] for raw_photo in self.raw_photos
+                                  if raw_photo['album_id'] == album['id']])
+            self.assertTrue(all(photo.album == album['title']
+                                for photo in album_photos.photos))
+        self.assertGreater(self.max_active_calls_count, 1)
+        self.assertLessEqual(self.max_active_calls_count, 3)
+        # requests are spaced out by scheduler
+        self.assertGreaterEqual(max(self.calls_times) - min(self.calls_times),
+                                (len(self.albums) - 1) / scheduler.calls_per_second * 0.9)
+        self.assertEqual(scheduler.get_metrics().calls_count, len(self.server.requests))
+
+
+class IntegrationTestsSynchronization(unittest.TestCase):
+    def setUp(self):
+        self.owner_id = -129836227
+        self.albums = [dict(id=ind, owner_id=self.owner_id, title='album {}'.format(ind))
+                       for ind in range(1, 3)]
+        # photos of albums are ordered from oldest to newest
+        self.albums_raw_photos = [self.generate_raw_photo(ind, album_id=ind % 2 + 1)
+                                  for ind in range(250)]
+        # posts are ordered from newest to oldest
+        self.raw_posts = [self.generate_raw_post(ind) for ind in reversed(range(250, 400))]
+
+        def get_photos(params):
+            album_id = int(params['album_id'])
+            raw_photos = [raw_photo for raw_photo in self.albums_raw_photos
+                          if raw_photo['album_id'] == album_id]
+            if int(params.get('rev', 0)):
+                raw_photos.reverse()
+            return paging_handler(raw_photos)(params)
+
+        self.server = FakeApiServer({'photos.getAlbums': paging_handler(self.albums),
+                                     'photos.get': get_photos,
+                                     'wall.get': paging_handler(self.raw_posts)})
+        self.server.start()
+
+        self.dao_url = make_url('sqlite:///community_app.db')
+        if not database_exists(self.dao_url):
+            create_database(self.dao_url)
+        self.app = create_app(self.server.url, group_id=-self.owner_id,
+                              dao=DataAccessObject(self.dao_url))
+        self.app.dao.migrate()
+
+    def tearDown(self):
+        self.server.stop()
+        drop_database(self.dao_url)
+
+    def generate_raw_photo(self, ind: int, album_id: int) -> dict:
+        return dict(id=ind, owner_id=self.owner_id, album_id=album_id,
+                    date=1475279707 + ind, text=None,
+                    photo_604='http://cs638122.vk.me/{}.jpg'.format(ind))
+
+    def generate_raw_post(self, ind: int) -> dict:
+        raw_photo = self.generate_raw_photo(ind, album_id=WALL_ALBUM_ID)
+        return dict(id=ind, owner_id=self.owner_id, date=raw_photo['date'], text='',
+                    attachments=[dict(type='photo', photo=raw_photo)])
+
+    def load_vk_ids(self):
+        with self.app.dao as session:
+            return {vk_id for vk_id, in session.query(Photo.vk_id)}
+
+    def test_synchronize_dao(self):
+        self.app.synchronize_dao('all', reconcile=True)
+        raw_photos = self.albums_raw_photos + [raw_post['attachments'][0]['photo']
+                                               for raw_post in self.raw_posts]
+        self.assertSetEqual(self.load_vk_ids(),
+                            {'{owner_id}_{id}'.format(**raw_photo) for raw_photo in raw_photos})
+
+        new_raw_photos = [self.generate_raw_photo(ind, album_id=1) for ind in range(400, 403)]
+        self.albums_raw_photos += new_raw_photos
+        deleted_raw_photo = self.albums_raw_photos.pop(0)
+        new_raw_posts = [self.generate_raw_post(ind) for ind in reversed(range(403, 405))]
+        # pinned post goes first
+        self.raw_posts[0]['is_pinned'] = 1
+        self.raw_posts[1:1] = new_raw_posts
+        self.server.requests.clear()
+        self.app.synchronize_dao('all', incremental=True)
+        # albums list, one page of every album and one page of wall posts
+        self.assertEqual(len(self.server.requests), 1 + len(self.albums) + 1)
+        vk_ids = self.load_vk_ids()
+        raw_photos += new_raw_photos
+        raw_photos += [raw_post['attachments'][0]['photo'] for raw_post in new_raw_posts]
+        self.assertSetEqual(vk_ids,
+                            {'{owner_id}_{id}'.format(**raw_photo) for raw_photo in raw_photos})
+
+        self.app.synchronize_dao('all', incremental=True,
+                                 reconcile_interval=datetime.timedelta(days=7))
+        self.assertSetEqual(self.load_vk_ids(), vk_ids)
+        self.app.synchronize_dao('all', incremental=True,
+                                 reconcile_interval=datetime.timedelta(0))
+        self.assertSetEqual(self.load_vk_ids(),
+                            vk_ids - {'{owner_id}_{id}'.format(**deleted_raw_photo)})
+
+    def test_reconcile(self):
+        self.app.synchronize_dao('all')
+        vk_ids = self.load_vk_ids()
+        deleted_album = self.albums.pop()
+        deleted_raw_photo = self.raw_posts.pop(0)['attachments'][0]['photo']
+        # photos are deleted by reconciliation only
+        self.app.synchronize_dao('all')
+        self.assertSetEqual(self.load_vk_ids(), vk_ids)
+        # photos before offset aren't loaded, so they aren't reconciled
+        self.app.synchronize_dao('wall', reconcile=True, offset=100)
+        self.assertSetEqual(self.load_vk_ids(), vk_ids)
+
+        self.app.synchronize_dao('all', reconcile=True)
+        # photos of deleted album are deleted with it
+        deleted_vk_ids = {'{owner_id}_{id}'.format(**raw_photo)
+                          for raw_photo in self.albums_raw_photos
+                          if raw_photo['album_id'] == deleted_album['id']}
+        deleted_vk_ids.add('{owner_id}_{id}'.format(**deleted_raw_photo))
+        self.assertSetEqual(self.load_vk_ids(), vk_ids - deleted_vk_ids)
+
+
+class UnitTestsFilesSynchronization(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.photos = [make_photo(ind) for ind in range(3)]
+        for photo in self.photos:
+            file_path = photo.get_file_path(self.path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, mode='w') as file:
+                file.write(photo.vk_id)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_synchronize_photo_file(self):
+        files_paths_by_names = index_files(self.path)
+        self.assertDictEqual(files_paths_by_names,
+                             {os.path.basename(photo.get_file_path(self.path)):
+                                  photo.get_file_path(self.path)
+                              for photo in self.photos})
+        moved_photo, kept_photo = self.photos[:2]
+        old_file_path = moved_photo.get_file_path(self.path)
+        moved_photo.album = 'saved'
+        file_path = synchronize_photo_file(moved_photo, self.path, files_paths_by_names)
+        self.assertEqual(file_path, moved_photo.get_file_path(self.path))
+        self.assertFalse(os.path.exists(old_file_path))
+        with open(file_path) as file:
+            self.assertEqual(file.read(), moved_photo.vk_id)
+        self.assertEqual(synchronize_photo_file(kept_photo, self.path, files_paths_by_names),
+                         kept_photo.get_file_path(self.path))
+        self.assertDictEqual(index_files(self.path), files_paths_by_names)
+        missing_photo = self.photos[-1]
+        os.remove(files_paths_by_names.pop(
+            os.path.basename(missing_photo.get_file_path(self.path))))
+        self.assertIsNone(synchronize_photo_file(missing_photo, self.path,
+                                                 files_paths_by_names))
+
+
+class IntegrationTestsPostsDeletion(unittest.TestCase):
+    def setUp(self):
+        self.owner_id = -129836227
+        self.raw_posts = [
+            dict(id=ind, owner_id=self.owner_id, date=1475279707 + ind, text='',
+                 attachments=[dict(type='photo',
+                                   photo=dict(id=ind * 10 + photo_ind, owner_id=self.owner_id,
+                                              album_id=WALL_ALBUM_ID, date=1475279707 + ind,
+                                              text=None, photo_604=''))
+                              for photo_ind in range(ind % 4)])
+            for ind in range(30)]
+        self.deleted_posts_ids = set()
+        self.deleted_photos_ids = set()
+        self.undeletable_post_id = 7
+        self.undeletable_photo_id = 21
+
+        def delete_post(params):
+            post_id = int(params['post_id'])
+            if post_id == self.undeletable_post_id:
+                raise ValueError('Access denied')
+            self.deleted_posts_ids.add(post_id)
+            return 1
+
+        def delete_photo(params):
+            photo_id = int(params['photo_id'])
+            if photo_id == self.undeletable_photo_id:
+                raise ValueError('Access denied')
+            self.deleted_photos_ids.add(photo_id)
+            return 1
+
+        self.server = FakeApiServer({'wall.delete': delete_post,
+                                     'photos.delete': delete_photo})
+        self.server.start()
+        self.app = create_app(self.server.url, group_id=-self.owner_id)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_delete_wall_posts(self):
+        posts = [Post.from_raw(raw_post) for raw_post in self.raw_posts]
+        posts_deletions = self.app.delete_wall_posts(posts)
+        calls_count = sum(len(raw_post['attachments']) + 1 for raw_post in self.raw_posts)
+        # posts calls are not split between requests
+        self.assertEqual(len(self.server.requests), math.ceil(calls_count / 25) + 1)
+        self.assertListEqual([post_deletion.post_id for post_deletion in posts_deletions],
+                             [raw_post['id'] for raw_post in self.raw_posts])
+        self.assertSetEqual(self.deleted_posts_ids,
+                            {raw_post['id'] for raw_post in self.raw_posts} -
+                            {self.undeletable_post_id})
+        self.assertEqual(len(self.deleted_photos_ids),
+                         sum(len(raw_post['attachments']) for raw_post in self.raw_posts) - 1)
+        for post_deletion in posts_deletions:
+            self.assertIsNone(post_deletion.error)
+            if post_deletion.post_id == self.undeletable_post_id:
+                self.assertFalse(post_deletion.deleted)
+                self.assertListEqual(post_deletion.failed_calls,
+                                     [('wall.delete', dict(owner_id=self.owner_id,
+                                                           post_id=self.undeletable_post_id))])
+            elif post_deletion.post_id == self.undeletable_photo_id // 10:
+                self.assertTrue(post_deletion.deleted)
+                self.assertListEqual(post_deletion.failed_calls,
+                                     [('photos.delete', dict(owner_id=self.owner_id,
+                                                             photo_id=self.undeletable_photo_id))])
+            else:
+                self.assertTrue(post_deletion.deleted)
+                self.assertListEqual(post_deletion.failed_calls, [])
+
+    def test_delete_wall_posts_failure(self):
+        posts = [Post.from_raw(raw_post) for raw_post in self.raw_posts[:3]]
+        with FakeApiServer(dict()) as server:
+            api_url = server.url
+        # server is stopped, so requests fail
+        app = create_app(api_url, group_id=-self.owner_id)
+        posts_deletions = app.delete_wall_posts(posts)
+        self.assertEqual(len(posts_deletions), len(posts))
+        for post, post_deletion in zip(posts, posts_deletions):
+            self.assertFalse(post_deletion.deleted)
+            self.assertIsNotNone(post_deletion.error)
+            self.assertEqual(len(post_deletion.failed_calls), len(post.attachments) + 1)
+
+
+class FakeAttachable:
+    """Attachable stored at local files"""
+    KEY = ''
+    FILE_EXTENSION = ''
+
+    def __init__(self, object_id: int):
+        self.object_id = object_id
+
+    @classmethod
+    def key(cls) -> str:
+        return cls.KEY
+
+    @classmethod
+    def get_file_extension(cls) -> str:
+        return cls.FILE_EXTENSION
+
+    @classmethod
+    def getUploadServer_method(cls, dst_type: str) -> str:
+        return '{}.get{}UploadServer'.format(cls.KEY, dst_type.capitalize())
+
+    @classmethod
+    def save_method(cls, dst_type: str) -> str:
+        return '{}.save{}'.format(cls.KEY, dst_type.capitalize())
+
+    @classmethod
+    def from_raw(cls, raw: dict) -> 'FakeAttachable':
+        return cls(raw['id'])
+
+    def get_file_path(self, path: str) -> str:
+        return os.path.join(path, self.key() + str(self.object_id) + self.FILE_EXTENSION)
+
+    def download(self, path: str, **kwargs):
+        pass
+
+
+class FakePhoto(FakeAttachable):
+    KEY = 'photo'
+    FILE_EXTENSION = '.jpg'
+
+
+class FakeDoc(FakeAttachable):
+    KEY = 'doc'
+    FILE_EXTENSION = '.txt'
+
+
+class FakeLink(FakeAttachable):
+    KEY = 'link'
+
+    def download(self, path: str, **kwargs):
+        raise AttributeError('Links are not downloadable')
+
+
+class IntegrationTestsAttachmentsReloading(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.attachments = [{attachable_type.key(): attachable_type(ind)}
+                            for ind, attachable_type in enumerate(
+                                [FakePhoto, FakeDoc, FakePhoto, FakeLink, FakePhoto, FakePhoto,
+                                 FakeDoc, FakePhoto, FakePhoto, FakePhoto, FakeDoc])]
+        for attachment in self.attachments:
+            for attachable in attachment.values():
+                with open(attachable.get_file_path(self.path), mode='w') as file:
+                    file.write(str(attachable.object_id))
+        self.upload_server = FakeUploadServer(self.path, delay=0.05)
+        self.upload_server.start()
+
+        def save_files(params):
+            files = parse_multipart(*next(request
+                                          for request in self.upload_server.requests
+                                          if request[1] == params['body']))
+            # new ids are equal to old ones shifted by 100
+            return [dict(id=100 + int(content)) for _, _, content in files]
+
+        self.api_server = FakeApiServer({'photo.saveWall': save_files,
+                                         'doc.saveWall': save_files})
+        self.api_server.start()
+        self.app = create_app(self.api_server.url, group_id=129836227)
+        self.app.get_upload_server_url = lambda method, **params: self.upload_server.url
+
+    def tearDown(self):
+        self.upload_server.stop()
+        self.api_server.stop()
+        shutil.rmtree(self.path)
+
+    def test_reload_attachments(self):
+        new_attachments = self.app.reload_attachments(self.attachments, self.path)
+
+        self.assertEqual(len(new_attachments), len(self.attachments))
+        for attachment, new_attachment in zip(self.attachments, new_attachments):
+            (key, attachable), = attachment.items()
+            new_attachable = new_attachment[key]
+            if isinstance(attachable, FakeLink):
+                self.assertIs(new_attachable, attachable)
+                continue
+            self.assertIsInstance(new_attachable, type(attachable))
+            self.assertEqual(new_attachable.object_id, attachable.object_id + 100)
+
+        # 7 photos are uploaded by 2 requests, docs are uploaded one by one
+        uploaded_files = [parse_multipart(*request)
+                          for request in self.upload_server.requests]
+        self.assertListEqual(sorted(map(len, uploaded_files)), [1, 1, 1, 2, 5])
+        for files in uploaded_files:
+            if len(files) == 1:
+                self.assertEqual(files[0][0], 'file')
+            else:
+                self.assertListEqual([field_name for field_name, _, _ in files],
+                                     ['file{}'.format(ind)
+                                      for ind in range(1, len(files) + 1)])
+        self.assertEqual(sorted(self.api_server.requests),
+                         ['doc.saveWall'] * 3 + ['photo.saveWall'] * 2)
+        # photos and docs are uploaded simultaneously
+        self.assertEqual(self.upload_server.max_active_requests_count, 2)
+
+
+class IntegrationTestsPhotosPosting(unittest.TestCase):
+    def setUp(self):
+        self.owner_id = -129836227
+        self.path = tempfile.mkdtemp()
+        self.photos = [make_photo(ind, owner_id=self.owner_id, album_id=1, album='saved photos',
+                                  text='photo {}'.format(ind))
+                       for ind in range(7)]
+        for photo in self.photos:
+            file_path = photo.get_file_path(self.path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, mode='w') as file:
+                file.write(str(photo.object_id))
+        self.failed_message_prefix = 'photo 4'
+
+        def save_wall_photos(params):
+            content_type, body_path = self.upload_server.requests[-1]
+            self.assertEqual(body_path, params['body'])
+            files = parse_multipart(content_type, body_path)
+            self.assertListEqual([field_name for field_name, _, _ in files],
+                                 ['file{}'.format(ind) for ind in range(1, len(files) + 1)])
+            return [dict(owner_id=self.owner_id, id=1000 + int(content))
+                    for _, _, content in files]
+
+        def post(params):
+            if params['message'].startswith(self.failed_message_prefix):
+                raise ValueError('Access denied')
+            return dict(post_id=int(params['attachments'].split('_')[-1]) - 1000)
+
+        self.upload_server = FakeUploadServer(self.path)
+        self.upload_server.start()
+        self.api_server = FakeApiServer({'photos.saveWallPhoto': save_wall_photos,
+                                         'wall.post': post})
+        self.api_server.start()
+
+        self.dao_url = make_url('sqlite:///community_app.db')
+        if not database_exists(self.dao_url):
+            create_database(self.dao_url)
+        self.app = create_app(self.api_server.url, group_id=-self.owner_id,
+                              dao=DataAccessObject(self.dao_url))
+        self.app.get_upload_server_url = lambda method, **params: self.upload_server.url
+        self.app.community_info = dict(screen_name='club')
+        self.app.dao.migrate()
+        with self.app.dao:
+            self.app.dao.save_photos(self.photos)
+
+    def tearDown(self):
+        self.upload_server.stop()
+        self.api_server.stop()
+        drop_database(self.dao_url)
+        shutil.rmtree(self.path)
+
+    def test_post_photos_on_community_wall(self):
+        posts_ids = self.app.post_photos_on_community_wall(self.photos, self.path)
+        # all posts are published by one request
+        self.assertListEqual(self.api_server.requests, ['photos.saveWallPhoto', 'execute'])
+        self.assertDictEqual(posts_ids, {photo.vk_id: photo.object_id
+                                         for ind, photo in enumerate(self.photos)
+                                         if ind != 4})
+        with self.app.dao:
+            self.assertDictEqual({photo.vk_id: photo.posted
+                                  for photo in self.app.dao.load_photos()},
+                                 {photo.vk_id: ind != 4
+                                  for ind, photo in enumerate(self.photos)})
+
+    def test_publish_photos_posts(self):
+        calls = [('wall.post', dict(owner_id=self.owner_id,
+                                    attachments='photo{}'.format(photo.vk_id),
+                                    message=photo.text))
+                 for photo in self.photos]
+        # calls of last batch fail
+        self.failed_message_prefix = 'photo 6'
+        with self.app.dao:
+            posts_ids = self.app.publish_photos_posts(self.photos, calls, batch_size=3)
+            self.assertEqual(self.api_server.requests, ['execute'] * 3)
+            self.assertListEqual(sorted(posts_ids), sorted(photo.vk_id
+                                                           for photo in self.photos[:6]))
+            posted_photos_ids = {photo.vk_id
+                                 for photo in self.app.dao.load_photos(posted=True)}
+        self.assertSetEqual(posted_photos_ids, set(posts_ids))
@@ -1,13 +1,36 @@
 import calendar
 import datetime
+import importlib.util
+import os
+import tempfile
 import unittest
+from typing import List
+from unittest import mock
 
+import numpy as np
+from sqlalchemy import inspect
 from sqlalchemy.engine.url import make_url
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy_utils import drop_database
 
-from vk_community.models import Photo
-from vk_community.services.data_access import check_filters, DataAccessObject
+from vk_community.models import Photo, SyncCursor
+from vk_community.services.data_access import (check_filters, filter_photos, DataAccessObject,
+                                               BOUND_PARAMETERS_LIMIT, UPSERT_BY_DIALECT,
+                                               WAL_SQLITE_PRAGMAS)
+from vk_community.services.snapshots import export_photos, import_photos
+
+PYARROW_INSTALLED = importlib.util.find_spec('pyarrow') is not None
+
+
+def make_photo(ind: int, **overrides) -> Photo:
+    """Returns photo of wall album with `ind`-th object id,
+    its attributes may be overridden by keyword arguments"""
+    attributes = dict(owner_id=-129836227, object_id=431928280 + ind, album_id=-7, album='wall',
+                      date_time=datetime.datetime(2016, 9, 30, 23, 55, 7), user_id=100,
+                      text=None,
+                      link='http://cs638122.vk.me/v638122248/1c41/SnfoaFP-Hfk.jpg')
+    attributes.update(overrides)
+    return Photo(**attributes)
 
 
 class IntegrationTestsDataAccess(unittest.TestCase):
@@ -16,12 +39,7 @@ class IntegrationTestsDataAccess(unittest.TestCase):
         if not database_exists(self.dao_url):
             create_database(self.dao_url)
         self.dao = DataAccessObject(self.dao_url)
-        self.photos = [
-            Photo(owner_id=-129836227, object_id=431928280, album_id=-7, album='wall',
-                  date_time=datetime.datetime(2016, 9, 30, 23, 55, 7), user_id=100,
-                  text=None,
-                  link='http://cs638122.vk.me/v638122248/1c41/SnfoaFP-Hfk.jpg')
-        ]
+        self.photos = [make_photo(0)]
 
     def tearDown(self):
         drop_database(self.dao_url)
@@ -34,6 +52,300 @@ class IntegrationTestsDataAccess(unittest.TestCase):
             photos = session.query(Photo).all()
         self.assertListEqual(photos, self.photos)
 
+    def test_save_photos_bulk(self):
+        if not self.dao.engine.dialect.has_table(self.dao.engine, Photo.__tablename__):
+            Photo.__table__.create(bind=self.dao.engine)
+        posted_photo, = self.photos
+        posted_photo.posted = True
+        new_photos = [make_photo(ind) for ind in range(5)]
+        with self.dao as session:
+            self.dao.save_photos(self.photos)
+            counts = self.dao.save_photos(new_photos, bulk=True, chunk_size=2)
+            photos = session.query(Photo).order_by(Photo.object_id).all()
+        self.assertEqual(counts.inserted, 4)
+        self.assertEqual(counts.updated, 1)
+        self.assertListEqual(photos, new_photos)
+        # columns which are not set on saved photo should stay untouched
+        self.assertTrue(photos[0].posted)
+
+    @unittest.skipUnless('sqlite' in UPSERT_BY_DIALECT,
+                         'SQLAlchemy version does not support SQLite upsert')
+    def test_save_photos_by_upsert(self):
+        if not self.dao.engine.dialect.has_table(self.dao.engine, Photo.__tablename__):
+            Photo.__table__.create(bind=self.dao.engine)
+        posted_photo, = self.photos
+        posted_photo.posted = True
+        new_photos = [make_photo(ind) for ind in range(250)]
+        upsert = UPSERT_BY_DIALECT['sqlite']
+        statements_rows_counts = list()
+
+        def counting_upsert(table, rows):
+            statements_rows_counts.append(len(rows))
+            # values of rows are bound parameters
+            self.assertLessEqual(sum(map(len, rows)), BOUND_PARAMETERS_LIMIT)
+            return upsert(table, rows)
+
+        with self.dao as session, mock.patch.dict(UPSERT_BY_DIALECT,
+                                                  sqlite=counting_upsert):
+            self.dao.save_photos(self.photos)
+            counts = self.dao.save_photos(new_photos, bulk=True)
+            photos = session.query(Photo).order_by(Photo.object_id).all()
+        self.assertEqual(counts.inserted, len(new_photos) - 1)
+        self.assertEqual(counts.updated, 1)
+        self.assertEqual(sum(statements_rows_counts), len(new_photos))
+        self.assertGreater(len(statements_rows_counts), 1)
+        self.assertListEqual(photos, new_photos)
+        self.assertTrue(photos[0].posted)
+
+    def test_iter_photos(self):
+        if not self.dao.engine.dialect.has_table(self.dao.engine, Photo.__tablename__):
+            Photo.__table__.create(bind=self.dao.engine)
+        # photos with same dates should be ordered by ids
+        photos = [make_photo(ind, date_time=datetime.datetime(2016, 9, 30 - ind // 2, 23, 55, 7))
+                  for ind in range(7)]
+        photos.sort(key=lambda photo: (photo.date_time, photo.vk_id))
+        with self.dao:
+            self.dao.save_photos(photos)
+            batches = list(self.dao.iter_photos(batch_size=2))
+            descending_batches = list(self.dao.iter_photos(batch_size=2, descending=True))
+            filtered_batches = list(self.dao.iter_photos(
+                batch_size=2, start_datetime=datetime.datetime(2016, 9, 29)))
+        self.assertListEqual([len(batch) for batch in batches], [2, 2, 2, 1])
+        self.assertListEqual([photo for batch in batches for photo in batch], photos)
+        self.assertListEqual([photo for batch in descending_batches for photo in batch],
+                             photos[::-1])
+        self.assertListEqual([photo for batch in filtered_batches for photo in batch],
+                             photos[-4:])
+
+    def test_load_random_photos(self):
+        if not self.dao.engine.dialect.has_table(self.dao.engine, Photo.__tablename__):
+            Photo.__table__.create(bind=self.dao.engine)
+        photos = [make_photo(ind, album='wall' if ind % 2 else 'saved') for ind in range(10)]
+        wall_photos = [photo for photo in photos if photo.album == 'wall']
+        with self.dao:
+            self.dao.save_photos(photos)
+            for _ in range(10):
+                random_photos = self.dao.load_photos(random=True, limit=3, albums=['wall'])
+                self.assertEqual(len(random_photos), 3)
+                self.assertEqual(len({photo.vk_id for photo in random_photos}), 3)
+                self.assertTrue(all(photo in wall_photos for photo in random_photos))
+            random_photos = self.dao.load_photos(random=True, limit=10, albums=['wall'])
+            self.assertCountEqual(random_photos, wall_photos)
+            self.assertCountEqual(self.dao.load_photos(random=True, albums=['wall']),
+                                  wall_photos)
+            sorted_photos = sorted(random_photos, key=lambda photo: photo.random_key)
+            # every photo has its own pivot, the last one wraps around
+            pivots = [sorted_photos[3].random_key, sorted_photos[0].random_key, 1.]
+            with mock.patch('vk_community.services.data_access.generate_random_key',
+                            side_effect=pivots):
+                random_photos = self.dao.load_photos(random=True, limit=3, albums=['wall'])
+            self.assertListEqual(random_photos,
+                                 [sorted_photos[3], sorted_photos[0], sorted_photos[1]])
+            self.assertRaises(ValueError, self.dao.load_photos,
+                              random=True, limit=3, offset=1)
+            # photos saved before random keys were introduced
+            unmigrated_photos = sorted_photos[:2]
+            for photo in unmigrated_photos:
+                photo.random_key = None
+            self.dao.session.commit()
+            with mock.patch('vk_community.services.data_access.generate_random_key',
+                            return_value=1.):
+                random_photos = self.dao.load_photos(random=True, limit=3, albums=['wall'])
+            self.assertListEqual(random_photos, sorted_photos[2:5])
+
+    def test_migrate(self):
+        # table created before adding of random keys and indexes
+        self.dao.engine.execute('CREATE TABLE photos ('
+                                'vk_id VARCHAR(255) NOT NULL PRIMARY KEY, '
+                                'owner_id INTEGER, object_id INTEGER, album_id INTEGER, '
+                                'album VARCHAR(255), date_time DATETIME, user_id INTEGER, '
+                                'text TEXT, link VARCHAR(255), posted BOOLEAN)')
+        self.dao.engine.execute("INSERT INTO photos (vk_id, posted) VALUES ('-1_1', 0)")
+        self.dao.migrate()
+        inspector = inspect(self.dao.engine)
+        indexes_names = {index['name'] for index in inspector.get_indexes('photos')}
+        self.assertTrue(all(index.name in indexes_names
+                            for index in Photo.__table__.indexes))
+        with self.dao as session:
+            photo, = session.query(Photo).all()
+        self.assertIsNotNone(photo.random_key)
+
+    def test_migrate_twice(self):
+        self.dao.migrate()
+        with self.dao as session:
+            self.dao.save_photos(self.photos)
+            random_keys = session.query(Photo.vk_id, Photo.random_key).all()
+        indexes = inspect(self.dao.engine).get_indexes('photos')
+        # migrated table is left unchanged
+        self.dao.migrate()
+        with self.dao as session:
+            self.assertListEqual(session.query(Photo.vk_id, Photo.random_key).all(),
+                                 random_keys)
+        self.assertListEqual(inspect(self.dao.engine).get_indexes('photos'), indexes)
+
+    def test_queries_use_indexes(self):
+        self.dao.migrate()
+        with self.dao as session:
+            queries = [
+                filter_photos(session.query(Photo), posted=True)
+                    .order_by(Photo.date_time, Photo.vk_id),
+                filter_photos(session.query(Photo), posted=False)
+                    .filter(Photo.random_key >= 0.5)
+                    .order_by(Photo.random_key),
+                filter_photos(session.query(Photo), albums=['wall'], posted=False),
+                filter_photos(session.query(Photo), owner_id=-129836227,
+                              start_datetime=datetime.datetime(2016, 9, 30)),
+            ]
+            for query in queries:
+                statement = query.statement.compile(dialect=self.dao.engine.dialect,
+                                                    compile_kwargs={'literal_binds': True})
+                query_plan = self.dao.engine.execute(
+                    'EXPLAIN QUERY PLAN {}'.format(statement)).fetchall()
+                details = ' '.join(row[-1] for row in query_plan)
+                self.assertIn('USING INDEX ix_photos_', details)
+
+    def test_sqlite_pragmas(self):
+        dao = DataAccessObject(self.dao_url, sqlite_pragmas=WAL_SQLITE_PRAGMAS)
+        with dao as session:
+            journal_mode = session.execute('PRAGMA journal_mode').scalar()
+            busy_timeout = session.execute('PRAGMA busy_timeout').scalar()
+        self.assertEqual(journal_mode.lower(), 'wal')
+        self.assertEqual(busy_timeout, WAL_SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_query_cache(self):
+        dao = DataAccessObject(self.dao_url, query_cache_size=2)
+        dao.migrate()
+        filters = dict(albums=['wall'], posted='0')
+        check_filters(filters)
+        with dao:
+            dao.save_photos(self.photos)
+            photos = dao.load_photos(**filters)
+            self.assertListEqual(photos, self.photos)
+        with dao:
+            cached_photos = dao.load_photos(**filters)
+            dao.load_photos(random=True)
+            cache_info = dao.query_cache.cache_info()
+            self.assertListEqual(cached_photos, self.photos)
+            self.assertEqual(cache_info.hits, 1)
+            self.assertEqual(cache_info.misses, 1)
+            # saving photos should invalidate cache
+            cached_photo, = cached_photos
+            cached_photo.posted = True
+            dao.save_photos(cached_photos)
+            self.assertListEqual(dao.load_photos(**filters), [])
+        self.assertEqual(dao.query_cache.cache_info().misses, 2)
+        with dao:
+            cached_photos = dao.load_photos(posted=True)
+            cached_photo, = cached_photos
+            cached_photo.text = 'unsaved text'
+            # cache is bypassed while session has unflushed changes
+            self.assertListEqual(dao.load_photos(posted=True), cached_photos)
+            self.assertEqual(cached_photo.text, 'unsaved text')
+        self.assertEqual(dao.query_cache.cache_info().hits, 1)
+
+    def test_count_photos(self):
+        self.dao.migrate()
+        photos = [
+            make_photo(ind, album='wall' if ind % 3 else 'saved',
+                       date_time=datetime.datetime(2016, 9 + ind % 2, 30, 23, 55, 7))
+            for ind in range(6)]
+        for photo in photos[:2]:
+            photo.posted = True
+        with self.dao:
+            self.dao.save_photos(photos)
+            counts_by_albums = self.dao.count_photos_by_albums()
+            counts_by_posted = self.dao.count_photos_by_posted(albums=['wall'])
+            counts_by_days = self.dao.count_photos_by_dates()
+            counts_by_months = self.dao.count_photos_by_dates(period='month', posted=False)
+        self.assertDictEqual(counts_by_albums, {'saved': 2, 'wall': 4})
+        self.assertDictEqual(counts_by_posted, {False: 3, True: 1})
+        self.assertDictEqual(counts_by_days, {'2016-09-30': 3, '2016-10-30': 3})
+        self.assertDictEqual(counts_by_months, {'2016-09': 2, '2016-10': 2})
+        with self.dao:
+            self.assertRaises(ValueError, self.dao.count_photos_by_dates, period='week')
+
+    def test_export_import_photos(self):
+        self.check_export_import_photos(['photos.npz', 'photos.csv.gz'])
+        self.assertRaises(ValueError, export_photos, self.dao, 'photos.json')
+
+    @unittest.skipUnless(PYARROW_INSTALLED, 'pyarrow is not installed')
+    def test_export_import_photos_parquet(self):
+        self.check_export_import_photos(['photos.parquet'])
+
+    def check_export_import_photos(self, files_names: List[str]):
+        photos = [
+            make_photo(ind, album='wall' if ind % 2 else 'saved',
+                       date_time=datetime.datetime(2016, 9, 30, 23, 55, 7, ind),
+                       text=None if ind % 3 else 'текст, "quoted"\n{}'.format(ind))
+            for ind in range(7)]
+        for photo in photos[::2]:
+            photo.posted = True
+        self.dao.migrate()
+        with self.dao as session:
+            self.dao.save_photos(photos)
+            # values of columns with defaults are set by database only
+            defaults = (session.query(Photo.random_key, Photo.posted)
+                        .order_by(Photo.object_id).all())
+        snapshots_path = tempfile.mkdtemp()
+        for file_name in files_names:
+            file_path = os.path.join(snapshots_path, file_name)
+            exported_count = export_photos(self.dao, file_path, chunk_size=3)
+            if file_name.endswith('.npz'):
+                with np.load(file_path, allow_pickle=False) as arrays:
+                    # strings aren't stored in fixed-width unicode arrays
+                    self.assertFalse(any(arrays[array_name].dtype.kind == 'U'
+                                         for array_name in arrays.files))
+            imported_dao_url = make_url('sqlite:///imported_community_app.db')
+            imported_dao = DataAccessObject(imported_dao_url)
+            try:
+                imported_count = import_photos(imported_dao, file_path)
+                with imported_dao as session:
+                    imported_photos = session.query(Photo).order_by(Photo.object_id).all()
+                indexes_names = {index['name']
+                                 for index in inspect(imported_dao.engine).get_indexes('photos')}
+            finally:
+                drop_database(imported_dao_url)
+                os.remove(file_path)
+            self.assertEqual(exported_count, len(photos))
+            self.assertEqual(imported_count, len(photos))
+            self.assertListEqual(imported_photos, photos)
+            self.assertListEqual([(photo.random_key, photo.posted) for photo in imported_photos],
+                                 defaults)
+            self.assertTrue(all(index.name in indexes_names
+                                for index in Photo.__table__.indexes))
+        os.rmdir(snapshots_path)
+
+    def test_sync_cursors(self):
+        cursor = SyncCursor(owner_id=-129836227, source='album', album_id=1)
+        raw_photos = [dict(id=ind, date=1475279707 + ind // 2) for ind in range(5)]
+        self.assertFalse(cursor.is_known(raw_photos[0]))
+        cursor.update(raw_photos)
+        self.assertEqual((cursor.date, cursor.object_id), (1475279709, 4))
+        self.assertTrue(all(cursor.is_known(raw_photo) for raw_photo in raw_photos))
+        self.assertFalse(cursor.is_known(dict(id=3, date=1475279710)))
+        with self.dao:
+            self.assertDictEqual(self.dao.load_sync_cursors(-129836227), {})
+            self.dao.save_sync_cursors([cursor])
+        with self.dao:
+            cursors = self.dao.load_sync_cursors(-129836227)
+            cursor, = cursors.values()
+            self.assertEqual(list(cursors), [('album', 1)])
+            self.assertEqual((cursor.date, cursor.object_id), (1475279709, 4))
+            self.assertDictEqual(self.dao.load_sync_cursors(-1), {})
+
+    def test_delete_missing_photos(self):
+        self.dao.migrate()
+        photos = [make_photo(ind, album_id=ind % 2) for ind in range(7)]
+        kept_photos = photos[:3]
+        with self.dao as session:
+            self.dao.save_photos(photos)
+            deleted_count = self.dao.delete_missing_photos(
+                -129836227, 0, [photo.vk_id for photo in kept_photos], chunk_size=1)
+            vk_ids = [vk_id for vk_id, in session.query(Photo.vk_id).order_by(Photo.vk_id)]
+        self.assertEqual(deleted_count, 2)
+        self.assertListEqual(vk_ids, sorted(photo.vk_id for photo in photos
+                                            if photo in kept_photos or photo.album_id == 1))
+
 
 class UnitTestsDataAccess(unittest.TestCase):
     def setUp(self):
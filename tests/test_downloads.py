@@ -0,0 +1,75 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from tests.fake_api import FakeFilesServer
+from vk_community.services.downloads import Downloader
+
+
+def generate_image_content(seed: int) -> bytes:
+    random_state = np.random.RandomState(seed)
+    image_array = random_state.randint(0, 256, size=(120, 160, 3)).astype(np.uint8)
+    image_bytes = io.BytesIO()
+    Image.fromarray(image_array, mode='RGB').save(image_bytes, format='JPEG')
+    return image_bytes.getvalue()
+
+
+class IntegrationTestsDownloads(unittest.TestCase):
+    def setUp(self):
+        self.files = {'/{}.jpg'.format(ind): generate_image_content(ind)
+                      for ind in range(20)}
+        self.retried_path = '/0.jpg'
+        self.failed_path = '/unavailable.jpg'
+        self.missing_path = '/missing.jpg'
+        self.files[self.failed_path] = b''
+        self.server = FakeFilesServer(self.files,
+                                      failures={self.retried_path: 2,
+                                                self.failed_path: 10},
+                                      delay=0.01)
+        self.server.start()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def test_download(self):
+        host_connections_limit = 2
+        retries_count = 3
+        paths = sorted(self.files) + [self.missing_path]
+        downloads = [(self.server.url + path,
+                      os.path.join(self.path, 'album', path.lstrip('/')))
+                     for path in paths]
+        with Downloader(workers=6, host_connections_limit=host_connections_limit,
+                        retries_count=retries_count, backoff_factor=0.01) as downloader:
+            report = downloader.download(downloads)
+
+        self.assertEqual(report.files_count, len(self.files) - 1)
+        self.assertEqual(report.bytes_count, sum(map(len, self.files.values())))
+        # failures are in order of downloads
+        self.assertListEqual([failure.url for failure in report.failures],
+                             [self.server.url + self.failed_path,
+                              self.server.url + self.missing_path])
+        for path, (_, file_path) in zip(paths, downloads):
+            if path in {self.failed_path, self.missing_path}:
+                self.assertFalse(os.path.exists(file_path))
+                continue
+            with open(file_path, mode='rb') as file:
+                self.assertEqual(file.read(), self.files[path])
+        # no temporary files are left
+        self.assertEqual(len(os.listdir(os.path.join(self.path, 'album'))),
+                         len(self.files) - 1)
+
+        self.assertEqual(self.server.requests.count(self.retried_path), 3)
+        self.assertEqual(self.server.requests.count(self.failed_path), retries_count + 1)
+        self.assertEqual(self.server.requests.count(self.missing_path), 1)
+        self.assertLessEqual(self.server.max_active_requests_count, host_connections_limit)
+        # connections are reused except ones closed after error responses
+        errors_count = 2 + (retries_count + 1) + 1
+        self.assertLessEqual(len(self.server.connections),
+                             host_connections_limit + errors_count)
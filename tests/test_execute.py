@@ -0,0 +1,77 @@
+import unittest
+
+from tests.fake_api import ApiSession, FakeApiServer, paging_handler
+from vk_community.services.execute import (execute_calls, get_all_objects_by_execute,
+                                           get_execute_code, pack_calls_groups)
+
+
+class UnitTestsExecute(unittest.TestCase):
+    def test_get_execute_code(self):
+        code = get_execute_code([('wall.get', dict(owner_id=-1, offset=0, count=100)),
+                                 ('photos.get', dict(album_id='wall', owner_id=-1))])
+        self.assertEqual(code,
+                         'return [API.wall.get({"count": 100, "offset": 0, "owner_id": -1}), '
+                         'API.photos.get({"album_id": "wall", "owner_id": -1})];')
+
+    def test_pack_calls_groups(self):
+        calls_groups = [[('wall.delete', dict(post_id=ind))] * (ind % 4 + 1)
+                        for ind in range(20)]
+        batches = list(pack_calls_groups(calls_groups, calls_limit=10))
+        self.assertListEqual([calls_group for batch in batches for calls_group in batch],
+                             calls_groups)
+        self.assertTrue(all(sum(map(len, batch)) <= 10 for batch in batches))
+        self.assertEqual(len(batches), 5)
+
+        pairs = [(ind, calls_group) for ind, calls_group in enumerate(calls_groups)]
+        batches = list(pack_calls_groups(pairs, key=lambda pair: pair[1], calls_limit=10))
+        self.assertListEqual([ind for batch in batches for ind, _ in batch],
+                             list(range(20)))
+        self.assertRaises(ValueError, list, pack_calls_groups(calls_groups, calls_limit=3))
+
+
+class IntegrationTestsExecute(unittest.TestCase):
+    def setUp(self):
+        self.posts = [dict(id=ind, owner_id=-1, text='post {}'.format(ind))
+                      for ind in range(2345)]
+        self.photos = [dict(id=ind, owner_id=-1, album_id=1) for ind in range(7)]
+
+        def get_photos(params):
+            if int(params['album_id']) != 1:
+                raise ValueError('Access denied')
+            return paging_handler(self.photos)(params)
+
+        self.server = FakeApiServer({'wall.get': paging_handler(self.posts),
+                                     'photos.get': get_photos})
+        self.server.start()
+        self.api_session = ApiSession(self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get_all_objects_by_execute(self):
+        posts = get_all_objects_by_execute(self.api_session, 'wall.get', owner_id=-1)
+        self.assertListEqual(posts, self.posts)
+        # first page and 23 other pages of posts
+        self.assertListEqual(self.server.requests, ['execute'] * 2)
+
+        self.server.requests.clear()
+        posts = get_all_objects_by_execute(self.api_session, 'wall.get',
+                                           page_size=10, owner_id=-1, offset=5)
+        self.assertListEqual(posts, self.posts[5:])
+        self.assertEqual(len(self.server.requests), 1 + 10)
+
+        photos = get_all_objects_by_execute(self.api_session, 'photos.get',
+                                            owner_id=-1, album_id=1)
+        self.assertListEqual(photos, self.photos)
+        self.assertRaises(RuntimeError, get_all_objects_by_execute, self.api_session,
+                          'photos.get', owner_id=-1, album_id=2)
+
+    def test_execute_calls(self):
+        calls = [('photos.get', dict(owner_id=-1, album_id=album_id, offset=ind, count=1))
+                 for ind in range(30)
+                 for album_id in [1, 2]]
+        results = execute_calls(self.api_session, calls)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertListEqual(results[1::2], [False] * 30)
+        self.assertListEqual([result['items'] for result in results[::2]],
+                             [self.photos[ind:ind + 1] for ind in range(30)])
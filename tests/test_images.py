@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+from skimage import img_as_float
+
+from benchmarks.bench_images import generate_image, generate_watermark
+from vk_community.services import images
+from vk_community.services.images import (alpha_composite, alpha_composite_in_place,
+                                          mark_images, paste_watermark, WatermarkCache,
+                                          get_marked_image_path, get_marks_fingerprint,
+                                          jpeg_encoder, webp_encoder, WATERMARKS_CACHE_MAX_SIZE)
+from vk_community.services.manifest import MarksManifest
+
+
+def paste_watermark_full_frame(image: Image.Image,
+                               watermark: Image.Image) -> Image.Image:
+    """Reference implementation composing whole frame with floating point arithmetic"""
+    min_image_dimension = min(image.size)
+    watermark_length = int(min_image_dimension / 4.)
+
+    watermark_size = (watermark_length, watermark_length)
+    watermark = watermark.resize(watermark_size, Image.ANTIALIAS)
+
+    foreground_shape = (image.size[1], image.size[0], 4)
+
+    top_margin = int(5 * image.size[1] / 6.)
+
+    foreground_array = np.zeros(foreground_shape, dtype=np.uint8)
+    foreground_array[top_margin - watermark_length:top_margin, :watermark_length, :] = np.array(watermark)
+
+    image_array = np.array(image)
+    background_rgb = img_as_float(image_array[..., :-1])
+    mean = np.mean(background_rgb[top_margin - watermark_length:top_margin, :watermark_length, :])
+    if mean < 0.4:
+        foreground_alpha = foreground_array[..., -1:]
+        foreground_rgb = foreground_array[..., :-1]
+        foreground_rgb = 255 - foreground_rgb
+        foreground_array = np.dstack((foreground_rgb, foreground_alpha))
+
+    marked_image_array = alpha_composite(foreground_array, image_array)
+    return Image.fromarray(marked_image_array, mode='RGBA')
+
+
+class UnitTestsImages(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.watermark = generate_watermark(64)
+        self.images = [generate_image(size, color).convert('RGBA')
+                       for size in [(320, 240), (240, 320), (101, 97)]
+                       for color in [(20, 20, 20), (230, 230, 230)]]
+
+    def assertArraysClose(self, first: np.ndarray, second: np.ndarray):
+        difference = np.abs(first.astype(np.int16) - second.astype(np.int16))
+        self.assertLessEqual(difference.max(), 1)
+
+    def test_alpha_composite_in_place(self):
+        shape = (50, 40, 4)
+        src = self.random_state.randint(0, 256, size=shape).astype(np.uint8)
+        dst = self.random_state.randint(0, 256, size=shape).astype(np.uint8)
+        # fully transparent pixels
+        src[:5, ..., 3] = 0
+        dst[:5, ..., 3] = 0
+        expected = alpha_composite(src, dst)
+        alpha_composite_in_place(src, dst)
+        self.assertArraysClose(dst, expected)
+
+    def test_paste_watermark(self):
+        for image in self.images:
+            expected = np.array(paste_watermark_full_frame(image, self.watermark))
+            marked_image = np.array(paste_watermark(image, self.watermark))
+            self.assertArraysClose(marked_image, expected)
+
+    def test_watermark_cache(self):
+        watermarks_cache = WatermarkCache(self.watermark, max_size=2)
+        watermark_array = watermarks_cache.get(30)
+        self.assertEqual(watermark_array.shape, (30, 30, 4))
+        self.assertIs(watermarks_cache.get(30), watermark_array)
+        inverted_watermark_array = watermarks_cache.get(30, inverted=True)
+        self.assertTrue(np.array_equal(inverted_watermark_array[..., :-1],
+                                       255 - watermark_array[..., :-1]))
+        # least recently used non-inverted watermark should be evicted
+        watermarks_cache.get(20)
+        self.assertIs(watermarks_cache.get(30, inverted=True), inverted_watermark_array)
+        self.assertIsNot(watermarks_cache.get(30), watermark_array)
+        cache_info = watermarks_cache.cache_info()
+        # building of inverted watermark isn't counted as hit of non-inverted one
+        self.assertEqual(cache_info.hits, 2)
+        self.assertEqual(cache_info.misses, 4)
+        self.assertEqual(cache_info.size, 2)
+
+
+class IntegrationTestsImages(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.watermark = generate_watermark(64)
+        self.images_sizes = [(320, 240), (240, 320), (200, 200)]
+        self.images_colors = [(20, 20, 20), (230, 230, 230)]
+        self.images_paths = list()
+        for ind, size in enumerate(self.images_sizes):
+            for color in self.images_colors:
+                image_dir = os.path.join(self.path, 'album{}'.format(ind))
+                os.makedirs(image_dir, exist_ok=True)
+                image_path = os.path.join(image_dir, '{}.jpg'.format(color[0]))
+                generate_image(size, color).save(image_path)
+                self.images_paths.append(image_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_marked_images_contents(self):
+        marked_images_contents = list()
+        for image_path in self.images_paths:
+            with open(image_path.replace('.jpg', '.png'), mode='rb') as file:
+                marked_images_contents.append(file.read())
+            os.remove(image_path.replace('.jpg', '.png'))
+        return marked_images_contents
+
+    def test_mark_images_in_parallel(self):
+        report = mark_images(self.path, self.watermark)
+        self.assertEqual(report.images_count, len(self.images_paths))
+        self.assertGreater(report.cache_info.hits, 0)
+        marked_images_contents = self.get_marked_images_contents()
+        parallel_report = mark_images(self.path, self.watermark, workers=2)
+        parallel_marked_images_contents = self.get_marked_images_contents()
+        # caches of workers are summed up
+        self.assertIn(parallel_report.cache_info.max_size,
+                      {WATERMARKS_CACHE_MAX_SIZE, 2 * WATERMARKS_CACHE_MAX_SIZE})
+        self.assertLessEqual(parallel_report.cache_info.size,
+                             parallel_report.cache_info.max_size)
+        self.assertListEqual(parallel_marked_images_contents, marked_images_contents)
+
+    def test_mark_images_with_manifest(self):
+        mark_images(self.path, self.watermark)
+        fingerprint = get_marks_fingerprint(self.watermark)
+        marks_manifest = MarksManifest(self.path, fingerprint,
+                                       get_save_path=get_marked_image_path)
+        self.assertListEqual(marks_manifest.get_outdated_images_paths(), [])
+
+        changed_image_path = self.images_paths[0]
+        image_stat = os.stat(changed_image_path)
+        os.utime(changed_image_path, ns=(image_stat.st_atime_ns,
+                                         image_stat.st_mtime_ns + 10 ** 9))
+        marks_manifest = MarksManifest(self.path, fingerprint,
+                                       get_save_path=get_marked_image_path)
+        self.assertListEqual(marks_manifest.get_outdated_images_paths(),
+                             [changed_image_path])
+
+        mark_images(self.path, self.watermark)
+        new_image_path = os.path.join(self.path, 'new.jpg')
+        generate_image((100, 100), (0, 0, 0)).save(new_image_path)
+        marks_manifest = MarksManifest(self.path, fingerprint,
+                                       get_save_path=get_marked_image_path)
+        self.assertListEqual(marks_manifest.get_outdated_images_paths(),
+                             [new_image_path])
+
+        new_watermark = generate_watermark(32)
+        marks_manifest = MarksManifest(self.path, get_marks_fingerprint(new_watermark),
+                                       get_save_path=get_marked_image_path)
+        self.assertCountEqual(marks_manifest.get_outdated_images_paths(),
+                              self.images_paths + [new_image_path])
+
+    def test_mark_images_after_interruption(self):
+        mark_image = images.mark_image
+        marked_images_paths = list()
+
+        def interrupted_mark_image(image_path: str, *args, **kwargs):
+            if len(marked_images_paths) == 2:
+                raise KeyboardInterrupt
+            marked_images_paths.append(image_path)
+            return mark_image(image_path, *args, **kwargs)
+
+        with mock.patch.object(images, 'mark_image', interrupted_mark_image):
+            self.assertRaises(KeyboardInterrupt, mark_images, self.path, self.watermark)
+        # images left unmarked by interrupted run are marked by next one
+        report = mark_images(self.path, self.watermark)
+        self.assertEqual(report.images_count, len(self.images_paths) - 2)
+        for image_path in self.images_paths:
+            self.assertTrue(os.path.exists(get_marked_image_path(image_path)))
+        self.assertEqual(mark_images(self.path, self.watermark).images_count, 0)
+
+    def test_mark_images_unchanged(self):
+        mark_images(self.path, self.watermark)
+        manifest_mtime = os.stat(os.path.join(self.path, '.marks', 'manifest.json')).st_mtime_ns
+        with mock.patch('os.stat', wraps=os.stat) as stat, \
+                mock.patch('os.listdir', wraps=os.listdir) as listdir, \
+                mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            report = mark_images(self.path, self.watermark)
+        self.assertEqual(report.images_count, 0)
+        # directories aren't listed, every directory and image is checked once
+        self.assertEqual(listdir.call_count + scandir.call_count, 0)
+        dirs_count = len(self.images_sizes) + 1
+        # besides existence of manifest file is checked
+        self.assertLessEqual(stat.call_count, len(self.images_paths) + dirs_count + 1)
+        # unchanged manifest isn't rewritten
+        self.assertEqual(os.stat(os.path.join(self.path, '.marks', 'manifest.json')).st_mtime_ns,
+                         manifest_mtime)
+
+    def test_mark_images_with_encoders(self):
+        png_report = mark_images(self.path, self.watermark)
+        for encoder in [jpeg_encoder(quality=80, subsampling=2, optimize=True),
+                        webp_encoder(quality=80)]:
+            report = mark_images(self.path, self.watermark, encoder=encoder)
+            self.assertEqual(report.images_count, len(self.images_paths))
+            self.assertEqual(report.source_bytes, png_report.source_bytes)
+            self.assertLess(report.written_bytes, png_report.written_bytes)
+            for image_path in self.images_paths:
+                marked_image_path = get_marked_image_path(image_path, encoder=encoder)
+                with Image.open(marked_image_path) as marked_image:
+                    self.assertEqual(marked_image.format, encoder.file_format)
@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fake_api import ApiSession, FakeApiServer
+from vk_community.services.scheduler import (BULK_PRIORITY, INTERACTIVE_PRIORITY,
+                                             ApiScheduler, ScheduledApiSession)
+
+
+class UnitTestsScheduler(unittest.TestCase):
+    def setUp(self):
+        self.calls = list()
+        self.lock = threading.Lock()
+
+    def record_call(self, name: str) -> str:
+        with self.lock:
+            self.calls.append((name, time.monotonic()))
+        return name
+
+    def test_buckets_keys(self):
+        scheduler = ApiScheduler(calls_per_second=20)
+        calls_count = 6
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                lambda bucket_key: scheduler.call(lambda: self.record_call(bucket_key),
+                                                    bucket_key=bucket_key),
+                ['first', 'second'] * calls_count))
+        duration = time.monotonic() - start
+        self.assertListEqual(results, ['first', 'second'] * calls_count)
+        for bucket_key in ['first', 'second']:
+            calls_times = [call_time
+                           for name, call_time in self.calls
+                           if name == bucket_key]
+            self.assertGreaterEqual(max(calls_times) - min(calls_times),
+                                    (calls_count - 1) / 20 * 0.9)
+        # calls with different keys don't wait for each other
+        self.assertLess(duration, (2 * calls_count - 1) / 20)
+
+        metrics = scheduler.get_metrics()
+        self.assertEqual(metrics.calls_count, 2 * calls_count)
+        self.assertEqual(metrics.queue_depth, 0)
+        self.assertGreater(metrics.max_queue_depth, 1)
+        self.assertGreater(metrics.max_wait, 0)
+        self.assertLessEqual(metrics.mean_wait, metrics.max_wait)
+
+    def test_priorities(self):
+        scheduler = ApiScheduler(calls_per_second=20)
+        bulk_calls_count = 8
+        with ThreadPoolExecutor(max_workers=bulk_calls_count + 1) as executor:
+            for ind in range(bulk_calls_count):
+                executor.submit(scheduler.call, lambda: self.record_call('bulk'),
+                                priority=BULK_PRIORITY)
+            # waits for bulk calls to get in queue
+            while scheduler.get_metrics().queue_depth < bulk_calls_count - 1:
+                time.sleep(0.01)
+            executor.submit(scheduler.call, lambda: self.record_call('interactive'),
+                            priority=INTERACTIVE_PRIORITY)
+        names = [name for name, _ in self.calls]
+        self.assertEqual(len(names), bulk_calls_count + 1)
+        # interactive call overtakes waiting bulk calls
+        self.assertLessEqual(names.index('interactive'), 2)
+
+
+class IntegrationTestsScheduler(unittest.TestCase):
+    def setUp(self):
+        self.calls_per_second = 20
+        self.server = FakeApiServer({'wall.get': lambda params: int(params['offset'])},
+                                    calls_per_second=self.calls_per_second)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_backoff(self):
+        # scheduler rate exceeds server one
+        scheduler = ApiScheduler(calls_per_second=100)
+        api_session = ScheduledApiSession(ApiSession(self.server.url), scheduler)
+        calls_count = 40
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda offset: api_session.wall.get(offset=offset),
+                                        range(calls_count)))
+        self.assertListEqual(results, list(range(calls_count)))
+
+        metrics = scheduler.get_metrics()
+        self.assertGreater(self.server.rate_limit_errors_count, 0)
+        self.assertEqual(metrics.rate_limit_errors_count, self.server.rate_limit_errors_count)
+        self.assertEqual(metrics.calls_count, len(self.server.requests))
+        # rate is decreased after errors instead of retrying blindly
+        self.assertLess(metrics.rate_limit_errors_count, calls_count)
+
+    def test_rate_limit(self):
+        scheduler = ApiScheduler(calls_per_second=self.calls_per_second / 2)
+        api_session = ScheduledApiSession(ApiSession(self.server.url), scheduler)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda offset: api_session('wall.get', offset=offset),
+                                        range(15)))
+        self.assertListEqual(results, list(range(15)))
+        self.assertEqual(self.server.rate_limit_errors_count, 0)
+        self.assertEqual(scheduler.get_metrics().rate_limit_errors_count, 0)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from tests.fake_api import FakeUploadServer, parse_multipart
+from vk_community.services.uploads import MultipartStream, get_upload_files, upload_files
+
+FILE_SIZE = 16 * 1024 * 1024
+WRITE_CHUNK_SIZE = 1024 * 1024
+# bound of memory allocated while uploading files (by client and server)
+PEAK_MEMORY_LIMIT = 2 * 1024 * 1024
+
+
+def generate_file(file_path: str, size: int, seed: int):
+    with open(file_path, mode='wb') as file:
+        for start in range(0, size, WRITE_CHUNK_SIZE):
+            chunk_size = min(WRITE_CHUNK_SIZE, size - start)
+            file.write(bytes([(seed + start // WRITE_CHUNK_SIZE) % 256]) * chunk_size)
+
+
+class UnitTestsUploads(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.files_paths = [os.path.join(self.path, '{}.jpg'.format(ind))
+                            for ind in range(3)]
+        for ind, file_path in enumerate(self.files_paths):
+            with open(file_path, mode='wb') as file:
+                file.write(os.urandom(1000 * ind + 10))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_multipart_stream(self):
+        files = [('file{}'.format(ind), 'pic.jpg', file_path)
+                 for ind, file_path in enumerate(self.files_paths, start=1)]
+        stream = MultipartStream(files, chunk_size=100)
+        chunks = list()
+        while True:
+            chunk = stream.read(33)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 33)
+            chunks.append(chunk)
+        body = b''.join(chunks)
+        self.assertEqual(len(body), len(stream))
+
+        body_path = os.path.join(self.path, 'body')
+        with open(body_path, mode='wb') as body_file:
+            body_file.write(body)
+        parsed_files = parse_multipart(stream.content_type, body_path)
+        for (field_name, file_name, file_path), parsed_file in zip(files, parsed_files):
+            with open(file_path, mode='rb') as file:
+                self.assertTupleEqual(parsed_file, (field_name, file_name, file.read()))
+
+        # rest of body is read by default
+        stream = MultipartStream(files)
+        self.assertEqual(len(stream.read(10)) + len(stream.read()), len(body))
+        self.assertEqual(stream.read(), b'')
+
+    def test_get_upload_files(self):
+        files = [('pic.jpg', file_path) for file_path in self.files_paths]
+        self.assertListEqual(get_upload_files(files),
+                             [('file{}'.format(ind), 'pic.jpg', file_path)
+                              for ind, file_path in enumerate(self.files_paths, start=1)])
+        self.assertListEqual(get_upload_files(files[:1]),
+                             [('file', 'pic.jpg', self.files_paths[0])])
+
+
+class IntegrationTestsUploads(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = FakeUploadServer(self.path)
+        self.server.start()
+        self.files_paths = [os.path.join(self.path, '{}.png'.format(ind))
+                            for ind in range(3)]
+        for ind, file_path in enumerate(self.files_paths):
+            generate_file(file_path, FILE_SIZE, seed=ind)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def test_upload_files(self):
+        files = [('file{}'.format(ind), 'pic.png', file_path)
+                 for ind, file_path in enumerate(self.files_paths, start=1)]
+        tracemalloc.start()
+        try:
+            upload_response = upload_files(self.server.url, files)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # files aren't loaded in memory
+        self.assertLess(peak_memory, PEAK_MEMORY_LIMIT)
+
+        (content_type, body_path), = self.server.requests
+        self.assertEqual(upload_response['body'], body_path)
+        self.assertEqual(os.path.getsize(body_path), len(MultipartStream(files)))
+        parsed_files = parse_multipart(content_type, body_path)
+        self.assertEqual(len(parsed_files), len(files))
+        for (field_name, file_name, file_path), parsed_file in zip(files, parsed_files):
+            with open(file_path, mode='rb') as file:
+                self.assertTupleEqual(parsed_file, (field_name, file_name, file.read()))
@@ -1,9 +1,13 @@
 import datetime
 import logging
 import os
-from collections import defaultdict
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from typing import List, Callable, Dict, Any, Iterable
+from itertools import chain, takewhile
+from operator import itemgetter
+from typing import List, Callable, Dict, Any, Iterable, Iterator, Optional
 from urllib.parse import urlencode, urlparse, urlunparse
 
 import PIL.Image
@@ -11,13 +15,43 @@ from selenium.webdriver.remote.webdriver import WebDriver
 from vk_app import App
 from vk_app.models.objects import VKAttachable
 from vk_app.utils import check_dir
-from vk_community.models import Photo, Post
+from vk_community.models import Photo, Post, SyncCursor
+from vk_community.services.api_cache import ResponseCache
 from vk_community.services.data_access import DataAccessObject, check_filters
-from vk_community.services.images import mark_images
+from vk_community.services.downloads import DOWNLOAD_WORKERS, Downloader
+from vk_community.services.execute import (EXECUTE_CALLS_LIMIT, ApiCall, execute_calls,
+                                           get_all_objects_by_execute, pack_calls_groups)
+from vk_community.services.images import ImageEncoder, PNG_ENCODER, mark_images
 from vk_community.services.lyrics import open_url
 from vk_community.services.parse import parse_from_vk_dev
+from vk_community.services.scheduler import (INTERACTIVE_PRIORITY, ApiScheduler,
+                                             ScheduledApiSession)
+from vk_community.services.uploads import UploadFile, get_upload_files, upload_files
 
 MAX_ATTACHMENTS_LIMIT = 10
+ALBUMS_LOADING_WORKERS = 4
+WALL_SOURCE = 'wall'
+ALBUM_SOURCE = 'album'
+# source of albums list, its cursor keeps time of reconciliation only
+ALBUMS_LIST_SOURCE = 'albums'
+# parameters of API methods selecting part of posts or photos to synchronize
+PARTIAL_SYNC_PARAMS = {'offset', 'count', 'album_ids'}
+# id of album containing photos uploaded on wall
+WALL_ALBUM_ID = -7
+UPLOADING_WORKERS = 4
+# max numbers of files uploaded by one request by attachments keys,
+# files of other attachments are uploaded one by one
+UPLOAD_FILES_LIMITS_BY_KEYS = {'photo': 5}
+# API methods deleting attachments by their keys
+DELETE_METHODS_BY_KEYS = {'photo': 'photos.delete',
+                          'video': 'video.delete',
+                          'audio': 'audio.delete',
+                          'doc': 'docs.delete'}
+
+AttachmentUpload = namedtuple('AttachmentUpload', ['index', 'key', 'file_path', 'file_name'])
+AlbumPhotos = namedtuple('AlbumPhotos', ['album_id', 'title', 'photos', 'duration', 'error'])
+PostDeletion = namedtuple('PostDeletion', ['owner_id', 'post_id', 'deleted', 'failed_calls',
+                                           'error'])
 
 
 def with_session(function: Callable[..., Any]):
@@ -32,7 +66,12 @@ def with_session(function: Callable[..., Any]):
 class CommunityApp(App):
     def __init__(self, app_id: int = 0, group_id: int = 1, user_login: str = '',
                  user_password: str = '', scope: str = '', api_version: str = '5.62',
-                 dao: DataAccessObject = DataAccessObject('sqlite:///community_app.db')):
+                 dao: DataAccessObject = DataAccessObject('sqlite:///community_app.db'),
+                 api_cache_path: str = None):
+        """
+        :param api_cache_path: path of file to cache responses
+        of read-only API methods in, responses aren't cached if it's `None`
+        """
         # it's not available to use VK developers documentation page tool
         # with access token only
         super().__init__(app_id=app_id,
@@ -40,15 +79,48 @@ class CommunityApp(App):
                          scope=scope,
                          api_version=api_version)
         self.group_id = group_id
-        self.community_info = self.api_session.groups.getById(group_id=self.group_id,
-                                                              fields='screen_name')[0]
+        # every API call is made through scheduler shared by all threads,
+        # calls of user share one access token, so one bucket keyed by login
+        self.scheduler = ApiScheduler()
+        self.api_session = ScheduledApiSession(self.api_session, self.scheduler,
+                                               bucket_key=user_login)
+        self.api_cache = None if api_cache_path is None else ResponseCache(api_cache_path)
+        params = dict(group_id=self.group_id, fields='screen_name')
+        self.community_info = self.get_or_load(
+            'groups.getById', lambda: self.api_session.groups.getById(**params),
+            **params)[0]
         self.dao = dao
 
+    def get_or_load(self, method: str, load: Callable[[], Any], **params) -> Any:
+        """Returns response of read-only API method from cache if it's enabled
+
+        :param load: function returning response of method called with `params`
+        """
+        if self.api_cache is None:
+            return load()
+        return self.api_cache.get_or_load(method, params, load)
+
+    def get_albums(self, **params) -> List[Dict[str, Any]]:
+        return self.get_or_load(
+            'photos.getAlbums',
+            lambda: get_all_objects_by_execute(self.api_session, 'photos.getAlbums', **params),
+            **params)
+
+    @property
+    def interactive_api_session(self) -> ScheduledApiSession:
+        """Session for posting which calls are made before bulk ones"""
+        return self.api_session.with_priority(INTERACTIVE_PRIORITY)
+
     def synchronize_and_mark(self, images_path: str, src: str,
-                             watermark: PIL.Image.Image,
+                             watermark: PIL.Image.Image, workers: int = 1,
+                             encoder: ImageEncoder = PNG_ENCODER,
                              **params):
+        """
+        :param workers: number of processes to mark images with
+        :param encoder: encoder of marked images files
+        """
         self.synchronize(images_path, src, **params)
-        mark_images(images_path, watermark)
+        mark_images(images_path, watermark, workers=workers, encoder=encoder)
 
     def synchronize(self, images_path: str, src: str, **params):
         """
@@ -63,44 +135,139 @@ class CommunityApp(App):
         self.synchronize_files(images_path)
 
     @with_session
-    def synchronize_dao(self, src: str, **params):
-        if src == 'album':
-            photos = self.load_albums_photos(**params)
-        elif src == 'wall':
-            photos = self.load_wall_photos(**params)
-        elif src == 'all':
-            photos = self.load_albums_photos(**params)
-            photos += self.load_wall_photos(**params)
-        else:
+    def synchronize_dao(self, src: str, incremental: bool = False, reconcile: bool = False,
+                        reconcile_interval: datetime.timedelta = None, **params):
+        """
+        Synchronization cursors (newest loaded post and photos of every album)
+        are stored in database.
+
+        :param incremental: if `True` then only posts and photos newer than cursors
+        are loaded, otherwise all of them are loaded
+        :param reconcile: if `True` then all posts and photos are loaded
+        and photos deleted from wall or albums (or with whole albums)
+        are deleted from database
+        :param reconcile_interval: if set then sources which were reconciled
+        earlier than this time ago are reconciled too
+        :param params: parameters of API methods, nothing is reconciled
+        if paging parameters ("offset", "count") or "album_ids" are passed,
+        since only part of posts or photos is loaded then
+        """
+        if src not in {'album', 'wall', 'all'}:
             err_description = ('Incorrect `src` value: {src}\n'
                                'Allowable values: "wall", "album", "all".'
                                .format(src=src))
             raise ValueError(err_description)
-        self.dao.save_photos(photos)
+        owner_id = params.setdefault('owner_id', -self.group_id)
+        cursors = self.dao.load_sync_cursors(owner_id)
+        now = datetime.datetime.utcnow()
+        partial_params = PARTIAL_SYNC_PARAMS.intersection(params)
+        if partial_params and (reconcile or reconcile_interval is not None):
+            logging.warning('Photos are not reconciled since parameters {params} '
+                            'select part of them'.format(params=sorted(partial_params)))
+
+        def is_reconciled(cursor: SyncCursor) -> bool:
+            if partial_params:
+                return False
+            return reconcile or (reconcile_interval is not None and
+                                 (cursor.reconciled_at is None or
+                                  now - cursor.reconciled_at >= reconcile_interval))
+
+        def get_cursor(source: str, album_id: int = 0) -> SyncCursor:
+            cursor = cursors.get((source, album_id))
+            if cursor is None:
+                cursor = SyncCursor(owner_id=owner_id, source=source, album_id=album_id)
+            elif not incremental or is_reconciled(cursor):
+                # objects are loaded from scratch
+                cursor.date = cursor.object_id = None
+            return cursor
+
+        photos = list()
+        synchronized_cursors = list()
+        # cursors of reconciled sources with ids of albums and all their photos
+        reconciled_albums = list()
+        # cursor of albums list and ids of existing albums if it's reconciled
+        reconciled_albums_list = None
+        if src in {'album', 'all'}:
+            albums = self.get_albums(**params)
+            albums_cursors = {album['id']: get_cursor(ALBUM_SOURCE, album['id'])
+                              for album in albums}
+            albums_list_cursor = get_cursor(ALBUMS_LIST_SOURCE)
+            if is_reconciled(albums_list_cursor):
+                reconciled_albums_list = (albums_list_cursor,
+                                          [album['id'] for album in albums])
+            reconciled_albums_ids = {album_id
+                                     for album_id, cursor in albums_cursors.items()
+                                     if is_reconciled(cursor)}
+            albums_photos = load_albums(self.api_session, albums,
+                                        cursors=albums_cursors,
+                                        **params)
+            log_albums_photos(albums_photos)
+            for album_photos in albums_photos:
+                # cursors of failed albums stay unchanged
+                if album_photos.error is not None:
+                    continue
+                cursor = albums_cursors[album_photos.album_id]
+                photos += album_photos.photos
+                synchronized_cursors.append(cursor)
+                if album_photos.album_id in reconciled_albums_ids:
+                    reconciled_albums.append((cursor, album_photos.album_id,
+                                              album_photos.photos))
+        if src in {'wall', 'all'}:
+            cursor = get_cursor(WALL_SOURCE)
+            reconciled = is_reconciled(cursor)
+            wall_photos = self.load_wall_photos(cursor=cursor, **params)
+            photos += wall_photos
+            synchronized_cursors.append(cursor)
+            if reconciled:
+                reconciled_albums.append((cursor, WALL_ALBUM_ID, wall_photos))
+        counts = self.dao.save_photos(photos, bulk=True)
+        logging.info('Photos saved: {counts}'.format(counts=counts))
+        for cursor, album_id, album_photos in reconciled_albums:
+            deleted_count = self.dao.delete_missing_photos(
+                owner_id, album_id, [photo.vk_id for photo in album_photos])
+            if deleted_count:
+                logging.info('Photos deleted from album {album_id}: {count}'
+                             .format(album_id=album_id, count=deleted_count))
+            cursor.reconciled_at = now
+        if reconciled_albums_list is not None:
+            cursor, albums_ids = reconciled_albums_list
+            # photos of deleted albums attached to wall posts are kept
+            deleted_count = self.dao.delete_missing_albums(
+                owner_id, albums_ids + [WALL_ALBUM_ID], [photo.vk_id for photo in photos])
+            if deleted_count:
+                logging.info('Photos of deleted albums deleted: {count}'
+                             .format(count=deleted_count))
+            cursor.reconciled_at = now
+            synchronized_cursors.append(cursor)
+        self.dao.save_sync_cursors(synchronized_cursors)
 
     @with_session
-    def synchronize_files(self, path: str):
-        photos = self.dao.load_photos()
-
-        files_paths = list(
-            os.path.join(root, file)
-            for root, dirs, files in os.walk(path)
-            for file in files
-            if file.endswith('.jpg')
-        )
+    def synchronize_files(self, path: str, workers: int = DOWNLOAD_WORKERS):
+        """
+        :param workers: number of threads downloading missing photos files
+        """
         check_dir(path)
-        for photo in photos:
-            logging.info(photo)
-            photo.synchronize(path, files_paths)
+        files_paths_by_names = index_files(path)
+        downloads = list()
+        for photos in self.dao.iter_photos():
+            for photo in photos:
+                logging.info(photo)
+                if synchronize_photo_file(photo, path, files_paths_by_names) is None:
+                    downloads.append((photo.link, photo.get_file_path(path)))
+        with Downloader(workers=workers) as downloader:
+            report = downloader.download(downloads)
+        logging.info('Photos files downloaded: {count}, failed: {failed_count}'
+                     .format(count=report.files_count,
+                             failed_count=len(report.failures)))
 
+    @with_session
     def synchronize_wall_posts(self, **params):
         params.setdefault('owner_id', -self.group_id)
         filters = dict(posted=1)
         check_filters(filters)
-        posted_photos = self.dao.load_photos(**filters)
-        if posted_photos:
-            posted_photos.sort(key=lambda x: (x.date_time, x.object_id), reverse=True)
-            first_posted_photo_date = posted_photos[-1].date_time
+        first_posted_photos = next(self.dao.iter_photos(batch_size=1, **filters), [])
+        if first_posted_photos:
+            first_posted_photo_date = first_posted_photos[0].date_time
             posts = self.load_posts(**params)
             posts.sort(key=lambda x: (x.date_time, x.object_id))
             posts_for_delete = list()
@@ -109,20 +276,23 @@ class CommunityApp(App):
                     posts_for_delete.append(post)
                 else:
                     break
-            for post_for_delete in posts_for_delete:
-                self.delete_wall_post(post_for_delete)
+            posts_deletions = self.delete_wall_posts(posts_for_delete)
+            logging.info('Posts deleted: {count}/{total}'
+                         .format(count=sum(post_deletion.deleted
+                                           for post_deletion in posts_deletions),
+                                 total=len(posts_deletions)))
             last_post_date = posts[-1].date_time
-            unposted_photos = list()
-            for ind, posted_photo in enumerate(posted_photos):
-                if posted_photo.date_time > last_post_date:
-                    posted_photo.posted = False
-                    unposted_photos.append(posted_photo)
-                else:
-                    break
+            posted_photos = chain.from_iterable(self.dao.iter_photos(descending=True,
+                                                                     **filters))
+            unposted_photos = list(takewhile(
+                lambda posted_photo: posted_photo.date_time > last_post_date,
+                posted_photos))
+            for unposted_photo in unposted_photos:
+                unposted_photo.posted = False
             self.dao.save_photos(unposted_photos)
 
-    def load_wall_photos(self, **params):
-        posts = self.load_posts(**params)
+    def load_wall_photos(self, cursor: SyncCursor = None, **params):
+        posts = self.load_posts(cursor=cursor, **params)
         photos = [attachable
                   for post in posts
                   for attachment in post.attachments
@@ -130,10 +300,21 @@ class CommunityApp(App):
                   if key == Photo.key()]
         return photos
 
-    def load_posts(self, *, web_driver: WebDriver = None, **params) -> List[Post]:
+    def load_posts(self, *, web_driver: WebDriver = None, cursor: SyncCursor = None,
+                   **params) -> List[Post]:
+        """
+        :param cursor: if set then only posts newer than it are loaded
+        (if loaded with API) and cursor is moved to the newest of them
+        """
         params.setdefault('owner_id', -self.group_id)
         if web_driver is None:
-            raw_posts = self.get_all_objects('wall.get', **params)
+            stop = None
+            if cursor is not None:
+                # pinned post goes first regardless of its date
+                def stop(raw_post: Dict[str, Any]) -> bool:
+                    return not raw_post.get('is_pinned') and cursor.is_known(raw_post)
+            raw_posts = get_all_objects_by_execute(self.api_session, 'wall.get',
+                                                   stop=stop, **params)
         else:
             open_url('https://vk.com', web_driver)
             login = web_driver.find_element_by_xpath('//*[@id="index_email"]')
@@ -162,33 +343,69 @@ class CommunityApp(App):
                 url = urlunparse(url_parts)
                 response = parse_from_vk_dev(url, web_driver)['response']
                 raw_posts += response['items']
+        if cursor is not None:
+            cursor.update(raw_posts)
         return [Post.from_raw(raw_post) for raw_post in raw_posts]
 
     def delete_wall_post(self, wall_post: Post):
-        for attachment in wall_post.attachments:
-            for key, vk_attachment in attachment:
-                params = {'owner_id': vk_attachment.owner_id,
-                          '{}_id'.format(key): vk_attachment.object_id}
-                self.api_session.__call__('{}.delete'.format(key), **params)
-        values = dict(owner_id=wall_post.owner_id, post_id=wall_post.object_id)
-        self.api_session.wall.delete(**values)
-
-    def load_albums_photos(self, **params) -> List[Photo]:
-        params.setdefault('owner_id', -self.group_id)
+        for method, params in get_post_deletion_calls(wall_post):
+            self.api_session.__call__(method, **params)
 
-        albums = self.get_all_objects('photos.getAlbums', **params)
+    def delete_wall_posts(self, posts: Iterable[Post]) -> List[PostDeletion]:
+        """Deletes posts with their attachments by "execute" requests
 
-        photos = list()
-        for album in albums:
-            album_title = album['title']
-            params['album_id'] = album['id']
-            raw_photos = self.get_all_objects('photos.get', **params)
-            album_photos = [Photo.from_raw(raw_photo)
-                            for raw_photo in raw_photos]
-            for album_photo in album_photos:
-                album_photo.album = album_title
+        Calls deleting post and its attachments are made by the same request,
+        so interrupted deletion stops between posts
+        and can be resumed with posts which are still on wall.
 
-            photos += album_photos
+        :returns: reports of posts deletion in same order as posts
+        """
+        posts_deletions = list()
+        posts_calls = ((post, get_post_deletion_calls(post)) for post in posts)
+        posts_calls_batches = pack_calls_groups(posts_calls, key=itemgetter(1))
+        for posts_calls_batch in posts_calls_batches:
+            calls = [call for _, post_calls in posts_calls_batch for call in post_calls]
+            try:
+                results = execute_calls(self.api_session, calls)
+            except Exception as err:
+                logging.error('Failed to delete posts: {error}'.format(error=err))
+                results = None
+                error = err
+            else:
+                error = None
+            results_iterator = iter(results or [])
+            for post, post_calls in posts_calls_batch:
+                if results is None:
+                    failed_calls = post_calls
+                else:
+                    failed_calls = [call
+                                    for call, result in zip(post_calls, results_iterator)
+                                    if result is False]
+                posts_deletions.append(PostDeletion(
+                    owner_id=post.owner_id,
+                    post_id=post.object_id,
+                    # "wall.delete" goes last
+                    deleted=post_calls[-1] not in failed_calls,
+                    failed_calls=failed_calls,
+                    error=error))
+        return posts_deletions
+
+    def load_albums_photos(self, workers: int = ALBUMS_LOADING_WORKERS,
+                           **params) -> List[Photo]:
+        """
+        :param workers: number of albums loaded concurrently,
+        photos of albums failed to load are skipped
+        """
+        params.setdefault('owner_id', -self.group_id)
+
+        albums = self.get_albums(**params)
+        albums_photos = load_albums(self.api_session, albums,
+                                    workers=workers,
+                                    **params)
+        log_albums_photos(albums_photos)
+        photos = list()
+        for album_photos in albums_photos:
+            photos += album_photos.photos
 
         return photos
 
@@ -213,61 +430,95 @@ class CommunityApp(App):
         attachments = ','.join('{key}{vk_id}'.format(key=key, vk_id=content.vk_id)
                                for attachment in post.attachments
                                for key, content in attachment.items())
-        response = self.api_session.wall.post(message=message,
-                                              attachments=attachments,
-                                              **params)
+        response = self.interactive_api_session.wall.post(message=message,
+                                                          attachments=attachments,
+                                                          **params)
         return response['post_id']
 
     def reload_attachments(self, attachments: List[Dict[str, VKAttachable]],
-                           reload_path: str, **kwargs) -> List[Dict[str, VKAttachable]]:
-        reloaded_attachments = download_attachments(attachments, reload_path, **kwargs)
+                           reload_path: str, workers: int = UPLOADING_WORKERS,
+                           **kwargs) -> List[Dict[str, VKAttachable]]:
+        """Uploads attachments files on VK servers
+
+        Attachments which can't be downloaded are left as is.
 
-        attachables_files = defaultdict(list)
+        :returns: new attachments in same order as original ones
+        """
+        unloaded_attachments = download_attachments(attachments, reload_path, **kwargs)
+        unloaded_attachables_ids = {id(attachable)
+                                    for attachment in unloaded_attachments
+                                    for attachable in attachment.values()}
+
+        new_attachments = [dict() for _ in attachments]
+        attachables_uploads = defaultdict(list)
         for ind, attachment in enumerate(attachments):
-            if attachment in reloaded_attachments:
-                continue
-            for attachable in attachment.values():
+            for key, attachable in attachment.items():
+                if id(attachable) in unloaded_attachables_ids:
+                    new_attachments[ind][key] = attachable
+                    continue
                 file_path = attachable.get_file_path(reload_path)
                 file_name = ''.join([attachable.key(),
                                      str(ind),
                                      attachable.get_file_extension()])
-                with open(file_path, mode='rb') as file:
-                    attachable_file = ('file', (file_name, file.read()))
-                attachables_files[type(attachable)].append(attachable_file)
-
-        for attachable_type, files in attachables_files.items():
-            get_upload_server_method = (attachable_type
-                                        .getUploadServer_method(dst_type='wall'))
-            upload_url = self.get_upload_server_url(get_upload_server_method,
-                                                    group_id=self.group_id)
-
-            save_method = attachable_type.save_method(dst_type='wall')
-            response = [self.upload_files_on_vk_server(save_method, upload_url,
-                                                       files=[file],
-                                                       group_id=self.group_id)
-                        for file in files]
-
-            vk_attachables = list()
-            for raw_vk_attachment in response:
-                if isinstance(raw_vk_attachment, list):
-                    raw_vk_attachment, = raw_vk_attachment
-
-                vk_attachables.append(
-                    attachable_type.from_raw(raw_vk_attachment))
-
-            reloaded_attachments.extend([{vk_attachable.key(): vk_attachable}
-                                         for vk_attachable in vk_attachables])
-
-        ordered_new_attachments = list()
-        for attachment in attachments:
-            due_attachment = next(new_attachment
-                                  for new_attachment in reloaded_attachments
-                                  if new_attachment.keys() == attachment.keys())
-            reloaded_attachments.remove(due_attachment)
-            ordered_new_attachments.append(due_attachment)
-        return ordered_new_attachments
-
-    def post_random_photos_on_community_wall(self, images_path: str, **filters: dict):
+                upload = AttachmentUpload(index=ind, key=key,
+                                          file_path=file_path, file_name=file_name)
+                attachables_uploads[type(attachable)].append(upload)
+
+        attachables_types = list(attachables_uploads)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            vk_attachables_by_types = executor.map(
+                lambda attachable_type: self.upload_attachables(
+                    attachable_type, attachables_uploads[attachable_type]),
+                attachables_types)
+            for attachable_type, vk_attachables in zip(attachables_types,
+                                                       vk_attachables_by_types):
+                for upload, vk_attachable in zip(attachables_uploads[attachable_type],
+                                                 vk_attachables):
+                    new_attachments[upload.index][upload.key] = vk_attachable
+        return new_attachments
+
+    def stream_files_on_vk_server(self, save_method: str, upload_url: str,
+                                  files: List[UploadFile], **params) -> Any:
+        """Uploads files streaming them from disk and saves them by API method
+
+        :returns: response of saving method
+        """
+        upload_response = upload_files(upload_url, files)
+        params.update(upload_response)
+        return self.interactive_api_session.__call__(save_method, **params)
+
+    def upload_attachables(self, attachable_type: type,
+                           uploads: List[AttachmentUpload]) -> List[VKAttachable]:
+        """Uploads files of attachables of same type by batches
+
+        :returns: new attachables in same order as uploads
+        """
+        get_upload_server_method = attachable_type.getUploadServer_method(dst_type='wall')
+        upload_url = self.get_upload_server_url(get_upload_server_method,
+                                                group_id=self.group_id)
+        save_method = attachable_type.save_method(dst_type='wall')
+        files_limit = UPLOAD_FILES_LIMITS_BY_KEYS.get(attachable_type.key(), 1)
+        vk_attachables = list()
+        for uploads_batch in pack_uploads(uploads, files_limit):
+            files = get_upload_files([(upload.file_name, upload.file_path)
+                                      for upload in uploads_batch])
+            response = self.stream_files_on_vk_server(save_method, upload_url,
+                                                      files=files,
+                                                      group_id=self.group_id)
+            raw_vk_attachables = response if isinstance(response, list) else [response]
+            if len(raw_vk_attachables) != len(uploads_batch):
+                err_description = ('Number of saved attachments ({count}) '
+                                   'differs from number of uploaded files ({files_count}).'
+                                   .format(count=len(raw_vk_attachables),
+                                           files_count=len(uploads_batch)))
+                raise RuntimeError(err_description)
+            vk_attachables.extend(attachable_type.from_raw(raw_vk_attachable)
+                                  for raw_vk_attachable in raw_vk_attachables)
+        return vk_attachables
+
+    def post_random_photos_on_community_wall(self, images_path: str,
+                                             encoder: ImageEncoder = PNG_ENCODER,
+                                             **filters: dict):
         check_filters(filters)
         filters['random'] = True
         filters['limit'] = filters.get('limit', 1)
@@ -275,11 +526,17 @@ class CommunityApp(App):
         random_photos = self.dao.load_photos(**filters)
         self.post_photos_on_community_wall(random_photos,
                                            images_path=images_path,
-                                           marked=filters.get('marked', False))
+                                           marked=filters.get('marked', False),
+                                           encoder=encoder)
 
     @with_session
     def post_photos_on_community_wall(self, photos: List[Photo], images_path: str,
-                                      marked=False):
+                                      marked=False,
+                                      encoder: ImageEncoder = PNG_ENCODER) -> Dict[str, int]:
+        """
+        :param encoder: encoder which marked images were saved with
+        :returns: ids of posts by ids of posted photos
+        """
         if len(photos) > MAX_ATTACHMENTS_LIMIT:
             logging.warning("Too many photos to post: {count}, "
                             "max available: {limit}"
@@ -291,21 +548,21 @@ class CommunityApp(App):
         upload_server_method = Photo.getUploadServer_method(dst_type='wall')
         upload_url = self.get_upload_server_url(upload_server_method, **params)
 
-        images_contents = [photo.get_file_content(images_path, marked=marked)
-                           for photo in photos]
+        images_paths = [photo.get_upload_file_path(images_path, marked=marked,
+                                                   encoder=encoder)
+                        for photo in photos]
         pic_tag = 'pic'
         image_name = ''.join([pic_tag,
-                              Photo.MARKED_FILE_EXTENSION if marked
+                              encoder.file_extension if marked
                               else Photo.FILE_EXTENSION])
-        images = [('file{}'.format(ind), (image_name, image_content))
-                  for ind, image_content in enumerate(images_contents)]
+        images = get_upload_files([(image_name, image_path) for image_path in images_paths])
 
         save_method = Photo.save_method(dst_type='wall')
-        raw_photos = self.upload_files_on_vk_server(save_method, upload_url, images,
+        raw_photos = self.stream_files_on_vk_server(save_method, upload_url, images,
                                                     **params)
 
-        for ind, raw_photo in enumerate(raw_photos):
-            photo = photos[ind]
+        calls = list()
+        for photo, raw_photo in zip(photos, raw_photos):
             tags = [pic_tag, photo.album.replace(' ', '_')]
             tags_str = '\n'.join('#{}@{}'.format(tag, self.community_info['screen_name'])
                                  for tag in tags)
@@ -315,15 +572,157 @@ class CommunityApp(App):
                 key=Photo.key(),
                 owner_id=raw_photo['owner_id'],
                 object_id=raw_photo['id'])
-
-            self.api_session.wall.post(owner_id=-self.group_id,
-                                       attachments=attachment_str,
-                                       message=message)
-
-            photo.posted = True
-            photo.date_time = datetime.datetime.utcnow()
-
-        self.dao.save_photos(photos)
+            calls.append(('wall.post', dict(owner_id=-self.group_id,
+                                            attachments=attachment_str,
+                                            message=message)))
+        return self.publish_photos_posts(photos, calls)
+
+    def publish_photos_posts(self, photos: List[Photo], calls: List[ApiCall],
+                             batch_size: int = EXECUTE_CALLS_LIMIT) -> Dict[str, int]:
+        """Makes "wall.post" calls of photos by "execute" requests
+
+        Posted photos are saved after every request,
+        so photos which are on wall are marked as posted
+        even if next requests fail,
+        photos of failed calls are left not posted.
+
+        :param calls: "wall.post" calls of photos in same order as photos
+        :returns: ids of posts by ids of posted photos
+        """
+        posts_ids_by_photos_ids = dict()
+        for start in range(0, len(calls), batch_size):
+            photos_batch = photos[start:start + batch_size]
+            results = execute_calls(self.interactive_api_session,
+                                    calls[start:start + batch_size],
+                                    calls_limit=batch_size)
+            posted_photos = list()
+            for photo, result in zip(photos_batch, results):
+                if result is False:
+                    logging.error('Failed to post photo {vk_id}'.format(vk_id=photo.vk_id))
+                    continue
+                photo.posted = True
+                photo.date_time = datetime.datetime.utcnow()
+                posts_ids_by_photos_ids[photo.vk_id] = result['post_id']
+                posted_photos.append(photo)
+            self.dao.save_photos(posted_photos)
+        return posts_ids_by_photos_ids
+
+
+def load_albums(api_session, albums: List[Dict[str, Any]],
+                workers: int = ALBUMS_LOADING_WORKERS,
+                cursors: Dict[int, SyncCursor] = None,
+                **params) -> List[AlbumPhotos]:
+    """Loads photos of albums by `workers` threads
+
+    Failure of album loading doesn't stop loading of other albums.
+
+    :param albums: raw albums returned by "photos.getAlbums" method
+    :param cursors: synchronization cursors by albums ids,
+    only photos newer than cursor are loaded for album with cursor
+    and cursor is moved to the newest of them if album is loaded successfully
+    :returns: loading results in same order as albums
+    """
+    cursors = cursors or dict()
+
+    def load_album_photos(album: Dict[str, Any]) -> AlbumPhotos:
+        start = time.perf_counter()
+        album_params = dict(params, album_id=album['id'])
+        cursor = cursors.get(album['id'])
+        stop = None
+        if cursor is not None and cursor.date is not None:
+            # newest photos go first
+            album_params['rev'] = 1
+            stop = cursor.is_known
+        try:
+            raw_photos = get_all_objects_by_execute(api_session, 'photos.get',
+                                                    stop=stop,
+                                                    **album_params)
+        except Exception as err:
+            photos = list()
+            error = err
+        else:
+            if cursor is not None:
+                cursor.update(raw_photos)
+            photos = [Photo.from_raw(raw_photo) for raw_photo in raw_photos]
+            for photo in photos:
+                photo.album = album['title']
+            error = None
+        return AlbumPhotos(album_id=album['id'],
+                           title=album['title'],
+                           photos=photos,
+                           duration=time.perf_counter() - start,
+                           error=error)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(load_album_photos, albums))
+
+
+def get_post_deletion_calls(post: Post) -> List[ApiCall]:
+    """Returns API calls deleting attachments of post and post itself"""
+    calls = list()
+    for attachment in post.attachments:
+        for key, vk_attachment in attachment.items():
+            method = DELETE_METHODS_BY_KEYS.get(key, '{}.delete'.format(key))
+            params = {'owner_id': vk_attachment.owner_id,
+                      '{}_id'.format(key): vk_attachment.object_id}
+            calls.append((method, params))
+    calls.append(('wall.delete', dict(owner_id=post.owner_id, post_id=post.object_id)))
+    return calls
+
+
+def pack_uploads(uploads: List[AttachmentUpload],
+                 files_limit: int) -> Iterator[List[AttachmentUpload]]:
+    for start in range(0, len(uploads), files_limit):
+        yield uploads[start:start + files_limit]
+
+
+def log_albums_photos(albums_photos: Iterable[AlbumPhotos]):
+    for album_photos in albums_photos:
+        if album_photos.error is None:
+            logging.info('Album "{title}": {count} photos loaded in {duration:.2f}s'
+                         .format(title=album_photos.title,
+                                 count=len(album_photos.photos),
+                                 duration=album_photos.duration))
+        else:
+            logging.error('Album "{title}" failed to load in {duration:.2f}s: {error}'
+                          .format(title=album_photos.title,
+                                  duration=album_photos.duration,
+                                  error=album_photos.error))
+
+
+def index_files(path: str, file_extension: str = Photo.FILE_EXTENSION) -> Dict[str, str]:
+    """Returns paths of files with given extension under `path` by files names
+
+    Names of photos files are made of their ids,
+    so photo file can be found by name wherever it's placed.
+    """
+    files_paths_by_names = dict()
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            if file_name.endswith(file_extension):
+                files_paths_by_names.setdefault(file_name, os.path.join(root, file_name))
+    return files_paths_by_names
+
+
+def synchronize_photo_file(photo: Photo, path: str,
+                           files_paths_by_names: Dict[str, str]) -> Optional[str]:
+    """Moves photo file to its path if photo album or date changed
+
+    :param files_paths_by_names: index returned by `index_files`,
+    it's updated with new path of photo file
+    :returns: path of photo file or `None` if there is no such file
+    and it should be downloaded
+    """
+    file_path = photo.get_file_path(path)
+    file_name = os.path.basename(file_path)
+    old_file_path = files_paths_by_names.get(file_name)
+    if old_file_path is None:
+        return None
+    if old_file_path != file_path:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(old_file_path, file_path)
+        files_paths_by_names[file_name] = file_path
+    return file_path
 
 
 def download_attachments(attachments: Iterable[Dict[str, VKAttachable]],
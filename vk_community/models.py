@@ -1,14 +1,16 @@
+import random
 import typing
 
 from mutagen import File, id3
 from selenium.webdriver.remote.webdriver import WebDriver
-from sqlalchemy import Column, String, Boolean
+from sqlalchemy import Column, String, Boolean, DateTime, Float, Index, Integer
 from sqlalchemy.ext.declarative import declarative_base
 from vk_app.models import VKPhoto, VKAudio, VKPost
 from vk_app.models.objects import VKAttachable
 from vk_app.utils import (map_non_primary_columns_by_ancestor, get_year_month_date,
                           get_valid_dirs, get_all_subclasses)
 
+from vk_community.services.images import ImageEncoder, PNG_ENCODER, get_marked_image_path
 from vk_community.services.lyrics import (load_lyrics_from_musixmatch,
                                           load_lyrics_from_wikia,
                                           load_lyrics_from_azlyrics,
@@ -17,6 +19,10 @@ from vk_community.services.lyrics import (load_lyrics_from_musixmatch,
 Base = declarative_base()
 
 
+def generate_random_key() -> float:
+    return random.random()
+
+
 class Photo(VKPhoto, Base):
     __tablename__ = 'photos'
     __table_args__ = {
@@ -25,12 +31,36 @@ class Photo(VKPhoto, Base):
 
     vk_id = Column(String(255), primary_key=True)
     posted = Column(Boolean, default=False)
+    # uniformly distributed key for sampling random photos by index
+    random_key = Column(Float, default=generate_random_key, index=True)
 
     def get_file_subdirs(self) -> typing.List[str]:
         year_month_date = get_year_month_date(self.date_time)
         image_subdirs = get_valid_dirs(self.album, year_month_date)
         return image_subdirs
 
+    def get_file_content(self, path: str, marked: bool = False,
+                         encoder: ImageEncoder = PNG_ENCODER) -> bytes:
+        """
+        :param encoder: encoder which marked image was saved with
+        """
+        if not marked:
+            return super().get_file_content(path)
+        file_path = self.get_upload_file_path(path, marked=True, encoder=encoder)
+        with open(file_path, mode='rb') as file:
+            return file.read()
+
+    def get_upload_file_path(self, path: str, marked: bool = False,
+                             encoder: ImageEncoder = PNG_ENCODER) -> str:
+        """Returns path of image file to upload
+
+        :param encoder: encoder which marked image was saved with
+        """
+        file_path = self.get_file_path(path)
+        if not marked:
+            return file_path
+        return get_marked_image_path(file_path, encoder=encoder)
+
 
 class Audio(VKAudio, Base):
     __tablename__ = 'audio'
@@ -70,6 +100,53 @@ class Audio(VKAudio, Base):
 map_non_primary_columns_by_ancestor(ancestor=VKPhoto, inheritor=Photo)
 map_non_primary_columns_by_ancestor(ancestor=VKAudio, inheritor=Audio)
 
+# indexes are declared after mapping of inherited columns they use
+# iterating and synchronizing photos in order of keyset pagination
+Index('ix_photos_date_time_vk_id', Photo.date_time, Photo.vk_id)
+# posted/unposted photos filtered by date and ordered like above
+Index('ix_photos_posted_date_time_vk_id', Photo.posted, Photo.date_time, Photo.vk_id)
+# sampling random unposted photos
+Index('ix_photos_posted_random_key', Photo.posted, Photo.random_key)
+# filtering by albums
+Index('ix_photos_album_posted_date_time', Photo.album, Photo.posted, Photo.date_time)
+# filtering by owner
+Index('ix_photos_owner_id_date_time', Photo.owner_id, Photo.date_time)
+
+
+class SyncCursor(Base):
+    """Newest post or photo loaded from source of community photos
+
+    Sources are wall (with album id 0) and photos albums,
+    cursor of albums list (with album id 0) keeps time of its reconciliation only,
+    objects are compared by creation time and id like they are ordered by VK API.
+    """
+    __tablename__ = 'sync_cursors'
+    __table_args__ = {
+        'mysql_charset': 'utf8'
+    }
+
+    owner_id = Column(Integer, primary_key=True, autoincrement=False)
+    source = Column(String(255), primary_key=True)
+    album_id = Column(Integer, primary_key=True, autoincrement=False)
+    # UNIX time of creation and id of newest object
+    date = Column(Integer)
+    object_id = Column(Integer)
+    # time of last full synchronization (in UTC)
+    reconciled_at = Column(DateTime)
+
+    def is_known(self, raw_object: typing.Dict[str, typing.Any]) -> bool:
+        """Checks if raw object is not newer than objects loaded before"""
+        if self.date is None:
+            return False
+        return (raw_object['date'], raw_object['id']) <= (self.date, self.object_id)
+
+    def update(self, raw_objects: typing.Iterable[typing.Dict[str, typing.Any]]):
+        """Moves cursor to the newest of objects"""
+        for raw_object in raw_objects:
+            if not self.is_known(raw_object):
+                self.date = raw_object['date']
+                self.object_id = raw_object['id']
+
 
 class Post(VKPost):
     VK_ATTACHABLE_BY_KEY = {inheritor.key(): inheritor
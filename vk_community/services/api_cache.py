@@ -0,0 +1,162 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+# seconds which responses of read-only methods are kept for
+API_CACHE_TTLS = {'groups.getById': 24 * 60 * 60,
+                  'photos.getAlbums': 60 * 60}
+# max total size of cached responses in bytes
+API_CACHE_MAX_SIZE = 16 * 1024 * 1024
+# seconds to wait for database locked by other process
+LOCK_TIMEOUT = 10.
+
+ResponseCacheInfo = namedtuple('ResponseCacheInfo', ['hits', 'misses', 'hit_rate', 'max_size',
+                                                     'size', 'entries_count'])
+ResponseCacheEntry = namedtuple('ResponseCacheEntry', ['method', 'params', 'size',
+                                                       'created', 'expires'])
+
+
+class ResponseCache:
+    """On-disk cache of responses of read-only API methods
+
+    Responses are kept in SQLite database file,
+    so they are shared by short-lived processes,
+    every method of `ttls` has its own time to live,
+    least recently used responses are evicted
+    when total size of responses exceeds `max_size`,
+    responses of other methods aren't cached.
+    """
+
+    def __init__(self, path: str, ttls: Dict[str, float] = None,
+                 max_size: int = API_CACHE_MAX_SIZE):
+        self.path = path
+        self.ttls = API_CACHE_TTLS if ttls is None else ttls
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                               'key TEXT PRIMARY KEY, '
+                               'method TEXT NOT NULL, '
+                               'params TEXT NOT NULL, '
+                               'response TEXT NOT NULL, '
+                               'size INTEGER NOT NULL, '
+                               'created REAL NOT NULL, '
+                               'expires REAL NOT NULL, '
+                               'accessed REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                               'ON responses (accessed)')
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Yields connection committing its transaction on success and closing it"""
+        connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_or_load(self, method: str, params: Dict[str, Any],
+                    load: Callable[[], Any]) -> Any:
+        """Returns cached response or response returned by `load` caching it"""
+        response = self.get(method, params)
+        if response is None:
+            response = load()
+            self.put(method, params, response)
+        return response
+
+    def get(self, method: str, params: Dict[str, Any]) -> Any:
+        """Returns cached response or `None` if it's missing or expired"""
+        if method not in self.ttls:
+            return None
+        now = time.time()
+        key = get_key(method, params)
+        with self.connect() as connection:
+            row = connection.execute('SELECT response FROM responses '
+                                     'WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                                   (now, key))
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, method: str, params: Dict[str, Any], response: Any):
+        if method not in self.ttls or response is None:
+            return
+        serialized_response = json.dumps(response)
+        size = len(serialized_response.encode('utf-8'))
+        if size > self.max_size:
+            return
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO responses '
+                               '(key, method, params, response, size, '
+                               'created, expires, accessed) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (get_key(method, params), method, dump_params(params),
+                                serialized_response, size,
+                                now, now + self.ttls[method], now))
+            self.evict(connection, now)
+
+    def evict(self, connection: sqlite3.Connection, now: float):
+        """Removes expired responses and then least recently used ones
+        until total size fits in `max_size`"""
+        connection.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+        size, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if size <= self.max_size:
+            return
+        evicted_keys = list()
+        for key, response_size in connection.execute('SELECT key, size FROM responses '
+                                                      'ORDER BY accessed').fetchall():
+            if size <= self.max_size:
+                break
+            evicted_keys.append((key,))
+            size -= response_size
+        connection.executemany('DELETE FROM responses WHERE key = ?', evicted_keys)
+
+    def clear(self, methods: Iterable[str] = None) -> int:
+        """Removes responses of given methods or all ones, returns their number"""
+        with self.connect() as connection:
+            if methods is None:
+                cursor = connection.execute('DELETE FROM responses')
+            else:
+                cursor = connection.executemany('DELETE FROM responses WHERE method = ?',
+                                                [(method,) for method in methods])
+            return cursor.rowcount
+
+    def get_entries(self) -> List[ResponseCacheEntry]:
+        with self.connect() as connection:
+            rows = connection.execute('SELECT method, params, size, created, expires '
+                                      'FROM responses ORDER BY method, created').fetchall()
+        return [ResponseCacheEntry(method=method, params=json.loads(params), size=size,
+                                   created=created, expires=expires)
+                for method, params, size, created, expires in rows]
+
+    def cache_info(self) -> ResponseCacheInfo:
+        with self.connect() as connection:
+            entries_count, size = connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        with self.lock:
+            requests = self.hits + self.misses
+            return ResponseCacheInfo(hits=self.hits, misses=self.misses,
+                                     hit_rate=self.hits / requests if requests else 0.,
+                                     max_size=self.max_size, size=size,
+                                     entries_count=entries_count)
+
+
+def dump_params(params: Dict[str, Any]) -> str:
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def get_key(method: str, params: Dict[str, Any]) -> str:
+    return '{method}?{params}'.format(method=method, params=dump_params(params))
@@ -1,16 +1,178 @@
+import logging
+import random
+from collections import OrderedDict, namedtuple
 from datetime import datetime
-from typing import List
+from functools import partial
+from importlib import import_module
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql.expression import func
-from vk_community.models import Photo
+from sqlalchemy import create_engine, event, inspect, Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, make_transient_to_detached, Query
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.expression import and_, func, or_, ColumnElement, Insert
+from vk_community.models import Photo, SyncCursor, generate_random_key
+
+# default limit of number of bound parameters of SQLite statement (before 3.32)
+BOUND_PARAMETERS_LIMIT = 999
+# number of rows deleted or updated by one statement
+SAVING_CHUNK_SIZE = 100
+ITERATION_BATCH_SIZE = 1000
+# write-ahead logging lets readers work with SQLite database file
+# concurrently with writer, busy timeout (in milliseconds)
+# makes connections wait for locks instead of failing immediately
+WAL_SQLITE_PRAGMAS = OrderedDict([('journal_mode', 'WAL'),
+                                  ('synchronous', 'NORMAL'),
+                                  ('busy_timeout', 5000)])
+# formats of dates histograms bins for `strftime`-like functions (SQLite, MySQL)
+# and for PostgreSQL `to_char`
+DATE_FORMATS_BY_PERIODS = OrderedDict([
+    ('day', dict(strftime='%Y-%m-%d', to_char='YYYY-MM-DD')),
+    ('month', dict(strftime='%Y-%m', to_char='YYYY-MM')),
+    ('year', dict(strftime='%Y', to_char='YYYY')),
+])
+
+SavingCounts = namedtuple('SavingCounts', ['inserted', 'updated'])
+QueryCacheInfo = namedtuple('QueryCacheInfo', ['hits', 'misses', 'hit_rate', 'max_size', 'size'])
+
+
+def on_conflict_upsert(insert: Callable[[Table], Insert],
+                       table: Table, rows: List[Dict[str, Any]]) -> Insert:
+    statement = insert(table).values(rows)
+    primary_keys = [column.name for column in table.primary_key]
+    updated_values = {key: statement.excluded[key]
+                      for key in rows[0]
+                      if key not in primary_keys}
+    if not updated_values:
+        return statement.on_conflict_do_nothing(index_elements=primary_keys)
+    return statement.on_conflict_do_update(index_elements=primary_keys,
+                                           set_=updated_values)
+
+
+def on_duplicate_key_upsert(insert: Callable[[Table], Insert],
+                            table: Table, rows: List[Dict[str, Any]]) -> Insert:
+    statement = insert(table).values(rows)
+    primary_keys = [column.name for column in table.primary_key]
+    updated_values = {key: statement.inserted[key]
+                      for key in rows[0]
+                      if key not in primary_keys}
+    if not updated_values:
+        # updating primary key with itself is a no-op
+        updated_values = {key: statement.inserted[key] for key in primary_keys}
+    return statement.on_duplicate_key_update(**updated_values)
+
+
+def get_upsert_by_dialect() -> Dict[str, Callable[[Table, List[Dict[str, Any]]], Insert]]:
+    """Returns upsert statements factories by names of dialects
+    which native conflict handling is supported by installed SQLAlchemy version"""
+    upsert_by_dialect = dict()
+    for dialect_name, upsert in [('postgresql', on_conflict_upsert),
+                                 ('sqlite', on_conflict_upsert),
+                                 ('mysql', on_duplicate_key_upsert)]:
+        try:
+            dialect_module = import_module('sqlalchemy.dialects.' + dialect_name)
+            insert = dialect_module.insert
+        except (ImportError, AttributeError):
+            continue
+        upsert_by_dialect[dialect_name] = partial(upsert, insert)
+    return upsert_by_dialect
+
+
+UPSERT_BY_DIALECT = get_upsert_by_dialect()
+
+
+class QueryCache:
+    """Bounded LRU cache of query results keyed by normalized filters"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filters: Dict[str, Any]) -> Any:
+        key = get_filters_key(filters)
+        try:
+            result = self.results[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.results.move_to_end(key)
+        return result
+
+    def put(self, filters: Dict[str, Any], result: Any):
+        key = get_filters_key(filters)
+        self.results[key] = result
+        self.results.move_to_end(key)
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+
+    def cache_info(self) -> QueryCacheInfo:
+        requests = self.hits + self.misses
+        return QueryCacheInfo(hits=self.hits, misses=self.misses,
+                              hit_rate=self.hits / requests if requests else 0.,
+                              max_size=self.max_size, size=len(self.results))
 
 
 class DataAccessObject:
-    def __init__(self, database_url: str):
-        self.engine = create_engine(database_url, echo=False)
-        self.session_maker = sessionmaker(bind=self.engine)
+    def __init__(self, database_url: str, pool_size: int = None, max_overflow: int = None,
+                 pool_recycle: int = None, pool_pre_ping: bool = None,
+                 sqlite_pragmas: Dict[str, Any] = None, query_cache_size: int = 0):
+        """
+        Engine is created on first use, so creating of object does no database work.
+
+        Connection pool parameters are passed to `sqlalchemy.create_engine`
+        if they are set (`pool_pre_ping` requires SQLAlchemy 1.2+),
+        note that `pool_size` and `max_overflow` are not available
+        for SQLite file databases which don't use queue pool.
+
+        :param pool_recycle: seconds after which connection is reopened
+        :param sqlite_pragmas: pragmas set on every new SQLite connection,
+        e.g. `WAL_SQLITE_PRAGMAS` for sharing database file between processes
+        :param query_cache_size: max number of cached `load_photos` results,
+        cache is disabled if it equals 0, note that it's cleared by saving photos
+        with this object only, so it shouldn't be used if photos table
+        is modified by other processes, it's bypassed while session
+        has unflushed changes
+        """
+        self.database_url = database_url
+        engine_params = dict(pool_size=pool_size,
+                             max_overflow=max_overflow,
+                             pool_recycle=pool_recycle,
+                             pool_pre_ping=pool_pre_ping)
+        self.engine_params = {key: value
+                              for key, value in engine_params.items()
+                              if value is not None}
+        self.sqlite_pragmas = sqlite_pragmas or dict()
+        self._engine = None
+        self._session_maker = None
+        self.query_cache = QueryCache(query_cache_size) if query_cache_size else None
+
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            engine = create_engine(self.database_url, echo=False, **self.engine_params)
+            if engine.dialect.name == 'sqlite' and self.sqlite_pragmas:
+                event.listen(engine, 'connect', self.set_sqlite_pragmas)
+            self._engine = engine
+        return self._engine
+
+    @property
+    def session_maker(self) -> sessionmaker:
+        if self._session_maker is None:
+            self._session_maker = sessionmaker(bind=self.engine)
+        return self._session_maker
+
+    def set_sqlite_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in self.sqlite_pragmas.items():
+            cursor.execute('PRAGMA {pragma}={value}'.format(pragma=pragma, value=value))
+        cursor.close()
 
     def __enter__(self):
         self.session = self.session_maker()
@@ -19,53 +181,89 @@ class DataAccessObject:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.session.close()
 
-    def save_photos(self, photos: List[Photo]):
-        for photo in photos:
-            self.session.merge(photo)
+    def save_photos(self, photos: List[Photo], bulk: bool = False,
+                    chunk_size: int = None) -> SavingCounts:
+        """
+        :param bulk: if `True` then photos are saved in chunks by
+        "INSERT ... ON CONFLICT" (SQLite, PostgreSQL)
+        and "INSERT ... ON DUPLICATE KEY UPDATE" (MySQL) statements
+        or by merging one by one for other dialects,
+        photos are always merged one by one otherwise
+        :param chunk_size: number of photos saved by one statement in bulk mode,
+        it's limited (and defaults) by number of photos which values
+        fit in `BOUND_PARAMETERS_LIMIT` bound parameters
+        :returns: counts of inserted and updated photos
+        """
+        upsert = UPSERT_BY_DIALECT.get(self.engine.dialect.name)
+        if bulk and upsert is not None:
+            counts = self.upsert_photos(photos, upsert, chunk_size=chunk_size)
+        else:
+            inserted = updated = 0
+            for photo in photos:
+                merged_photo = self.session.merge(photo)
+                if merged_photo in self.session.new:
+                    inserted += 1
+                else:
+                    updated += 1
+            counts = SavingCounts(inserted=inserted, updated=updated)
         self.session.commit()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        return counts
+
+    def upsert_photos(self, photos: List[Photo],
+                      upsert: Callable[[Table, List[Dict[str, Any]]], Insert],
+                      chunk_size: int = None) -> SavingCounts:
+        # like merging, last of photos with same id wins
+        photos_by_ids = OrderedDict((photo.vk_id, photo) for photo in photos)
+        rows = [get_photo_row(photo) for photo in photos_by_ids.values()]
+        # every value of row is bound parameter of statement
+        columns_count = max(map(len, rows), default=1)
+        max_chunk_size = BOUND_PARAMETERS_LIMIT // columns_count
+        chunk_size = (max_chunk_size if chunk_size is None
+                      else min(chunk_size, max_chunk_size))
+        inserted = updated = 0
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            ids = [row['vk_id'] for row in chunk]
+            existing_ids_count = (self.session.query(Photo.vk_id)
+                                  .filter(Photo.vk_id.in_(ids))
+                                  .count())
+            # multi-row insert requires same columns in every row
+            chunk.sort(key=get_row_columns)
+            for _, rows_group in groupby(chunk, key=get_row_columns):
+                self.session.execute(upsert(Photo.__table__, list(rows_group)))
+            inserted += len(chunk) - existing_ids_count
+            updated += existing_ids_count
+        return SavingCounts(inserted=inserted, updated=updated)
 
     def load_photos(self, **filters) -> List[Photo]:
+        """
+        :param filters: normalized by `check_filters` filters,
+        "offset" filter can't be used with "random" one
+        since random photos don't have order to skip them by
+        """
         q = self.session.query(Photo)
-
-        owner_id = filters.get('owner_id')
-        if owner_id is not None:
-            q = q.filter(
-                Photo.owner_id == owner_id
-            )
-
-        albums = filters.get('albums')
-        if albums is not None:
-            q = q.filter(
-                Photo.album.in_(albums)
-            )
-        restricted_albums = filters.get('restricted_albums')
-        if restricted_albums is not None:
-            q = q.filter(
-                Photo.album.notin_(restricted_albums)
-            )
-
-        start_datetime = filters.get('start_datetime')
-        if start_datetime is not None:
-            q = q.filter(
-                Photo.date_time >= start_datetime
-            )
-        end_datetime = filters.get('end_datetime')
-        if end_datetime is not None:
-            q = q.filter(
-                Photo.date_time <= end_datetime
-            )
-
-        posted = filters.get('posted')
-        if posted is not None:
-            q = q.filter(
-                Photo.posted.is_(posted)
-            )
-
-        random = filters.get('random')
-        if random is not None:
-            q = q.order_by(func.rand())
+        q = filter_photos(q, **filters)
 
         limit = filters.get('limit')
+
+        if filters.get('random'):
+            if filters.get('offset') is not None:
+                raise ValueError("'offset' filter parameter can't be used "
+                                 "with 'random' filter parameter")
+            return load_random_photos(q, limit)
+
+        # cached states would overwrite unflushed changes of session photos
+        # and query results with flushed ones may be rolled back
+        use_query_cache = self.query_cache is not None and not (
+            self.session.new or self.session.dirty or self.session.deleted)
+        if use_query_cache:
+            photos_states = self.query_cache.get(filters)
+            if photos_states is not None:
+                return [self.session.merge(restore_photo(photo_state), load=False)
+                        for photo_state in photos_states]
+
         if limit is not None:
             q = q.limit(limit)
 
@@ -74,8 +272,308 @@ class DataAccessObject:
             q = q.offset(offset)
 
         photos = q.all()
+        if use_query_cache:
+            self.query_cache.put(filters, [get_photo_state(photo) for photo in photos])
         return photos
 
+    def iter_photos(self, batch_size: int = ITERATION_BATCH_SIZE, descending: bool = False,
+                    **filters) -> Iterator[List[Photo]]:
+        """Yields batches of photos ordered by date & id
+
+        Batches are paged by last loaded photo date and id instead of offset,
+        so every batch is loaded by index range scan
+        and only one batch is kept in memory at once.
+
+        :param descending: if `True` then newest photos are loaded first
+        :param filters: same as for `load_photos` except
+        "random", "limit" & "offset" ones which are ignored
+        """
+        q = self.session.query(Photo)
+        q = filter_photos(q, **filters)
+        if descending:
+            q = q.order_by(Photo.date_time.desc(), Photo.vk_id.desc())
+        else:
+            q = q.order_by(Photo.date_time, Photo.vk_id)
+
+        batch_q = q
+        while True:
+            photos = batch_q.limit(batch_size).all()
+            if not photos:
+                return
+            yield photos
+            if len(photos) < batch_size:
+                return
+            last_photo = photos[-1]
+            if descending:
+                batch_q = q.filter(or_(Photo.date_time < last_photo.date_time,
+                                       and_(Photo.date_time == last_photo.date_time,
+                                            Photo.vk_id < last_photo.vk_id)))
+            else:
+                batch_q = q.filter(or_(Photo.date_time > last_photo.date_time,
+                                       and_(Photo.date_time == last_photo.date_time,
+                                            Photo.vk_id > last_photo.vk_id)))
+
+    def count_photos_by_albums(self, **filters) -> Dict[str, int]:
+        """Returns counts of photos by albums titles computed by database
+
+        :param filters: same as for `load_photos` except
+        "random", "limit" & "offset" ones which are ignored
+        """
+        return OrderedDict(self.count_photos_by(Photo.album, **filters))
+
+    def count_photos_by_posted(self, **filters) -> Dict[bool, int]:
+        """Returns counts of unposted & posted photos computed by database"""
+        counts = OrderedDict([(False, 0), (True, 0)])
+        for posted, count in self.count_photos_by(Photo.posted, **filters):
+            # photos saved before introducing of `posted` column may have NULL
+            counts[bool(posted)] += count
+        return counts
+
+    def count_photos_by_dates(self, period: str = 'day', **filters) -> Dict[str, int]:
+        """Returns histogram of photos dates computed by database
+
+        :param period: histogram bin,
+        allowable values: "day", "month", "year"
+        :returns: counts of photos by dates formatted as "YYYY-MM-DD",
+        "YYYY-MM" or "YYYY" correspondingly in chronological order
+        """
+        try:
+            date_formats = DATE_FORMATS_BY_PERIODS[period]
+        except KeyError:
+            err_description = ('Incorrect `period` value: {period}\n'
+                               'Allowable values: "day", "month", "year".'
+                               .format(period=period))
+            raise ValueError(err_description)
+        dialect_name = self.engine.dialect.name
+        if dialect_name == 'mysql':
+            date = func.date_format(Photo.date_time, date_formats['strftime'])
+        elif dialect_name == 'postgresql':
+            date = func.to_char(Photo.date_time, date_formats['to_char'])
+        else:
+            date = func.strftime(date_formats['strftime'], Photo.date_time)
+        return OrderedDict((str(date), count)
+                           for date, count in self.count_photos_by(date, **filters)
+                           if date is not None)
+
+    def count_photos_by(self, column: ColumnElement, **filters) -> List[Tuple[Any, int]]:
+        q = self.session.query(column, func.count(Photo.vk_id))
+        q = filter_photos(q, **filters)
+        q = q.group_by(column).order_by(column)
+        return q.all()
+
+    def delete_missing_photos(self, owner_id: int, album_id: int, vk_ids: Iterable[str],
+                              chunk_size: int = SAVING_CHUNK_SIZE) -> int:
+        """Deletes photos of album which ids are not in `vk_ids`
+
+        :returns: number of deleted photos
+        """
+        vk_ids = set(vk_ids)
+        missing_ids = [vk_id
+                       for vk_id, in (self.session.query(Photo.vk_id)
+                                      .filter(Photo.owner_id == owner_id,
+                                              Photo.album_id == album_id))
+                       if vk_id not in vk_ids]
+        for start in range(0, len(missing_ids), chunk_size):
+            (self.session.query(Photo)
+             .filter(Photo.vk_id.in_(missing_ids[start:start + chunk_size]))
+             .delete(synchronize_session=False))
+        self.session.commit()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        return len(missing_ids)
+
+    def delete_missing_albums(self, owner_id: int, albums_ids: Iterable[int],
+                              vk_ids: Iterable[str] = (),
+                              chunk_size: int = SAVING_CHUNK_SIZE) -> int:
+        """Deletes photos of albums which ids are not in `albums_ids`
+        except photos which ids are in `vk_ids` (e.g. attached to posts)
+
+        :returns: number of deleted photos
+        """
+        albums_ids = set(albums_ids)
+        vk_ids = set(vk_ids)
+        missing_ids = [vk_id
+                       for vk_id, album_id in (self.session.query(Photo.vk_id, Photo.album_id)
+                                               .filter(Photo.owner_id == owner_id))
+                       if album_id not in albums_ids and vk_id not in vk_ids]
+        for start in range(0, len(missing_ids), chunk_size):
+            (self.session.query(Photo)
+             .filter(Photo.vk_id.in_(missing_ids[start:start + chunk_size]))
+             .delete(synchronize_session=False))
+        self.session.commit()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        return len(missing_ids)
+
+    def load_sync_cursors(self, owner_id: int) -> Dict[Tuple[str, int], SyncCursor]:
+        """Returns synchronization cursors of owner by sources and albums ids"""
+        SyncCursor.__table__.create(bind=self.engine, checkfirst=True)
+        cursors = self.session.query(SyncCursor).filter(SyncCursor.owner_id == owner_id)
+        return {(cursor.source, cursor.album_id): cursor for cursor in cursors}
+
+    def save_sync_cursors(self, cursors: Iterable[SyncCursor]):
+        for cursor in cursors:
+            self.session.merge(cursor)
+        self.session.commit()
+
+    def migrate(self, chunk_size: int = SAVING_CHUNK_SIZE):
+        """Creates missing tables, adds columns and indexes missing in existing photos table
+        and fills random keys of photos saved before they were introduced"""
+        SyncCursor.__table__.create(bind=self.engine, checkfirst=True)
+        table = Photo.__table__
+        inspector = inspect(self.engine)
+        if table.name not in inspector.get_table_names():
+            table.create(bind=self.engine)
+            return
+
+        existing_columns_names = {column['name']
+                                  for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns_names:
+                logging.info('Adding column "{column}" to "{table}" table'
+                             .format(column=column.name, table=table.name))
+                column_ddl = CreateColumn(column).compile(dialect=self.engine.dialect)
+                self.engine.execute('ALTER TABLE {table} ADD COLUMN {column}'
+                                    .format(table=table.name, column=column_ddl))
+
+        existing_indexes_names = {index['name']
+                                  for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes_names:
+                logging.info('Creating index "{index}" on "{table}" table'
+                             .format(index=index.name, table=table.name))
+                index.create(bind=self.engine)
+
+        session = self.session_maker()
+        try:
+            while True:
+                ids = [vk_id
+                       for vk_id, in (session.query(Photo.vk_id)
+                                      .filter(Photo.random_key.is_(None))
+                                      .limit(chunk_size))]
+                if not ids:
+                    break
+                session.bulk_update_mappings(
+                    Photo, [dict(vk_id=vk_id, random_key=generate_random_key())
+                            for vk_id in ids])
+                session.commit()
+        finally:
+            session.close()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+
+def load_random_photos(q: Query, limit: int = None) -> List[Photo]:
+    """Returns random photos from query results
+
+    Every photo is taken by its own random pivot as photo
+    with the nearest indexed random key not less than pivot,
+    so only `limit` photos are read instead of sorting all of them
+    and photos with adjacent keys don't come together.
+    Photos without random keys (saved before `migrate`) aren't taken,
+    since they would be first ones after wrapping around.
+    All photos are loaded and shuffled if `limit` is `None`.
+    """
+    if limit is None:
+        photos = q.all()
+        random.shuffle(photos)
+        return photos
+    photos = list()
+    q = q.filter(Photo.random_key.isnot(None))
+    for _ in range(limit):
+        photos_q = q
+        if photos:
+            photos_q = photos_q.filter(Photo.vk_id.notin_([photo.vk_id for photo in photos]))
+        photos_q = photos_q.order_by(Photo.random_key)
+        photo = photos_q.filter(Photo.random_key >= generate_random_key()).first()
+        if photo is None:
+            # wrapping around
+            photo = photos_q.first()
+        if photo is None:
+            break
+        photos.append(photo)
+    return photos
+
+
+def filter_photos(q: Query, **filters) -> Query:
+    owner_id = filters.get('owner_id')
+    if owner_id is not None:
+        q = q.filter(
+            Photo.owner_id == owner_id
+        )
+
+    albums = filters.get('albums')
+    if albums is not None:
+        q = q.filter(
+            Photo.album.in_(albums)
+        )
+    restricted_albums = filters.get('restricted_albums')
+    if restricted_albums is not None:
+        q = q.filter(
+            Photo.album.notin_(restricted_albums)
+        )
+
+    start_datetime = filters.get('start_datetime')
+    if start_datetime is not None:
+        q = q.filter(
+            Photo.date_time >= start_datetime
+        )
+    end_datetime = filters.get('end_datetime')
+    if end_datetime is not None:
+        q = q.filter(
+            Photo.date_time <= end_datetime
+        )
+
+    posted = filters.get('posted')
+    if posted is not None:
+        q = q.filter(
+            Photo.posted.is_(posted)
+        )
+    return q
+
+
+def get_photo_row(photo: Photo) -> Dict[str, Any]:
+    """Returns values of columns set on photo,
+    unset ones (e.g. `posted` of photo loaded from VK) stay untouched on update"""
+    photo_state = inspect(photo)
+    return {column_property.columns[0].name: photo_state.dict[column_property.key]
+            for column_property in photo_state.mapper.column_attrs
+            if column_property.key in photo_state.dict}
+
+
+def get_photo_state(photo: Photo) -> Dict[str, Any]:
+    """Returns values of loaded column attributes of photo"""
+    photo_state = inspect(photo)
+    return {column_property.key: photo_state.dict[column_property.key]
+            for column_property in photo_state.mapper.column_attrs
+            if column_property.key in photo_state.dict}
+
+
+def restore_photo(photo_state: Dict[str, Any]) -> Photo:
+    """Returns detached photo with given column attributes values
+    without calling of constructor and querying database"""
+    photo = inspect(Photo).class_manager.new_instance()
+    for key, value in photo_state.items():
+        setattr(photo, key, value)
+    make_transient_to_detached(photo)
+    return photo
+
+
+def get_filters_key(filters: Dict[str, Any]) -> tuple:
+    key = list()
+    for name, value in sorted(filters.items()):
+        if value is None:
+            continue
+        if isinstance(value, list):
+            # order of albums doesn't matter
+            value = tuple(sorted(value))
+        key.append((name, value))
+    return tuple(key)
+
+
+def get_row_columns(row: Dict[str, Any]) -> List[str]:
+    return sorted(row)
+
 
 def check_filters(filters):
     owner_id = filters.get('owner_id')
@@ -0,0 +1,172 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DOWNLOAD_WORKERS = 8
+# VK content servers are few, so connections to every one of them are limited
+HOST_CONNECTIONS_LIMIT = 4
+RETRIES_COUNT = 3
+# delays between retries are 0.5, 1, 2, ... seconds
+BACKOFF_FACTOR = 0.5
+# seconds for connecting and for waiting of data
+TIMEOUT = (5, 30)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PROGRESS_LOGGING_INTERVAL = 5.
+TMP_FILE_SUFFIX = '.part'
+
+# pair of URL and path of file to save its content to
+Download = Tuple[str, str]
+DownloadFailure = namedtuple('DownloadFailure', ['url', 'file_path', 'error'])
+DownloadReport = namedtuple('DownloadReport', ['files_count', 'bytes_count', 'duration',
+                                               'failures'])
+
+
+class Downloader:
+    """Downloads files by pool of threads sharing keep-alive HTTP session
+
+    Number of simultaneous connections to every host is limited,
+    failed requests (connection errors, timeouts, 429 and 5xx responses)
+    are retried with exponential backoff,
+    files are written to temporary files which are renamed on completion,
+    so there are no partially downloaded files at their paths.
+    """
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS,
+                 host_connections_limit: int = HOST_CONNECTIONS_LIMIT,
+                 retries_count: int = RETRIES_COUNT,
+                 backoff_factor: float = BACKOFF_FACTOR,
+                 timeout: Tuple[float, float] = TIMEOUT):
+        self.workers = workers
+        self.host_connections_limit = host_connections_limit
+        self.retries_count = retries_count
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.session = requests.Session()
+        # connections pools are per host, so every one keeps connections
+        # of threads allowed to download from host simultaneously
+        adapter = HTTPAdapter(pool_maxsize=host_connections_limit)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.hosts_semaphores = dict()  # type: Dict[str, threading.BoundedSemaphore]
+        self.lock = threading.Lock()
+
+    def download(self, downloads: Iterable[Download]) -> DownloadReport:
+        """Downloads files logging progress and throughput
+
+        Failed downloads don't stop downloading of other files.
+        """
+        downloads = list(downloads)
+        start = last_logging_time = time.perf_counter()
+        files_count = bytes_count = 0
+        failures = list()  # type: List[DownloadFailure]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = executor.map(self.download_file_safely, downloads)
+            for ind, ((url, file_path), result) in enumerate(zip(downloads, results),
+                                                             start=1):
+                if isinstance(result, Exception):
+                    logging.error('Failed to download {url} to {file_path}: {error}'
+                                  .format(url=url, file_path=file_path, error=result))
+                    failures.append(DownloadFailure(url=url, file_path=file_path,
+                                                    error=result))
+                else:
+                    files_count += 1
+                    bytes_count += result
+                now = time.perf_counter()
+                if (now - last_logging_time >= PROGRESS_LOGGING_INTERVAL
+                        or ind == len(downloads)):
+                    last_logging_time = now
+                    log_progress(ind, len(downloads), bytes_count, now - start)
+        report = DownloadReport(files_count=files_count,
+                                bytes_count=bytes_count,
+                                duration=time.perf_counter() - start,
+                                failures=failures)
+        return report
+
+    def download_file_safely(self, download: Download):
+        """Returns size of downloaded file or error"""
+        url, file_path = download
+        try:
+            return self.download_file(url, file_path)
+        except Exception as err:
+            return err
+
+    def download_file(self, url: str, file_path: str) -> int:
+        """Downloads file retrying on failures, returns its size"""
+        for attempt in range(self.retries_count + 1):
+            try:
+                with self.get_host_semaphore(urlparse(url).netloc):
+                    return self.fetch_file(url, file_path)
+            except requests.RequestException as err:
+                if attempt == self.retries_count or not is_retryable(err):
+                    raise
+                delay = self.backoff_factor * 2 ** attempt
+                logging.warning('Retrying download of {url} in {delay:.1f}s: {error}'
+                                .format(url=url, delay=delay, error=err))
+                time.sleep(delay)
+
+    def fetch_file(self, url: str, file_path: str) -> int:
+        response = self.session.get(url, stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+            file_dir = os.path.dirname(file_path)
+            os.makedirs(file_dir, exist_ok=True)
+            tmp_file = tempfile.NamedTemporaryFile(dir=file_dir, suffix=TMP_FILE_SUFFIX,
+                                                   delete=False)
+            try:
+                with tmp_file:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        tmp_file.write(chunk)
+                os.replace(tmp_file.name, file_path)
+            except BaseException:
+                os.remove(tmp_file.name)
+                raise
+        finally:
+            # returns connection to pool
+            response.close()
+        return os.path.getsize(file_path)
+
+    def get_host_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            try:
+                return self.hosts_semaphores[host]
+            except KeyError:
+                semaphore = threading.BoundedSemaphore(self.host_connections_limit)
+                self.hosts_semaphores[host] = semaphore
+                return semaphore
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self) -> 'Downloader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_retryable(err: requests.RequestException) -> bool:
+    response = err.response
+    if response is None:
+        # connection error or timeout
+        return True
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def log_progress(ind: int, downloads_count: int, bytes_count: int, duration: float):
+    logging.info('Downloaded {ind}/{count} files, {bytes_count} bytes in {duration:.1f}s '
+                 '({files_rate:.1f} files/s, {bytes_rate:.0f} bytes/s)'
+                 .format(ind=ind,
+                         count=downloads_count,
+                         bytes_count=bytes_count,
+                         duration=duration,
+                         files_rate=ind / (duration or 1),
+                         bytes_rate=bytes_count / (duration or 1)))
@@ -0,0 +1,126 @@
+import json
+import logging
+import math
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# VK API allows no more than 25 API calls in one "execute" request
+EXECUTE_CALLS_LIMIT = 25
+PAGE_SIZE = 100
+
+# pair of API method name and its parameters,
+# e.g. ('wall.get', {'owner_id': -1, 'count': 100})
+ApiCall = Tuple[str, Dict[str, Any]]
+
+
+def get_call_code(method: str, params: Dict[str, Any]) -> str:
+    # JSON objects are valid VKScript objects
+    return 'API.{method}({params})'.format(method=method,
+                                           params=json.dumps(params, sort_keys=True))
+
+
+def get_execute_code(calls: Sequence[ApiCall]) -> str:
+    """Returns VKScript code which returns list of calls results in same order"""
+    calls_codes = [get_call_code(method, params) for method, params in calls]
+    return 'return [{calls_codes}];'.format(calls_codes=', '.join(calls_codes))
+
+
+def execute_calls(api_session, calls: Sequence[ApiCall],
+                  calls_limit: int = EXECUTE_CALLS_LIMIT) -> List[Any]:
+    """Makes API calls packed by `calls_limit` in "execute" requests
+
+    :returns: results of calls in same order,
+    failed calls have `False` as result (like in VK API)
+    """
+    results = list()
+    for start in range(0, len(calls), calls_limit):
+        calls_batch = calls[start:start + calls_limit]
+        batch_results = api_session.execute(code=get_execute_code(calls_batch))
+        if len(batch_results) != len(calls_batch):
+            err_description = ('Expected {expected} results of "execute" request, '
+                               'but got {actual}.'
+                               .format(expected=len(calls_batch),
+                                       actual=len(batch_results)))
+            raise RuntimeError(err_description)
+        results.extend(batch_results)
+    return results
+
+
+def pack_calls_groups(calls_groups: Iterable[Any],
+                      key: Callable[[Any], Sequence[ApiCall]] = None,
+                      calls_limit: int = EXECUTE_CALLS_LIMIT) -> Iterator[List[Any]]:
+    """Packs groups of calls in batches for "execute" requests
+
+    Group is never split between batches, so interrupted processing
+    stops between groups.
+
+    :param key: function returning calls of group if groups aren't calls sequences,
+    e.g. for pairs of object and its calls
+    """
+    batch = list()
+    batch_calls_count = 0
+    for calls_group in calls_groups:
+        calls_count = len(calls_group if key is None else key(calls_group))
+        if calls_count > calls_limit:
+            err_description = ('Group of {count} calls does not fit in "execute" request, '
+                               'max number of calls: {limit}.'
+                               .format(count=calls_count, limit=calls_limit))
+            raise ValueError(err_description)
+        if batch_calls_count + calls_count > calls_limit:
+            yield batch
+            batch = list()
+            batch_calls_count = 0
+        batch.append(calls_group)
+        batch_calls_count += calls_count
+    if batch:
+        yield batch
+
+
+def get_all_objects_by_execute(api_session, method: str, page_size: int = PAGE_SIZE,
+                               calls_limit: int = EXECUTE_CALLS_LIMIT,
+                               stop: Callable[[Dict[str, Any]], bool] = None,
+                               **params) -> List[Dict[str, Any]]:
+    """Loads all objects of paging API method (e.g. "wall.get", "photos.get")
+
+    First page is requested alone to get total count of objects,
+    then up to `calls_limit` pages are requested by single "execute" request,
+    so loading of N objects takes about N / (`page_size` * `calls_limit`)
+    HTTP round-trips instead of N / `page_size`.
+
+    :param page_size: number of objects requested by one API call
+    :param stop: predicate of object to stop loading at (it's not returned),
+    number of pages requested at once grows from 1 to `calls_limit` in this case,
+    so few pages are requested beyond stop object
+    """
+    offset = params.pop('offset', 0)
+    params.pop('count', None)
+    objects = list()
+    total_count = None
+    pages_count = 0
+    while total_count is None or offset < total_count:
+        if total_count is None:
+            # total count is unknown yet and most of albums fit in one page
+            pages_count = 1
+        else:
+            max_pages_count = calls_limit if stop is None else min(calls_limit, pages_count * 2)
+            pages_count = min(max_pages_count, math.ceil((total_count - offset) / page_size))
+        calls = [(method, dict(params, offset=offset + ind * page_size, count=page_size))
+                 for ind in range(pages_count)]
+        responses = execute_calls(api_session, calls, calls_limit=calls_limit)
+        for (_, call_params), response in zip(calls, responses):
+            if response is False:
+                err_description = ('Call of "{method}" with parameters {params} failed.'
+                                   .format(method=method, params=call_params))
+                raise RuntimeError(err_description)
+            # count is taken from last response since objects may be added or removed
+            total_count = response['count']
+            for ind, item in enumerate(response['items']):
+                if stop is not None and stop(item):
+                    objects.extend(response['items'][:ind])
+                    return objects
+            objects.extend(response['items'])
+        offset += pages_count * page_size
+        logging.debug('"{method}" objects loaded: {loaded}/{total}'
+                      .format(method=method, loaded=len(objects), total=total_count))
+        if not responses[-1]['items']:
+            break
+    return objects
@@ -1,9 +1,133 @@
 import logging
 import os
+from collections import OrderedDict, namedtuple
+from functools import partial
+from multiprocessing import Pool
+from typing import Callable, Iterable, Tuple
 
 from PIL import Image
 import numpy as np
-from skimage import img_as_float
+
+from vk_community.services.manifest import MarksManifest, get_watermark_fingerprint
+
+WATERMARKS_CACHE_MAX_SIZE = 32
+
+WatermarkCacheInfo = namedtuple('WatermarkCacheInfo', ['hits', 'misses', 'max_size', 'size'])
+MarkingReport = namedtuple('MarkingReport', ['images_count', 'source_bytes', 'written_bytes',
+                                             'cache_info'])
+
+# watermarks cache and encoder shared by all images processed in worker process,
+# set once by `init_worker` instead of pickling them for every task
+worker_watermarks_cache = None
+worker_encoder = None
+
+
+class ImageEncoder:
+    """Describes format of image files, parameters of encoding and image mode to encode"""
+
+    def __init__(self, file_format: str, file_extension: str, mode: str = 'RGB',
+                 **save_params):
+        self.file_format = file_format
+        self.file_extension = file_extension
+        self.mode = mode
+        self.save_params = save_params
+
+    def save(self, image: Image.Image, file_path: str):
+        if image.mode != self.mode:
+            image = image.convert(self.mode)
+        image.save(file_path, format=self.file_format, **self.save_params)
+
+    def __repr__(self):
+        save_params = ', '.join('{}={!r}'.format(key, value)
+                                for key, value in sorted(self.save_params.items()))
+        return ('{cls}({file_format!r}, {file_extension!r}, mode={mode!r}{save_params})'
+                .format(cls=type(self).__name__,
+                        file_format=self.file_format,
+                        file_extension=self.file_extension,
+                        mode=self.mode,
+                        save_params=', ' + save_params if save_params else ''))
+
+
+def png_encoder(optimize: bool = False) -> ImageEncoder:
+    return ImageEncoder('PNG', '.png', mode='RGBA', optimize=optimize)
+
+
+def jpeg_encoder(quality: int = 90, subsampling: int = None,
+                 optimize: bool = False) -> ImageEncoder:
+    """
+    :param subsampling: chroma subsampling,
+    allowable values: 0 (4:4:4), 1 (4:2:2), 2 (4:2:0), `None` for library default
+    """
+    save_params = dict(quality=quality, optimize=optimize)
+    if subsampling is not None:
+        save_params['subsampling'] = subsampling
+    # ".jpg" extension is reserved for source images
+    return ImageEncoder('JPEG', '.jpeg', **save_params)
+
+
+def webp_encoder(quality: int = 90, lossless: bool = False,
+                 method: int = 4) -> ImageEncoder:
+    """
+    :param method: quality/speed trade-off from 0 (fast) to 6 (slower, better)
+    """
+    return ImageEncoder('WEBP', '.webp', quality=quality, lossless=lossless,
+                        method=method)
+
+
+PNG_ENCODER = png_encoder()
+
+
+class WatermarkCache:
+    """Bounded LRU cache of resized watermark arrays
+
+    Keys are pairs of watermark side length and flag
+    showing if watermark colors are inverted (for dark backgrounds).
+    """
+
+    def __init__(self, watermark: Image.Image, max_size: int = WATERMARKS_CACHE_MAX_SIZE):
+        self.watermark = watermark
+        self.max_size = max_size
+        self.arrays = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, length: int, inverted: bool = False) -> np.ndarray:
+        """Returns read-only RGBA array of watermark with given side length"""
+        if (length, inverted) in self.arrays:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return self.lookup(length, inverted)
+
+    def lookup(self, length: int, inverted: bool = False) -> np.ndarray:
+        """Same as `get`, but doesn't count hits and misses,
+        so building of inverted watermark from non-inverted one
+        isn't counted as separate request"""
+        key = (length, inverted)
+        try:
+            array = self.arrays[key]
+        except KeyError:
+            pass
+        else:
+            self.arrays.move_to_end(key)
+            return array
+
+        if inverted:
+            array = self.lookup(length).copy()
+            array[..., :-1] = 255 - array[..., :-1]
+        else:
+            watermark_size = (length, length)
+            array = np.array(self.watermark.resize(watermark_size, Image.ANTIALIAS))
+        array.flags.writeable = False
+
+        self.arrays[key] = array
+        if len(self.arrays) > self.max_size:
+            self.arrays.popitem(last=False)
+        return array
+
+    def cache_info(self) -> WatermarkCacheInfo:
+        return WatermarkCacheInfo(hits=self.hits, misses=self.misses,
+                                  max_size=self.max_size, size=len(self.arrays))
 
 
 def alpha_composite(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
@@ -32,42 +156,177 @@ def alpha_composite(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
     return out
 
 
+def alpha_composite_in_place(src: np.ndarray, dst: np.ndarray):
+    """Composition of 2 RGBA images of same shape, result is written into `dst`
+
+    Works with integer arithmetic only and gives same results as `alpha_composite`
+    up to its floating point rounding errors (±1).
+    """
+    src_a = src[..., 3:].astype(np.uint32)
+    dst_a = dst[..., 3:].astype(np.uint32)
+    # alpha values are multiplied by 255 to stay integer
+    dst_weight = dst_a * (255 - src_a)
+    out_a = src_a * 255 + dst_weight
+    out_rgb = src[..., :3] * (src_a * 255) + dst[..., :3] * dst_weight
+    # fully transparent pixels have zero numerator and denominator
+    out_rgb //= np.maximum(out_a, 1)
+    dst[..., :3] = out_rgb
+    dst[..., 3:] = out_a // 255
+
+
 def paste_watermark(image: Image.Image, watermark: Image.Image) -> Image.Image:
+    watermarks_cache = WatermarkCache(watermark, max_size=2)
+    return paste_cached_watermark(image, watermarks_cache)
+
+
+def paste_cached_watermark(image: Image.Image,
+                           watermarks_cache: WatermarkCache) -> Image.Image:
     min_image_dimension = min(image.size)
     watermark_length = int(min_image_dimension / 4.)
 
-    watermark_size = (watermark_length, watermark_length)
-    watermark = watermark.resize(watermark_size, Image.ANTIALIAS)
+    top_margin = int(5 * image.size[1] / 6.)
+    # only the region covered by watermark gets composed
+    region = np.index_exp[top_margin - watermark_length:top_margin, :watermark_length]
 
-    foreground_shape = (image.size[1], image.size[0], 4)
+    image_array = np.array(image)
+    region_array = image_array[region]
+    mean = np.mean(region_array[..., :-1]) / 255.
+    foreground_array = watermarks_cache.get(watermark_length, inverted=mean < 0.4)
 
-    top_margin = int(5 * image.size[1] / 6.)
+    alpha_composite_in_place(foreground_array, region_array)
+    return Image.fromarray(image_array, mode='RGBA')
 
-    foreground_array = np.zeros(foreground_shape, dtype=np.uint8)
-    foreground_array[top_margin - watermark_length:top_margin, :watermark_length, :] = np.array(watermark)
 
-    image_array = np.array(image)
-    background_rgb = img_as_float(image_array[..., :-1])
-    mean = np.mean(background_rgb[top_margin - watermark_length:top_margin, :watermark_length, :])
-    if mean < 0.4:
-        foreground_alpha = foreground_array[..., -1:]
-        foreground_rgb = foreground_array[..., :-1]
-        foreground_rgb = 255 - foreground_rgb
-        foreground_array = np.dstack((foreground_rgb, foreground_alpha))
+def mark_images(images_path: str, watermark: Image.Image,
+                workers: int = 1, manifest: bool = True,
+                encoder: ImageEncoder = PNG_ENCODER) -> MarkingReport:
+    """
+    :param images_path: path to directory containing images
+    :param watermark: RGBA image to paste on every unmarked image
+    :param workers: number of processes to mark images with,
+    images are marked in current process if it equals 1
+    :param manifest: if `True` then marked images are tracked
+    by manifest stored in images directory, so changed images
+    (or all of them if watermark or encoder changed) are marked again,
+    otherwise only images without marked copy are marked
+    :param encoder: encoder of marked images files
+    """
+    get_save_path = partial(get_marked_image_path, encoder=encoder)
+    if manifest:
+        marks_manifest = MarksManifest(images_path,
+                                       fingerprint=get_marks_fingerprint(watermark,
+                                                                         encoder),
+                                       get_save_path=get_save_path)
+        images_paths = marks_manifest.get_outdated_images_paths()
+    else:
+        marks_manifest = None
+        images_paths = get_unmarked_images_paths(images_path, get_save_path)
+    images_paths = sorted(images_paths)
+    images_count = len(images_paths)
+    source_bytes = written_bytes = 0
+    try:
+        if workers > 1:
+            watermark_state = (watermark.mode, watermark.size, watermark.tobytes())
+            with Pool(processes=workers,
+                      initializer=init_worker,
+                      initargs=(watermark_state, encoder)) as pool:
+                results = pool.imap(mark_image_by_worker, images_paths)
+                caches_infos = dict()
+                for ind, (image_path, (image_report, worker_id, cache_info)) in enumerate(
+                        zip(images_paths, results), start=1):
+                    save_path, image_source_bytes, image_written_bytes = image_report
+                    log_progress(save_path, ind, images_count)
+                    if marks_manifest is not None:
+                        marks_manifest.update(image_path)
+                    source_bytes += image_source_bytes
+                    written_bytes += image_written_bytes
+                    caches_infos[worker_id] = cache_info
+            caches_infos = list(caches_infos.values())
+            cache_info = WatermarkCacheInfo(
+                hits=sum(cache_info.hits for cache_info in caches_infos),
+                misses=sum(cache_info.misses for cache_info in caches_infos),
+                # every worker has its own cache
+                max_size=sum(cache_info.max_size for cache_info in caches_infos),
+                size=sum(cache_info.size for cache_info in caches_infos))
+        else:
+            watermarks_cache = WatermarkCache(watermark)
+            for ind, image_path in enumerate(images_paths, start=1):
+                save_path, image_source_bytes, image_written_bytes = mark_image(
+                    image_path, watermarks_cache, encoder=encoder)
+                log_progress(save_path, ind, images_count)
+                if marks_manifest is not None:
+                    marks_manifest.update(image_path)
+                source_bytes += image_source_bytes
+                written_bytes += image_written_bytes
+            cache_info = watermarks_cache.cache_info()
+    finally:
+        if marks_manifest is not None:
+            marks_manifest.save()
+    report = MarkingReport(images_count=images_count,
+                           source_bytes=source_bytes,
+                           written_bytes=written_bytes,
+                           cache_info=cache_info)
+    logging.info('Marked {count} images: {source_bytes} bytes of sources, '
+                 '{written_bytes} bytes written ({ratio:.2f}x), '
+                 'watermarks cache: {cache_info}'
+                 .format(count=images_count,
+                         source_bytes=source_bytes,
+                         written_bytes=written_bytes,
+                         ratio=written_bytes / (source_bytes or 1),
+                         cache_info=cache_info))
+    return report
 
-    marked_image_array = alpha_composite(foreground_array, image_array)
-    return Image.fromarray(marked_image_array, mode='RGBA')
 
+def get_marks_fingerprint(watermark: Image.Image,
+                          encoder: ImageEncoder = PNG_ENCODER) -> str:
+    return '{watermark_fingerprint}:{encoder}'.format(
+        watermark_fingerprint=get_watermark_fingerprint(watermark),
+        encoder=encoder)
 
-def mark_images(images_path: str, watermark: Image.Image):
+
+def get_unmarked_images_paths(images_path: str,
+                              get_save_path: Callable[[str], str]) -> Iterable[str]:
     for folder, _, files in os.walk(images_path):
         for file_path in files:
             if file_path.endswith('.jpg'):
                 image_path = os.path.join(folder, file_path)
-                save_path = image_path.replace('.jpg', '.png')
+                save_path = get_save_path(image_path)
                 if not os.path.exists(save_path):
-                    image = Image.open(image_path)
-                    image = image.convert('RGBA')
-                    logging.info(save_path)
-                    marked_image = paste_watermark(image, watermark=watermark)
-                    marked_image.save(save_path)
+                    yield image_path
+
+
+def get_marked_image_path(image_path: str, encoder: ImageEncoder = PNG_ENCODER) -> str:
+    return image_path.replace('.jpg', encoder.file_extension)
+
+
+def mark_image(image_path: str, watermarks_cache: WatermarkCache,
+               encoder: ImageEncoder = PNG_ENCODER) -> Tuple[str, int, int]:
+    """Returns path of saved marked image, sizes of source and marked images files"""
+    save_path = get_marked_image_path(image_path, encoder=encoder)
+    image = Image.open(image_path)
+    image = image.convert('RGBA')
+    marked_image = paste_cached_watermark(image, watermarks_cache)
+    encoder.save(marked_image, save_path)
+    return save_path, os.path.getsize(image_path), os.path.getsize(save_path)
+
+
+def init_worker(watermark_state: Tuple[str, Tuple[int, int], bytes],
+                encoder: ImageEncoder):
+    global worker_watermarks_cache, worker_encoder
+    mode, size, data = watermark_state
+    watermark = Image.frombytes(mode, size, data)
+    worker_watermarks_cache = WatermarkCache(watermark)
+    worker_encoder = encoder
+
+
+def mark_image_by_worker(image_path: str
+                         ) -> Tuple[Tuple[str, int, int], int, WatermarkCacheInfo]:
+    image_report = mark_image(image_path, worker_watermarks_cache,
+                              encoder=worker_encoder)
+    return image_report, os.getpid(), worker_watermarks_cache.cache_info()
+
+
+def log_progress(save_path: str, ind: int, images_count: int):
+    logging.info('{save_path} ({ind}/{count})'.format(save_path=save_path,
+                                                       ind=ind,
+                                                       count=images_count))
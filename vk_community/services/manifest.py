@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from PIL import Image
+
+MANIFEST_DIR_NAME = '.marks'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def get_watermark_fingerprint(watermark: Image.Image) -> str:
+    hasher = hashlib.sha1()
+    hasher.update('{mode}{size}'.format(mode=watermark.mode,
+                                        size=watermark.size).encode())
+    hasher.update(watermark.tobytes())
+    return hasher.hexdigest()
+
+
+class MarksManifest:
+    """Persisted index of marked images stored under images directory
+
+    For every source image it keeps modification time and size of it
+    and path of marked image, for whole index -- fingerprint of watermark
+    and encoding of marked images and modification times of directories, so on next runs
+    directories are walked only if some of them changed
+    and only new or changed images are marked.
+    Unchanged run takes one "stat" call per directory and per image,
+    images are checked since they may be changed in place
+    without changing of their directories.
+    """
+
+    def __init__(self, images_path: str, fingerprint: str,
+                 get_save_path: Callable[[str], str]):
+        self.images_path = images_path
+        self.fingerprint = fingerprint
+        self.get_save_path = get_save_path
+        self.manifest_dir = os.path.join(images_path, MANIFEST_DIR_NAME)
+        self.file_path = os.path.join(self.manifest_dir, MANIFEST_FILE_NAME)
+        # relative directory path -> modification time in nanoseconds
+        # or `None` if directory isn't fully indexed
+        self.dirs = dict()  # type: Dict[str, Optional[int]]
+        # relative image path -> [modification time in nanoseconds, size,
+        #                         relative marked image path]
+        self.images = dict()  # type: Dict[str, list]
+        # image path -> (modification time in nanoseconds, size)
+        # of outdated images at the moment of check
+        self.outdated_images_stats = dict()  # type: Dict[str, Tuple[int, int]]
+        # relative paths of directories where marked images were written
+        self.marked_dirs = set()  # type: Set[str]
+        # manifest is written only if it's changed
+        self.changed = False
+        self.exists = os.path.exists(self.file_path)
+        if self.exists:
+            self.load()
+
+    def load(self):
+        with open(self.file_path) as file:
+            manifest = json.load(file)
+        if manifest['fingerprint'] != self.fingerprint:
+            logging.info('Watermark or encoder changed, all images will be marked again')
+            return
+        self.dirs = manifest['dirs']
+        self.images = manifest['images']
+
+    def save(self):
+        if not self.changed:
+            return
+        # directories of images left unmarked (e.g. by interrupted run)
+        # are walked again on next run
+        unindexed_dirs = {os.path.relpath(os.path.dirname(image_path), self.images_path)
+                          for image_path in self.outdated_images_stats}
+        dirs = dict()
+        for rel_dir, mtime in self.dirs.items():
+            if rel_dir in unindexed_dirs:
+                mtime = None
+            elif rel_dir in self.marked_dirs:
+                # writing of marked images changes modification time of directory
+                try:
+                    mtime = os.stat(os.path.join(self.images_path, rel_dir)).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+            dirs[rel_dir] = mtime
+        manifest = dict(fingerprint=self.fingerprint,
+                        dirs=dirs,
+                        images=self.images)
+
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        tmp_file_path = self.file_path + '.tmp'
+        with open(tmp_file_path, mode='w') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_file_path, self.file_path)
+
+    def get_outdated_images_paths(self) -> List[str]:
+        """Returns paths of images which are not marked or marked before their change"""
+        if self.dirs and not self.are_dirs_changed():
+            images_paths = [os.path.join(self.images_path, rel_image_path)
+                            for rel_image_path in self.images]
+        else:
+            # creating manifest directory changes images directory modification time,
+            # so it should be done before walking
+            os.makedirs(self.manifest_dir, exist_ok=True)
+            images_paths = self.walk()
+            self.changed = True
+        outdated_images_paths = list()
+        for image_path in images_paths:
+            rel_image_path = os.path.relpath(image_path, self.images_path)
+            image_stat = os.stat(image_path)
+            stat = (image_stat.st_mtime_ns, image_stat.st_size)
+            record = self.images.get(rel_image_path)
+            if record is None or tuple(record[:2]) != stat:
+                self.images.pop(rel_image_path, None)
+                self.outdated_images_stats[image_path] = stat
+                outdated_images_paths.append(image_path)
+                self.changed = True
+        return outdated_images_paths
+
+    def update(self, image_path: str):
+        """Adds record of marked image"""
+        mtime, size = self.outdated_images_stats.pop(image_path)
+        rel_image_path = os.path.relpath(image_path, self.images_path)
+        save_path = self.get_save_path(image_path)
+        rel_save_path = os.path.relpath(save_path, self.images_path)
+        self.images[rel_image_path] = [mtime, size, rel_save_path]
+        self.marked_dirs.add(os.path.relpath(os.path.dirname(save_path), self.images_path))
+
+    def are_dirs_changed(self) -> bool:
+        for rel_dir, mtime in self.dirs.items():
+            try:
+                dir_mtime = os.stat(os.path.join(self.images_path, rel_dir)).st_mtime_ns
+            except FileNotFoundError:
+                return True
+            if dir_mtime != mtime:
+                return True
+        return False
+
+    def walk(self) -> List[str]:
+        """Returns paths of all images & drops records of removed or unmarked ones"""
+        self.dirs = dict()
+        images = dict()
+        images_paths = list()
+        for folder, dirs, files in os.walk(self.images_path):
+            if folder == self.images_path:
+                dirs[:] = [dr for dr in dirs if dr != MANIFEST_DIR_NAME]
+            rel_dir = os.path.relpath(folder, self.images_path)
+            self.dirs[rel_dir] = os.stat(folder).st_mtime_ns
+            files_names = set(files)
+            for file_name in files:
+                if not file_name.endswith('.jpg'):
+                    continue
+                image_path = os.path.join(folder, file_name)
+                images_paths.append(image_path)
+                rel_image_path = os.path.relpath(image_path, self.images_path)
+                save_path = self.get_save_path(image_path)
+                rel_save_path = os.path.relpath(save_path, self.images_path)
+                marked = os.path.basename(save_path) in files_names
+                if not marked:
+                    continue
+                record = self.images.get(rel_image_path)
+                if record is None and not self.exists:
+                    # adopting images marked before manifest creation
+                    image_stat = os.stat(image_path)
+                    record = [image_stat.st_mtime_ns, image_stat.st_size, rel_save_path]
+                if record is not None and record[2] == rel_save_path:
+                    images[rel_image_path] = record
+        self.images = images
+        return images_paths
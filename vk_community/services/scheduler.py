@@ -0,0 +1,200 @@
+import heapq
+import logging
+import threading
+import time
+from collections import namedtuple
+from itertools import count
+from typing import Any, Callable, Dict, List, Tuple
+
+# VK API allows no more than 3 requests per second for user access token
+API_CALLS_PER_SECOND = 3
+# calls waiting for user (e.g. posting) are made before bulk ones (e.g. synchronization)
+INTERACTIVE_PRIORITY = 0
+BULK_PRIORITY = 1
+# VK API errors codes: "Too many requests per second", "Flood control", "Rate limit reached"
+RATE_LIMIT_ERROR_CODES = {6, 9, 29}
+RETRIES_COUNT = 5
+# rate is multiplied by factor on rate limit errors
+BACKOFF_FACTOR = 0.5
+# number of successful calls restoring rate after backoff
+RECOVERY_CALLS_COUNT = 10
+MIN_CALLS_PER_SECOND = 0.2
+
+SchedulerMetrics = namedtuple('SchedulerMetrics', ['calls_count', 'queue_depth',
+                                                   'max_queue_depth', 'mean_wait', 'max_wait',
+                                                   'rate_limit_errors_count'])
+
+
+class TokenBucket:
+    """Limits rate of calls made with one key (e.g. access token)
+
+    Every call takes token, tokens are added with current rate
+    up to `capacity` which is max number of calls made at once.
+    """
+
+    def __init__(self, calls_per_second: float, capacity: float):
+        self.max_rate = self.rate = calls_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.backoff_time = 0.
+        # heap of waiting calls tickets, i.e. pairs of priority and sequence number
+        self.queue = list()  # type: List[Tuple[int, int]]
+
+    def get_delay(self, now: float) -> float:
+        """Returns time in seconds left until token is available"""
+        self.tokens = min(self.capacity,
+                          self.tokens + max(now - self.updated, 0.) * self.rate)
+        self.updated = max(now, self.updated)
+        return max(self.updated - now, (1. - self.tokens) / self.rate, 0.)
+
+    def take(self):
+        self.tokens -= 1.
+
+    def back_off(self, call_time: float, now: float):
+        """Decreases rate and holds calls for new interval
+
+        Calls made before previous backoff don't decrease rate again,
+        since their errors are caused by same excess.
+        """
+        if call_time >= self.backoff_time:
+            self.rate = max(self.rate * BACKOFF_FACTOR, MIN_CALLS_PER_SECOND)
+            self.backoff_time = now
+        self.tokens = 0.
+        self.updated = max(self.updated, now + 1. / self.rate)
+
+    def recover(self):
+        self.rate = min(self.rate + self.max_rate / RECOVERY_CALLS_COUNT, self.max_rate)
+
+
+class ApiScheduler:
+    """Schedules API calls made by any number of threads
+
+    Calls with every bucket key (e.g. access token or user login)
+    are limited by their own token bucket,
+    waiting calls are made in order of priorities and then of arrival,
+    calls failed with rate limit errors are retried
+    and decrease rate of their bucket, which is restored
+    by subsequent successful calls.
+    """
+
+    def __init__(self, calls_per_second: float = API_CALLS_PER_SECOND, capacity: float = 1.,
+                 retries_count: int = RETRIES_COUNT):
+        self.calls_per_second = calls_per_second
+        self.capacity = capacity
+        self.retries_count = retries_count
+        self.buckets = dict()  # type: Dict[str, TokenBucket]
+        self.tickets_numbers = count()
+        self.condition = threading.Condition()
+        self.calls_count = self.rate_limit_errors_count = 0
+        self.queue_depth = self.max_queue_depth = 0
+        self.total_wait = self.max_wait = 0.
+
+    def call(self, function: Callable[[], Any], bucket_key: str = '',
+             priority: int = BULK_PRIORITY) -> Any:
+        """Makes call when it is allowed, returns its result"""
+        for attempt in range(self.retries_count + 1):
+            self.acquire(bucket_key, priority)
+            call_time = time.monotonic()
+            try:
+                result = function()
+            except Exception as err:
+                if getattr(err, 'code', None) not in RATE_LIMIT_ERROR_CODES:
+                    raise
+                with self.condition:
+                    self.rate_limit_errors_count += 1
+                    bucket = self.buckets[bucket_key]
+                    bucket.back_off(call_time, time.monotonic())
+                    self.condition.notify_all()
+                if attempt == self.retries_count:
+                    raise
+                logging.warning('Rate limit is exceeded, calls per second decreased to '
+                                '{rate:.2f}: {error}'.format(rate=bucket.rate, error=err))
+                continue
+            with self.condition:
+                self.buckets[bucket_key].recover()
+            return result
+
+    def acquire(self, bucket_key: str, priority: int) -> float:
+        """Blocks until call is allowed, returns waited time in seconds"""
+        start = time.monotonic()
+        with self.condition:
+            try:
+                bucket = self.buckets[bucket_key]
+            except KeyError:
+                bucket = TokenBucket(self.calls_per_second, capacity=self.capacity)
+                self.buckets[bucket_key] = bucket
+            ticket = (priority, next(self.tickets_numbers))
+            heapq.heappush(bucket.queue, ticket)
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            try:
+                while True:
+                    if bucket.queue[0] != ticket:
+                        self.condition.wait()
+                        continue
+                    delay = bucket.get_delay(time.monotonic())
+                    if delay <= 0:
+                        break
+                    self.condition.wait(delay)
+            except BaseException:
+                # interrupted call shouldn't block others
+                bucket.queue.remove(ticket)
+                heapq.heapify(bucket.queue)
+                self.queue_depth -= 1
+                self.condition.notify_all()
+                raise
+            bucket.take()
+            heapq.heappop(bucket.queue)
+            self.queue_depth -= 1
+            wait = time.monotonic() - start
+            self.calls_count += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            # next call in queue becomes first
+            self.condition.notify_all()
+        return wait
+
+    def get_metrics(self) -> SchedulerMetrics:
+        with self.condition:
+            return SchedulerMetrics(calls_count=self.calls_count,
+                                    queue_depth=self.queue_depth,
+                                    max_queue_depth=self.max_queue_depth,
+                                    mean_wait=self.total_wait / (self.calls_count or 1),
+                                    max_wait=self.max_wait,
+                                    rate_limit_errors_count=self.rate_limit_errors_count)
+
+
+class ScheduledApiSession:
+    """Wrapper of API session making every call through scheduler
+
+    Supports both "api_session.wall.get(...)"
+    and "api_session('wall.get', ...)" calls.
+    """
+
+    def __init__(self, api_session, scheduler: ApiScheduler, bucket_key: str = '',
+                 priority: int = BULK_PRIORITY, method: str = ''):
+        self.api_session = api_session
+        self.scheduler = scheduler
+        self.bucket_key = bucket_key
+        self.priority = priority
+        self.method = method
+
+    def __getattr__(self, name: str) -> 'ScheduledApiSession':
+        method = '.'.join(filter(None, [self.method, name]))
+        return ScheduledApiSession(self.api_session, self.scheduler,
+                                   bucket_key=self.bucket_key,
+                                   priority=self.priority,
+                                   method=method)
+
+    def __call__(self, *args, **params) -> Any:
+        method, = args or [self.method]
+        return self.scheduler.call(lambda: self.api_session.__call__(method, **params),
+                                   bucket_key=self.bucket_key,
+                                   priority=self.priority)
+
+    def with_priority(self, priority: int) -> 'ScheduledApiSession':
+        return ScheduledApiSession(self.api_session, self.scheduler,
+                                   bucket_key=self.bucket_key,
+                                   priority=priority,
+                                   method=self.method)
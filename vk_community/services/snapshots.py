@@ -0,0 +1,292 @@
+import csv
+import gzip
+import io
+import zipfile
+from collections import OrderedDict
+from datetime import date, datetime
+from itertools import groupby
+from typing import Any, Dict, Iterable, Iterator, List
+
+import numpy as np
+from sqlalchemy import inspect, Table
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import select
+
+from vk_community.models import Photo
+from vk_community.services.data_access import DataAccessObject
+
+SNAPSHOT_CHUNK_SIZE = 10000
+# marks NULL values in CSV files, like MySQL does
+CSV_NULL = r'\N'
+NUMPY_DTYPES_BY_TYPES = {int: np.int64,
+                         float: np.float64,
+                         bool: np.bool_,
+                         date: 'datetime64[D]',
+                         datetime: 'datetime64[us]'}
+FILLERS_BY_TYPES = {int: 0,
+                    float: float('nan'),
+                    bool: False,
+                    str: ''}
+
+# chunk of table is stored by columns: column name -> column values
+Chunk = Dict[str, List[Any]]
+
+
+def export_photos(dao: DataAccessObject, file_path: str,
+                  chunk_size: int = SNAPSHOT_CHUNK_SIZE) -> int:
+    """Writes photos table to columnar file
+
+    Table is streamed in chunks, so memory usage is bounded by chunk size.
+    Format is selected by file extension: ".npz" (numpy),
+    ".parquet" (requires `pyarrow`), ".csv.gz" or ".csv".
+
+    :returns: number of written photos
+    """
+    write_chunks = get_snapshot_format(file_path)[0]
+    table = Photo.__table__
+    rows_count = 0
+
+    def read_chunks() -> Iterator[Chunk]:
+        nonlocal rows_count
+        query = (select([table])
+                 .order_by(*table.primary_key.columns)
+                 .execution_options(stream_results=True))
+        result = dao.engine.execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                rows_count += len(rows)
+                yield OrderedDict(zip([column.name for column in table.columns],
+                                      map(list, zip(*rows))))
+        finally:
+            result.close()
+
+    write_chunks(file_path, table, read_chunks())
+    return rows_count
+
+
+def import_photos(dao: DataAccessObject, file_path: str) -> int:
+    """Restores photos table from columnar file written by `export_photos`
+
+    Rows are inserted in chunks by bulk "INSERT" statements,
+    so table should not contain photos with same ids.
+    If photos table doesn't exist, it's created with primary key only
+    and other indexes are built after inserting of all rows.
+
+    :returns: number of inserted photos
+    """
+    read_chunks = get_snapshot_format(file_path)[1]
+    table = Photo.__table__
+    if table.name not in inspect(dao.engine).get_table_names():
+        indexes = set(table.indexes)
+        # creating table in SQLAlchemy creates its indexes as well
+        table.indexes.clear()
+        try:
+            table.create(bind=dao.engine)
+        finally:
+            table.indexes.update(indexes)
+    rows_count = 0
+    with dao.engine.begin() as connection:
+        for chunk in read_chunks(file_path, table):
+            insert_chunk(connection, table, chunk)
+            rows_count += len(next(iter(chunk.values()), []))
+    dao.migrate()
+    return rows_count
+
+
+def insert_chunk(connection: Connection, table: Table, chunk: Chunk):
+    """Inserts chunk rows by DB-API "executemany"
+
+    Values are converted to database types column by column
+    instead of building of parameters dictionary for every row.
+    """
+    dialect = connection.dialect
+    statement = table.insert().compile(dialect=dialect, column_keys=list(chunk))
+    columns_values = dict()
+    for column_name, values in chunk.items():
+        bind_processor = table.c[column_name].type.bind_processor(dialect)
+        if bind_processor is not None:
+            values = list(map(bind_processor, values))
+        columns_values[column_name] = values
+    if statement.positional:
+        parameters = list(zip(*(columns_values[column_name]
+                                for column_name in statement.positiontup)))
+    else:
+        parameters = [dict(zip(columns_values.keys(), row_values))
+                      for row_values in zip(*columns_values.values())]
+    cursor = connection.connection.cursor()
+    try:
+        cursor.executemany(str(statement), parameters)
+    finally:
+        cursor.close()
+
+
+def get_snapshot_format(file_path: str):
+    """Returns writer and reader of snapshot file by its extension"""
+    if file_path.endswith('.npz'):
+        return write_npz, read_npz
+    elif file_path.endswith('.parquet'):
+        return write_parquet, read_parquet
+    elif file_path.endswith(('.csv', '.csv.gz')):
+        return write_csv, read_csv
+    err_description = ('Unknown snapshot format of file: {file_path}\n'
+                       'Allowable extensions: ".npz", ".parquet", ".csv.gz", ".csv".'
+                       .format(file_path=file_path))
+    raise ValueError(err_description)
+
+
+def write_npz(file_path: str, table: Table, chunks: Iterable[Chunk]):
+    """Writes every chunk column as separate array
+
+    Fixed-width unicode arrays take 4 bytes per character of the longest value
+    for every value, so strings are stored in variable-length layout instead:
+    array of concatenated UTF-8 bytes of values
+    and additional array of offsets of values bounds.
+    NULL values are marked by additional boolean mask arrays.
+    """
+    with zipfile.ZipFile(file_path, mode='w', compression=zipfile.ZIP_DEFLATED) as file:
+        for chunk_ind, chunk in enumerate(chunks):
+            for column in table.columns:
+                values = chunk[column.name]
+                mask = np.array([value is None for value in values], dtype=np.bool_)
+                python_type = column.type.python_type
+                if mask.any():
+                    filler = FILLERS_BY_TYPES.get(python_type)
+                    values = [filler if value is None else value for value in values]
+                array_name = '{chunk}/{column}'.format(chunk=chunk_ind, column=column.name)
+                if python_type in NUMPY_DTYPES_BY_TYPES:
+                    array = np.array(values, dtype=NUMPY_DTYPES_BY_TYPES[python_type])
+                else:
+                    encoded_values = [value.encode('utf-8') for value in values]
+                    array = np.frombuffer(b''.join(encoded_values), dtype=np.uint8)
+                    offsets = np.cumsum([0] + list(map(len, encoded_values)), dtype=np.int64)
+                    write_npy(file, array_name + '.offsets', offsets)
+                write_npy(file, array_name, array)
+                if mask.any():
+                    write_npy(file, array_name + '.mask', mask)
+
+
+def write_npy(file: zipfile.ZipFile, array_name: str, array: np.ndarray):
+    array_bytes = io.BytesIO()
+    np.lib.format.write_array(array_bytes, array, allow_pickle=False)
+    file.writestr(array_name + '.npy', array_bytes.getvalue())
+
+
+def read_npz(file_path: str, table: Table) -> Iterator[Chunk]:
+    with np.load(file_path, allow_pickle=False) as arrays:
+        # arrays are loaded lazily by names
+        arrays_names = sorted(arrays.files,
+                              key=lambda array_name: int(array_name.split('/')[0]))
+        for chunk_ind, chunk_arrays_names in groupby(
+                arrays_names, key=lambda array_name: array_name.split('/')[0]):
+            chunk_arrays_names = set(chunk_arrays_names)
+            chunk = OrderedDict()
+            for column in table.columns:
+                array_name = '{chunk}/{column}'.format(chunk=chunk_ind, column=column.name)
+                array = arrays[array_name]
+                offsets_name = array_name + '.offsets'
+                if offsets_name in chunk_arrays_names:
+                    data = array.tobytes()
+                    offsets = arrays[offsets_name].tolist()
+                    values = [data[start:end].decode('utf-8')
+                              for start, end in zip(offsets, offsets[1:])]
+                else:
+                    if column.type.python_type in {date, datetime}:
+                        array = array.astype(column.type.python_type)
+                    values = array.tolist()
+                mask_name = array_name + '.mask'
+                if mask_name in chunk_arrays_names:
+                    values = [None if is_null else value
+                              for value, is_null in zip(values, arrays[mask_name].tolist())]
+                chunk[column.name] = values
+            yield chunk
+
+
+def write_parquet(file_path: str, table: Table, chunks: Iterable[Chunk]):
+    import pyarrow
+    import pyarrow.parquet
+    arrow_types_by_types = {int: pyarrow.int64(),
+                            float: pyarrow.float64(),
+                            bool: pyarrow.bool_(),
+                            date: pyarrow.date32(),
+                            datetime: pyarrow.timestamp('us')}
+    # schema is set explicitly since it can't be inferred
+    # from chunk with NULL values only
+    schema = pyarrow.schema([
+        pyarrow.field(column.name,
+                      arrow_types_by_types.get(column.type.python_type, pyarrow.string()))
+        for column in table.columns])
+    with pyarrow.parquet.ParquetWriter(file_path, schema) as writer:
+        for chunk in chunks:
+            # every chunk becomes row group
+            writer.write_table(pyarrow.Table.from_pydict(chunk, schema=schema))
+
+
+def read_parquet(file_path: str, table: Table) -> Iterator[Chunk]:
+    import pyarrow.parquet
+    file = pyarrow.parquet.ParquetFile(file_path)
+    columns_names = [column.name for column in table.columns]
+    for row_group_ind in range(file.num_row_groups):
+        columns_values = file.read_row_group(row_group_ind, columns=columns_names).to_pydict()
+        yield OrderedDict((column_name, columns_values[column_name])
+                          for column_name in columns_names)
+
+
+def write_csv(file_path: str, table: Table, chunks: Iterable[Chunk]):
+    with open_csv(file_path, mode='wt') as file:
+        writer = csv.writer(file)
+        writer.writerow([column.name for column in table.columns])
+        for chunk in chunks:
+            writer.writerows(zip(*([format_csv_value(value) for value in chunk[column.name]]
+                                   for column in table.columns)))
+
+
+def read_csv(file_path: str, table: Table,
+             chunk_size: int = SNAPSHOT_CHUNK_SIZE) -> Iterator[Chunk]:
+    parsers_by_columns_names = {column.name: get_csv_parser(column.type.python_type)
+                                for column in table.columns}
+    with open_csv(file_path, mode='rt') as file:
+        reader = csv.reader(file)
+        columns_names = next(reader)
+        parsers = [parsers_by_columns_names[column_name] for column_name in columns_names]
+        rows = list()
+        for row_values in reader:
+            rows.append([None if value == CSV_NULL else parser(value)
+                         for parser, value in zip(parsers, row_values)])
+            if len(rows) == chunk_size:
+                yield OrderedDict(zip(columns_names, map(list, zip(*rows))))
+                rows = list()
+        if rows:
+            yield OrderedDict(zip(columns_names, map(list, zip(*rows))))
+
+
+def open_csv(file_path: str, mode: str):
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode=mode, encoding='utf-8', newline='')
+    return open(file_path, mode=mode, encoding='utf-8', newline='')
+
+
+def format_csv_value(value: Any) -> Any:
+    if value is None:
+        return CSV_NULL
+    elif isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def get_csv_parser(python_type: type):
+    if python_type is bool:
+        return lambda value: bool(int(value))
+    elif python_type is datetime:
+        return parse_datetime
+    elif python_type is date:
+        return lambda value: datetime.strptime(value, '%Y-%m-%d').date()
+    return python_type
+
+
+def parse_datetime(value: str) -> datetime:
+    # `str` of `datetime` omits microseconds if they equal 0
+    datetime_format = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+    return datetime.strptime(value, datetime_format)
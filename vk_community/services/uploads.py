@@ -0,0 +1,123 @@
+import os
+import uuid
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import requests
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# seconds for connecting and for waiting of response
+TIMEOUT = (5, 120)
+
+# triplet of multipart field name, name of file and path of file to send
+UploadFile = Tuple[str, str, str]
+
+
+class MultipartStream:
+    """Body of "multipart/form-data" request read from files by chunks
+
+    Files are opened one at a time when their parts are reached,
+    so memory used by request doesn't depend on sizes of files.
+    Length of body is known beforehand,
+    so request is sent with "Content-Length" header rather than chunked.
+    """
+
+    def __init__(self, files: List[UploadFile], chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        # headers and boundaries are kept as bytes, files contents as paths
+        self.parts = list()  # type: List[Union[bytes, str]]
+        for field_name, file_name, file_path in files:
+            headers = ('--{boundary}\r\n'
+                       'Content-Disposition: form-data; name="{field_name}"; '
+                       'filename="{file_name}"\r\n'
+                       'Content-Type: application/octet-stream\r\n\r\n'
+                       .format(boundary=self.boundary,
+                               field_name=field_name,
+                               file_name=file_name))
+            self.parts += [headers.encode('utf-8'), file_path, b'\r\n']
+        self.parts.append('--{boundary}--\r\n'.format(boundary=self.boundary)
+                          .encode('utf-8'))
+        self.length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part)
+                          for part in self.parts)
+        self.chunks = self.iter_chunks()
+        # current chunk and position of its unread part
+        self.chunk = b''
+        self.offset = 0
+
+    @property
+    def content_type(self) -> str:
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            with open(part, mode='rb') as file:
+                while True:
+                    chunk = file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def read(self, size: int = -1) -> bytes:
+        """Returns next `size` bytes of body or its rest if `size` is negative"""
+        pieces = list()
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self.offset == len(self.chunk):
+                self.chunk = next(self.chunks, b'')
+                self.offset = 0
+                if not self.chunk:
+                    break
+            end = len(self.chunk) if size < 0 else self.offset + remaining
+            piece = self.chunk[self.offset:end]
+            self.offset += len(piece)
+            remaining -= len(piece)
+            pieces.append(piece)
+        return b''.join(pieces)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def __len__(self) -> int:
+        return self.length
+
+
+def get_upload_files(files: List[Tuple[str, str]]) -> List[UploadFile]:
+    """Returns files to upload given by pairs of name and path of file
+
+    VK upload servers expect files in "file1", ..., "fileN" fields,
+    single file is sent in "file" field.
+    """
+    if len(files) == 1:
+        return [('file', file_name, file_path) for file_name, file_path in files]
+    return [('file{}'.format(ind), file_name, file_path)
+            for ind, (file_name, file_path) in enumerate(files, start=1)]
+
+
+def upload_files(upload_url: str, files: List[UploadFile],
+                 session: requests.Session = None,
+                 timeout: Tuple[float, float] = TIMEOUT) -> Dict[str, Any]:
+    """Sends files on upload server streaming them from disk
+
+    :returns: response of upload server
+    to pass to method saving uploaded files
+    """
+    stream = MultipartStream(files)
+    response = (session or requests).post(upload_url, data=stream, timeout=timeout,
+                                          headers={'Content-Type': stream.content_type})
+    try:
+        response.raise_for_status()
+        upload_response = response.json()
+    finally:
+        response.close()
+    if 'error' in upload_response:
+        err_description = ('Failed to upload files on "{url}": {error}'
+                           .format(url=upload_url, error=upload_response['error']))
+        raise RuntimeError(err_description)
+    return upload_response